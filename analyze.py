@@ -1,29 +1,194 @@
 # analyze.py: Enhanced performance analysis
-import time
+"""
+Benchmark harness for candidate functions.
+
+Each test case runs in its own worker process (up to max_workers at a time)
+with a wall-clock timeout, so a candidate that loops forever or
+crashes only takes down its worker. Within a worker the case is warmed up,
+then timed over several repeats with perf_counter_ns, and one extra run
+under tracemalloc records peak memory. Results are per-case pass/fail plus
+p50/p95/p99 latency over all samples.
+
+Workers are never plain forks of the caller: the threaded server holds
+SQLite connections and locks (cache store, proposal queue, log writer)
+that a forked child would inherit mid-use. They come from a forkserver, a
+clean single-threaded process, or are spawned where that is unavailable.
+"""
+
 import ast  # For syntax checking
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import time
+import tracemalloc
 from logger import log_change
 
-def analyze_performance(func, test_cases):
-    """Run tests and measure time/accuracy."""
-    results = []
+DEFAULT_REPEAT = 5
+DEFAULT_WARMUP = 1
+DEFAULT_TIMEOUT = 5.0  # seconds per case (warmup + repeats + memory run)
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list (q in 0..100)."""
+    if not sorted_values:
+        return float('inf')
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def measure_case(func, case, expected, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP):
+    """Run one case in this process: warmup, timed repeats, then a tracemalloc run."""
     try:
-        for case, expected in test_cases:
-            start = time.time()
+        for _ in range(warmup):
+            func(case)
+        samples = []
+        result = None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter_ns()
             result = func(case)
-            end = time.time()
-            accuracy = 1 if result == expected else 0
-            results.append({"time": end - start, "accuracy": accuracy})
-        avg_time = sum(r["time"] for r in results) / len(results)
-        avg_acc = sum(r["accuracy"] for r in results) / len(results)
-        return {"avg_time": avg_time, "avg_acc": avg_acc}
+            samples.append(time.perf_counter_ns() - start)
+
+        tracemalloc.start()
+        try:
+            func(case)
+            _, mem_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'case': case,
+            'passed': result == expected,
+            'samples_ns': samples,
+            'mem_peak': mem_peak,
+            'error': None,
+            'timed_out': False,
+        }
     except Exception as e:
-        log_change("Analysis error", str(e))
-        return {"avg_time": float('inf'), "avg_acc": 0}
+        return failed_case(case, f"{type(e).__name__}: {e}")
+
+def failed_case(case, error, timed_out=False):
+    return {'case': case, 'passed': False, 'samples_ns': [], 'mem_peak': 0, 'error': error, 'timed_out': timed_out}
+
+def _case_worker(conn, func, case, expected, repeat, warmup):
+    try:
+        report = measure_case(func, case, expected, repeat, warmup)
+        conn.send(report)
+    except Exception as e:  # e.g. unpicklable case
+        conn.send(failed_case(case, f"Worker error: {e}"))
+    finally:
+        conn.close()
+
+def worker_context():
+    """multiprocessing context for isolated workers: forkserver if available, else spawn."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(['analyze'])  # Workers fork with the harness already imported
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+def _picklable(obj):
+    try:
+        pickle.dumps(obj)
+        return True
+    except Exception:
+        return False
+
+def analyze_performance(func, test_cases, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP,
+                        timeout=DEFAULT_TIMEOUT, max_workers=None, isolate=True):
+    """
+    Run tests and measure time/accuracy.
+
+    Returns a dict with avg_time/avg_acc (as before) plus p50/p95/p99 latency
+    in seconds, mem_peak in bytes, counts of failures/timeouts, and 'cases'
+    with the per-case reports.
+    """
+    test_cases = list(test_cases)
+    if not test_cases:
+        return summarize([])
+    try:
+        if isolate and not _picklable(func):
+            # Workers import func by reference, so lambdas and closures can't be sent
+            log_change("Analysis not isolated", f"{func!r} is not picklable; running in-process", level='WARNING')
+            isolate = False
+        if not isolate:
+            reports = [measure_case(func, case, expected, repeat, warmup) for case, expected in test_cases]
+        else:
+            reports = _run_isolated(worker_context(), func, test_cases, repeat, warmup, timeout,
+                                    max_workers or min(len(test_cases), os.cpu_count() or 1))
+        return summarize(reports)
+    except Exception as e:
+        log_change("Analysis error", str(e), level='ERROR')
+        return {"avg_time": float('inf'), "avg_acc": 0, "p50": float('inf'), "p95": float('inf'),
+                "p99": float('inf'), "mem_peak": 0, "failures": len(test_cases), "timeouts": 0, "cases": []}
+
+def _run_isolated(ctx, func, test_cases, repeat, warmup, timeout, max_workers):
+    """Start one worker per case, at most max_workers at once, killing any past its timeout."""
+    reports = [None] * len(test_cases)
+    queue = list(enumerate(test_cases))
+    running = {}  # index -> (process, conn, deadline)
+
+    while queue or running:
+        while queue and len(running) < max_workers:
+            i, (case, expected) = queue.pop(0)
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_case_worker, args=(child_conn, func, case, expected, repeat, warmup), daemon=True)
+            try:
+                proc.start()
+            except Exception as e:  # e.g. an unpicklable case or expected value
+                reports[i] = failed_case(case, f"Worker error: {e}")
+                parent_conn.close()
+                continue
+            finally:
+                child_conn.close()
+            running[i] = (proc, parent_conn, time.monotonic() + timeout)
+
+        ready = multiprocessing.connection.wait([conn for _, conn, _ in running.values()], timeout=0.05)
+        now = time.monotonic()
+        for i, (proc, conn, deadline) in list(running.items()):
+            case = test_cases[i][0]
+            if conn in ready:
+                try:
+                    reports[i] = conn.recv()
+                except EOFError:
+                    proc.join(1)
+                    reports[i] = failed_case(case, f"Worker exited with code {proc.exitcode}")
+            elif now >= deadline:
+                proc.kill()
+                reports[i] = failed_case(case, f"Timed out after {timeout}s", timed_out=True)
+            elif not proc.is_alive() and not conn.poll():
+                proc.join(1)
+                reports[i] = failed_case(case, f"Worker exited with code {proc.exitcode}")
+            else:
+                continue
+            proc.join(1)
+            conn.close()
+            del running[i]
+    return reports
+
+def summarize(reports):
+    samples = sorted(s for r in reports for s in r['samples_ns'])
+    to_s = lambda ns: ns / 1e9 if ns != float('inf') else ns
+    total = len(reports)
+    return {
+        "avg_time": to_s(sum(samples) / len(samples)) if samples else float('inf'),
+        "avg_acc": sum(1 for r in reports if r['passed']) / total if total else 0,
+        "p50": to_s(percentile(samples, 50)),
+        "p95": to_s(percentile(samples, 95)),
+        "p99": to_s(percentile(samples, 99)),
+        "mem_peak": max((r['mem_peak'] for r in reports), default=0),
+        "failures": sum(1 for r in reports if not r['passed']),
+        "timeouts": sum(1 for r in reports if r['timed_out']),
+        "cases": [{k: v for k, v in r.items() if k != 'case'} | {'case': repr(r['case'])} for r in reports],
+    }
 
 def detect_fail_state(perf_metrics, generated_code, threshold_acc=0.8, threshold_time=1.0, min_code_len=50):
     """Check performance and code quality."""
     try:
-        if perf_metrics['avg_acc'] < threshold_acc or perf_metrics['avg_time'] > threshold_time:
+        if perf_metrics['avg_acc'] < threshold_acc:
+            return True
+        # Judge latency on the tail, not the mean: one pathological case should fail the patch
+        if perf_metrics.get('p95', perf_metrics['avg_time']) > threshold_time:
+            return True
+        if perf_metrics.get('timeouts', 0) > 0:
             return True
         if len(generated_code) < min_code_len:
             return True  # Too short, likely failure
@@ -38,4 +203,5 @@ if __name__ == "__main__":
     from core import process_query
     tests = [("hello", "Hello! How can I help?"), ("sort 3 1 2", [1, 2, 3])]
     metrics = analyze_performance(process_query, tests)
-    print(detect_fail_state(metrics, "def func(): pass", min_code_len=10))
\ No newline at end of file
+    print({k: v for k, v in metrics.items() if k != 'cases'})
+    print(detect_fail_state(metrics, "def func(): pass", min_code_len=10))
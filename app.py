@@ -1,119 +1,436 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Blueprint, render_template, request, jsonify, session, Response, stream_with_context, g
+from flask.sessions import SecureCookieSessionInterface
 import threading
+import hmac
 import os
 import time
-from monitor import monitor_resources, get_alerts
-from reflect import reflect_and_expand, PENDING_PATCH, PENDING_PATCH_QUERY, process_patch_decision, PENDING_PATCH_TESTS, PENDING_PATCH_TARGET, CONTINUOUS_GOAL # Import the continuous goal for display
-from core import process_query
+import json
+import sys
+import uuid
+from monitor import start_monitor, get_alerts, publish_alert
+from metrics import exposition, REQUEST_LATENCY, REQUESTS
+from hotswap import process_query, process_query_async, process_query_stream, rule_stats, active_core, get_registry
+from history_store import get_history_store
 from logger import log_change
+from events import get_event_bus, HEARTBEAT
+from tracing import TracingMiddleware, span, tag, recent_traces, profile, collapsed_stacks, PROFILE_MAX_SECONDS
+# Self-modification (reflect -> proposals -> modify -> llm_query -> requests), the LLM
+# client, batching and the benchmark are imported inside the views that use them,
+# so starting a worker doesn't pay for subsystems it may never touch
 # Removed: from phase import advance_phase, get_current_phase, PHASES
-from core import process_query
 
-app = Flask(__name__)
-app.secret_key = 'self_improving_ai_secret' 
+HISTORY_PAGE = 20  # Turns returned by /history and /chat
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')  # Sent as X-Debug-Token to use /debug/* and /core/rollback
+DEBUG_ENDPOINTS = os.environ.get('DEBUG_ENDPOINTS') == '1'  # Without a token: open them to loopback (local dev only)
 
-# Start quiet monitoring in background
-threading.Thread(target=lambda: monitor_resources(quiet=True), daemon=True).start()
+web = Blueprint('web', __name__)
+
+class TracedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions with loading and saving timed as trace spans."""
+
+    def open_session(self, app, request):
+        with span('session.open'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with span('session.save'):
+            return super().save_session(app, session, response)
+
+def create_app(config=None, start_background=True):
+    """
+    Build the Flask app. Importing this module has no side effects; the
+    background resource monitor starts here (unless start_background is False).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', 'self_improving_ai_secret')
+    if config:
+        app.config.update(config)
+    app.register_blueprint(web)
+    app.session_interface = TracedSessionInterface()
+    # Every request runs in a trace (X-Trace-Id in the response); see /debug/traces
+    app.wsgi_app = TracingMiddleware(app.wsgi_app)
+    if start_background:
+        # Start quiet monitoring in background
+        start_monitor(quiet=True)
+    return app
+
+_app = None
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # `app.app` (gunicorn app:app, older scripts) builds the default app on first access
+    global _app
+    if name == 'app':
+        if _app is None:
+            with _app_lock:
+                if _app is None:
+                    _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@web.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    tag(endpoint=request.endpoint)
+
+@web.after_app_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+def session_id():
+    """Id of this browser's history in the server-side store (the only thing in the cookie)."""
+    sid = session.get('sid')
+    if sid is None:
+        sid = session['sid'] = uuid.uuid4().hex
+    return sid
+
+def recent_history(sid, n=HISTORY_PAGE):
+    return [{'user': u, 'ai': a} for u, a in get_history_store().recent(sid, n)]
 
 def handle_query(user_input):
     """Wrapper for process_query with history management."""
-    history = session.get('conversation_history', [])
+    sid = session_id()
+
+    response = handle_command(user_input)
+    if response is None:
+        response = process_query(user_input, get_history_store().recent(sid, active_core().CONTEXT_TURNS))
+
+    return record_turn(sid, user_input, response)
 
-    response = ""
+async def handle_query_async(user_input):
+    """Async wrapper: the LLM fallback is awaited instead of blocking the worker."""
+    sid = session_id()
 
+    response = handle_command(user_input)
+    if response is None:
+        response = await process_query_async(user_input, get_history_store().recent(sid, active_core().CONTEXT_TURNS))
+
+    return record_turn(sid, user_input, response)
+
+def handle_command(user_input):
+    """Built-in commands ('reflect', 'advance'); returns None for regular queries."""
     if user_input.lower() == 'reflect':
         # Removed hard-coded tests specific to old phases. Use general tests.
         tests = [("hello", "Hello! How can I help?"), ("sort 5 3 1", [1, 3, 5]), ("add 2 3", 5)]
         log_change("Reflection triggered by web user")
 
         # Start reflection in a background thread to prevent blocking the web request
+        from reflect import reflect_and_expand
         threading.Thread(target=lambda: reflect_and_expand(tests), daemon=True).start()
 
-        response = "Reflection process initiated. Check the 'Patch Proposal' area for results soon."
+        return "Reflection process initiated. Check the 'Patch Proposal' area for results soon."
 
-    elif user_input.lower() == 'advance':
+    if user_input.lower() == 'advance':
         # Removed phase advancement logic as the system is now continuous.
-        response = "The 'advance' command is deprecated. The AI now works continuously towards general intelligence. Use 'reflect' to generate a new idea."
+        return "The 'advance' command is deprecated. The AI now works continuously towards general intelligence. Use 'reflect' to generate a new idea."
 
-    else:
-        response = process_query(user_input, history)
+    return None
 
+def record_turn(sid, user_input, response):
+    """Append the turn to the session history and attach pending alerts."""
     # Record the interaction in history
-    history.append((user_input, response))
-    session['conversation_history'] = history
+    get_history_store().append(sid, user_input, response)
 
     # Append Alerts (if any)
-    alerts = get_alerts()
+    alerts = get_alerts(sid)
     if alerts:
-        response += f"\n\n[System Alert]: {'; '.join(alerts)}"
+        response = f"{response}\n\n[System Alert]: {'; '.join(alerts)}"
 
     return response
 
-@app.route('/')
+@web.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/history', methods=['GET'])
-def get_history():
+@web.route('/history', methods=['GET'])
+async def get_history():
     """Returns the current conversation history from the session."""
-    # Only return the most recent 20 entries for performance
-    recent_history = session.get('conversation_history', [])[-20:]
-    return jsonify({
-        'history': [{'user': u, 'ai': a} for u, a in recent_history]
-    })
+    # Only the most recent entries are read from the ring buffer
+    return jsonify({'history': recent_history(session_id())})
 
-@app.route('/chat', methods=['POST'])
-def chat():
+@web.route('/chat', methods=['POST'])
+async def chat():
     user_input = request.json.get('message', '').strip()
     if not user_input:
         return jsonify({'error': 'Empty message'})
 
-    response = handle_query(user_input)
-    recent_history = session.get('conversation_history', [])[-20:]
+    response = await handle_query_async(user_input)
 
     return jsonify({
         'response': response,
-        'history': [{'user': u, 'ai': a} for u, a in recent_history]
+        'history': recent_history(session_id())
     })
 
-@app.route('/alerts', methods=['GET'])
+MAX_BATCH_QUERIES = 1000
+MAX_BATCH_WORKERS = 16  # Upper bound on the LLM threads one batch request may use
+
+def valid_history(history):
+    """A history is a list of [user, ai] pairs."""
+    return isinstance(history, list) and all(isinstance(turn, (list, tuple)) and len(turn) == 2 for turn in history)
+
+@web.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answers a list of queries in one call (for replaying query logs)."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    queries = body.get('queries') or []
+    histories = body.get('histories')
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({'error': "'queries' must be a list of strings"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per batch'}), 400
+    if histories is not None and (not isinstance(histories, list) or len(histories) != len(queries)
+                                  or not all(valid_history(h) for h in histories)):
+        return jsonify({'error': "'histories' must be a list of [user, ai] pair lists, one per query"}), 400
+
+    try:
+        max_workers = min(max(1, int(body.get('max_workers', 8))), MAX_BATCH_WORKERS)
+    except (TypeError, ValueError):
+        return jsonify({'error': "'max_workers' must be an integer"}), 400
+
+    from batch import process_many
+    try:
+        return jsonify(process_many(queries, histories, max_workers=max_workers))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def sse_event(data, event=None, event_id=None):
+    """Format one Server-Sent Events frame."""
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    frame += f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@web.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streams the response as Server-Sent Events, token by token."""
+    user_input = request.json.get('message', '').strip()
+    if not user_input:
+        return jsonify({'error': 'Empty message'})
+
+    sid = session_id()
+    history = get_history_store().recent(sid, active_core().CONTEXT_TURNS)
+    command_response = handle_command(user_input)
+
+    def generate():
+        if command_response is not None:
+            chunks = [command_response]
+        else:
+            chunks = process_query_stream(user_input, history)
+
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield sse_event({'token': chunk if isinstance(chunk, str) else json.dumps(chunk)})
+
+        # Rule results (lists, ints) arrive as a single chunk; keep their type
+        response = parts[0] if len(parts) == 1 else "".join(str(p) for p in parts)
+        # History lives server-side, so the turn can be recorded after the headers went out
+        response = record_turn(sid, user_input, response)
+        yield sse_event({'response': response}, event='done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@web.route('/alerts', methods=['GET'])
 def alerts():
-    return jsonify({'alerts': get_alerts()})
+    return jsonify({'alerts': get_alerts(session_id())})
+
+MAX_EVENT_STREAMS = 32  # Open /events streams per process; each holds a worker thread while open
+
+_streams = 0
+_streams_lock = threading.Lock()
+
+def _release_stream():
+    global _streams
+    with _streams_lock:
+        _streams -= 1
+
+@web.route('/events', methods=['GET'])
+def events():
+    """
+    Pushes alerts and proposal changes as Server-Sent Events.
+
+    Each connection reads the event bus from its own cursor, so every open
+    tab gets every event. Each frame carries its id; a reconnecting
+    EventSource sends it back as Last-Event-ID and the stream resumes after
+    it. A 'reset' event means events were missed and the client should
+    refetch current state.
+
+    Under a threaded server each open stream holds one worker thread, so at
+    most MAX_EVENT_STREAMS are served per process; beyond that the client is
+    told to retry later (503).
+    """
+    global _streams
+    with _streams_lock:
+        if _streams >= MAX_EVENT_STREAMS:
+            return jsonify({'error': 'Too many event streams'}), 503, {'Retry-After': '30'}
+        _streams += 1
+    try:
+        response = _event_stream()
+    except BaseException:
+        _release_stream()  # No response exists to give the slot back when it closes
+        raise
+    response.call_on_close(_release_stream)
+    return response
 
-@app.route('/status', methods=['GET'])
+def _event_stream():
+    """The /events streaming response for this request's session and cursor."""
+    sid = session_id()
+    bus = get_event_bus()
+    header = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_id = int(header) if header is not None else bus.last_id
+    except ValueError:
+        last_id = bus.last_id
+
+    def generate():
+        nonlocal last_id
+        # Tell a fresh client where it starts, and how long to wait before reconnecting
+        yield "retry: 3000\n" + sse_event({'last_id': last_id}, event='hello', event_id=last_id)
+        while True:
+            batch, missed = bus.listen(last_id, HEARTBEAT)
+            if missed:
+                last_id = bus.last_id
+                yield sse_event({'last_id': last_id}, event='reset', event_id=last_id)
+                continue
+            if not batch:
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, _, event_type, data in batch:
+                last_id = event_id
+                if event_type == 'alert':
+                    yield sse_event({'alerts': [data['message']]}, event='alert', event_id=event_id)
+                    # Shown in this session's tabs already; don't repeat it in the next chat reply
+                    get_alerts(sid)
+                else:
+                    yield sse_event(data, event=event_type, event_id=event_id)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@web.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of request, cache, LLM and process metrics."""
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+@web.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Returns LLM cache counters (hits, misses, evictions, bytes)."""
+    from llm_query import cache_stats
+    return jsonify(cache_stats())
+
+@web.route('/context/stats', methods=['GET'])
+def get_context_stats():
+    """Returns prompt token usage per call kind (chat, code) against the budgets."""
+    from context import usage_stats
+    return jsonify(usage_stats())
+
+@web.route('/rules/stats', methods=['GET'])
+def get_rule_stats():
+    """Returns per-rule hit counters from the query dispatcher."""
+    return jsonify({'rules': rule_stats()})
+
+@web.route('/status', methods=['GET'])
 def get_status():
     """Returns the continuous goal status."""
+    from phase import CONTINUOUS_GOAL
     return jsonify({'goal': CONTINUOUS_GOAL})
 
+def operator_allowed():
+    """
+    Debug and core-management endpoints are off unless DEBUG_TOKEN is set and
+    sent as X-Debug-Token. DEBUG_ENDPOINTS=1 opens them to loopback clients
+    instead, for local development: behind a reverse proxy every client
+    looks like loopback, so the address alone is never enough.
+    """
+    if DEBUG_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Debug-Token', ''), DEBUG_TOKEN)
+    return DEBUG_ENDPOINTS and request.remote_addr in ('127.0.0.1', '::1')
+
+@web.route('/core/versions', methods=['GET'])
+def core_versions():
+    """Returns the live core version and the versions kept for rollback."""
+    return jsonify(get_registry().stats())
+
+@web.route('/core/rollback', methods=['POST'])
+def core_rollback():
+    """Restores the files of the previous snapshot and swaps core back to it without a restart."""
+    if not operator_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    from modify import rollback
+    try:
+        return jsonify({'active': rollback()})
+    except (RuntimeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 409
+
+@web.route('/debug/traces', methods=['GET'])
+def debug_traces():
+    """Recent request traces with their spans, newest first (?n=, ?min_ms=, ?trace_id=)."""
+    if not operator_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        n = int(request.args.get('n', 50))
+        min_ms = float(request.args.get('min_ms', 0))
+    except ValueError:
+        return jsonify({'error': "'n' and 'min_ms' must be numbers"}), 400
+    return jsonify({'traces': recent_traces(n, min_ms, request.args.get('trace_id'))})
+
+@web.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Samples all threads for ?seconds= (default 5) and returns collapsed stacks for flame graphs."""
+    if not operator_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        seconds = float(request.args.get('seconds', 5))
+    except ValueError:
+        return jsonify({'error': "'seconds' must be a number"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({'error': f"'seconds' must be in (0, {PROFILE_MAX_SECONDS:g}]"}), 400
+    try:
+        counts, rounds = profile(seconds)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    log_change("Profile captured", f"{seconds:g}s, {rounds} rounds, {len(counts)} stacks")
+    return Response(collapsed_stacks(counts), mimetype='text/plain',
+                    headers={'X-Profile-Rounds': str(rounds)})
+
+@web.route('/patch/proposal', methods=['GET'])
+@web.route('/patch/proposal/<int:proposal_id>', methods=['GET'])
+async def patch_proposal(proposal_id=None):
+    """Open patch proposals, or one in detail with its diff and benchmark (changes arrive on /events)."""
+    from reflect import proposal_state
+    if proposal_id is not None:
+        proposal = proposal_state(proposal_id)
+        return jsonify(proposal), 404 if proposal['status'] == 'unknown' else 200
+    # Only modules that ran a benchmark have a report; don't import benchmark just to say so
+    benchmark = sys.modules.get('benchmark')
+    return jsonify(dict(proposal_state(), benchmark=benchmark.last_report() if benchmark else None))
 
-@app.route('/patch/proposal', methods=['GET'])
-def patch_proposal():
-    """Polls for a pending patch proposal."""
-    with PENDING_PATCH:
-        if PENDING_PATCH_QUERY:
-            return jsonify({
-                'status': 'pending',
-                'query': PENDING_PATCH_QUERY,
-                'target': PENDING_PATCH_TARGET,
-                'tests_count': len(PENDING_PATCH_TESTS) if PENDING_PATCH_TESTS else 0
-            })
-        return jsonify({'status': 'none'})
-
-@app.route('/patch/decide', methods=['POST'])
-def patch_decide():
-    """Accepts the user's decision (approve/reject)."""
+@web.route('/patch/decide', methods=['POST'])
+async def patch_decide():
+    """Accepts the user's decision (approve/reject) on proposal 'id' (default: the top one)."""
     decision = request.json.get('decision', '').lower()
+    proposal_id = request.json.get('id')
+    if proposal_id is not None and not isinstance(proposal_id, int):
+        return jsonify({'error': "'id' must be an integer"}), 400
 
     def run_decision(decision):
-        result = process_patch_decision(decision)
-        get_alerts().append(result)
+        from reflect import process_patch_decision
+        result = process_patch_decision(decision, proposal_id)
+        publish_alert(result)
 
     threading.Thread(target=lambda: run_decision(decision), daemon=True).start()
 
-    return jsonify({'message': f'Decision "{decision}" is being processed in the background.'})
+    target = f" on #{proposal_id}" if proposal_id is not None else ""
+    return jsonify({'message': f'Decision "{decision}"{target} is being processed in the background.'})
 
 if __name__ == '__main__':
     print("Starting web AI interface... Open / in browser.")
+    from phase import CONTINUOUS_GOAL
     print(f"Continuous Goal: {CONTINUOUS_GOAL}")
-    app.run(host='0.0.0.0', port=8080, debug=True, use_reloader=False)
+    create_app().run(host='0.0.0.0', port=8080, debug=True, use_reloader=False)
 
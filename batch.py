@@ -0,0 +1,101 @@
+# batch.py: Batch query processing for replaying query logs
+"""
+process_many() answers a list of queries the way core.process_query would,
+but in bulk: rule-matched queries are answered inline, identical LLM
+fallbacks are sent upstream once, and the remaining LLM calls fan out
+across a bounded thread pool. Results come back in input order, with
+errors captured per item.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hotswap import active_core
+
+DEFAULT_MAX_WORKERS = 8
+
+def process_many(queries, histories=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Process queries in bulk.
+
+    Args:
+        queries (list of str): Queries to answer.
+        histories (list or None): Per-query history lists (same length as queries), or None.
+        max_workers (int): Upper bound on concurrent LLM calls.
+
+    Returns:
+        dict: {'results': [...], 'stats': {...}}. Each result has 'query', 'response',
+        'source' ('rule' or 'llm'), 'error' (str or None) and 'time' in seconds.
+    """
+    if histories is not None and len(histories) != len(queries):
+        raise ValueError("histories must match queries in length.")
+
+    core = active_core()  # The whole batch runs on one version, even if a patch lands meanwhile
+    start = time.perf_counter()
+    results = [None] * len(queries)
+    pending = {}  # prompt -> indices waiting on it
+    hints = {}    # prompt -> cache hint, as process_query passes it
+
+    for i, query in enumerate(queries):
+        item_start = time.perf_counter()
+        try:
+            result = core.apply_rules(query)
+            if result is not core.NO_RULE:
+                results[i] = _result(query, result, 'rule', None, item_start)
+                continue
+            history = histories[i] if histories is not None else None
+            prompt = core.build_prompt(query, history)
+            pending.setdefault(prompt, []).append(i)
+            hints[prompt] = core.cache_hint(query, history)
+        except Exception as e:
+            results[i] = _result(query, core.error_response(e), 'rule', str(e), item_start)
+
+    llm_calls = len(pending)
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, llm_calls))) as pool:
+            futures = {pool.submit(_timed_llm_call, core, prompt, hints[prompt]): prompt for prompt in pending}
+            for future, prompt in futures.items():
+                response, error, elapsed = future.result()
+                for i in pending[prompt]:
+                    results[i] = {
+                        'query': queries[i],
+                        'response': response,
+                        'source': 'llm',
+                        'error': error,
+                        'time': elapsed,
+                    }
+
+    elapsed = time.perf_counter() - start
+    llm_items = sum(len(indices) for indices in pending.values())
+    return {
+        'results': results,
+        'stats': {
+            'count': len(queries),
+            'rule_answers': len(queries) - llm_items,
+            'llm_items': llm_items,
+            'llm_calls': llm_calls,
+            'deduplicated': llm_items - llm_calls,
+            'errors': sum(1 for r in results if r['error']),
+            'elapsed': elapsed,
+            'throughput_qps': len(queries) / elapsed if elapsed > 0 else 0.0,
+        },
+    }
+
+def _timed_llm_call(core, prompt, hint=None):
+    start = time.perf_counter()
+    try:
+        response = core.query_llm(prompt, max_tokens=150, temperature=0.7, cache_hint=hint)
+        error = None if response else "LLM returned no response"
+        return core.finish_llm_response(response), error, time.perf_counter() - start
+    except Exception as e:
+        return core.error_response(e), str(e), time.perf_counter() - start
+
+def _result(query, response, source, error, started):
+    return {'query': query, 'response': response, 'source': source, 'error': error,
+            'time': time.perf_counter() - started}
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    report = process_many(["hello", "sort 3 1 2", "add 2 3", "tell me a joke", "tell me a joke", "add 1"])
+    for r in report['results']:
+        print(r)
+    print(report['stats'])
@@ -0,0 +1,380 @@
+# benchmark.py: Regression benchmark suite gating self-modification patches
+"""
+A fixed suite over the core rule paths (greeting, sort, add, phase) plus
+the LLM-fallback path, run against a local stub so no network is involved.
+
+gate_patch() runs the suite on the current source and the candidate in
+alternating rounds under TIMING_LOCK, so both are measured at the same
+time under the same load, and compares them per case: a one-sided
+Mann-Whitney U test on the pooled latency samples, a large effect size,
+a median increase over both an absolute and a relative floor, and a
+ratio check on peak memory. Any case that gets significantly slower than
+`tolerance`, or uses more memory than `mem_tolerance`, is a regression,
+but only if a second, fresh measurement flags it again.
+
+Reference baselines are also stored per source SHA-256 in BASELINE_FILE
+(`python benchmark.py` records one) for inspecting how the suite moves
+between versions; the gate doesn't compare against them.
+
+`python benchmark.py startup` measures cold start instead: fresh
+interpreters importing app and building it with create_app(), recording
+wall time and the number of imported modules per commit in STARTUP_FILE.
+"""
+
+import hashlib
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from sandbox import evaluate
+from logger import log_change
+from filecache import read_json
+
+BASELINE_FILE = os.path.join('benchmarks', 'baselines.json')
+REPEAT = 9             # Latency samples per case
+WARMUP = 2
+CASE_TIMEOUT = 10.0    # Seconds per case
+TOLERANCE = 0.25       # Allowed median latency increase (25%)
+MEM_TOLERANCE = 0.25   # Allowed peak memory increase (25%)
+ALPHA = 0.05           # Significance level for the latency test
+MIN_DELTA_NS = 5000    # Ignore latency differences below 5 microseconds (timer noise)...
+MIN_RELATIVE_DELTA = 0.05  # ...or below 5% of the baseline median
+MIN_EFFECT = 0.71      # Vargha-Delaney A a slowdown needs ("large" effect)
+ROUNDS = 3             # Alternating baseline/candidate runs per gate measurement
+MIN_MEM_DELTA = 4096   # Ignore memory differences below 4 KB
+STARTUP_FILE = os.path.join('benchmarks', 'startup.json')
+STARTUP_RUNS = 7       # Fresh interpreters per startup measurement
+
+STUB_LLM_RESPONSE = "Stub LLM response for benchmarking."
+
+def stub_query_llm(prompt, **kwargs):
+    """Deterministic stand-in for llm_query.query_llm used by the suite."""
+    return STUB_LLM_RESPONSE
+
+def _large_sort_query(n=20000):
+    # Deterministic pseudo-random numbers (LCG) so every run sorts the same input
+    x, values = 12345, []
+    for _ in range(n):
+        x = (1103515245 * x + 12345) % (2 ** 31)
+        values.append(x % 100000 - 50000)
+    return "sort " + " ".join(map(str, values))
+
+def build_suite():
+    """(name, query, expected) cases; expected values come from the reference behaviour."""
+    import numeric
+    from phase import get_current_phase, PHASES
+    current = get_current_phase()
+    large = _large_sort_query()
+    return [
+        ("greeting", "hello", "Hello! How can I help you today?"),
+        ("greeting_sentence", "hi there, how are you", "Hello! How can I help you today?"),
+        ("sort_small", "sort 5 3 1", [1, 3, 5]),
+        ("sort_large", large, numeric.compact(numeric.sort_numbers(numeric.parse_numbers(large)), label="sorted numbers")),
+        ("add", "add 2 3", 5),
+        ("add_symbol", "2 + 3", 5),
+        ("phase", "what phase", f"Current phase: {current} ({PHASES[current] if current < len(PHASES) else 'Terminal'})"),
+        ("llm_fallback", "tell me something interesting", STUB_LLM_RESPONSE),
+    ]
+
+def run_suite(source, repeat=REPEAT, warmup=WARMUP, timeout=CASE_TIMEOUT):
+    """Benchmark source's process_query over the suite in a sandbox worker. Returns {case name: report}."""
+    suite = build_suite()
+    metrics = evaluate(source, [(query, expected) for _, query, expected in suite],
+                       overrides={'query_llm': stub_query_llm}, repeat=repeat, warmup=warmup, timeout=timeout)
+    results = {}
+    for (name, _, _), case in zip(suite, metrics['cases']):
+        results[name] = {
+            'samples_ns': case['samples_ns'],
+            'mem_peak': case['mem_peak'],
+            'passed': case['passed'],
+            'error': case['error'],
+        }
+    return results
+
+# --- Baselines -------------------------------------------------------------
+
+def current_commit(repo='.'):
+    """Resolve HEAD by reading .git directly (no git subprocess)."""
+    git_dir = os.path.join(repo, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head
+        ref = head[5:]
+        ref_path = os.path.join(git_dir, ref)
+        if os.path.exists(ref_path):
+            with open(ref_path) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, 'packed-refs')) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return 'unversioned'
+
+_baseline_lock = threading.Lock()
+
+def _load_baselines():
+    # A copy: the cached dict is shared, and get_baseline adds to this one
+    return dict(read_json(BASELINE_FILE, {}))
+
+def _save_baselines(baselines):
+    os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+    tmp = BASELINE_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(baselines, f)
+    os.replace(tmp, BASELINE_FILE)
+
+def get_baseline(source, refresh=False):
+    """Stored baseline for source (keyed by its SHA-256), running the suite if there is none."""
+    source_sha = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    with _baseline_lock:
+        baselines = _load_baselines()
+        entry = baselines.get(source_sha)
+        if entry and not refresh:
+            return entry
+        entry = {'source_sha': source_sha, 'created': time.time(), 'results': run_suite(source)}
+        baselines[source_sha] = entry
+        _save_baselines(baselines)
+        log_change("Benchmark baseline recorded", f"source {source_sha[:12]}")
+        return entry
+
+# --- Comparison ------------------------------------------------------------
+
+def mann_whitney_greater(candidate, baseline):
+    """
+    One-sided Mann-Whitney U p-value for 'candidate samples tend to be larger'.
+
+    Normal approximation with tie correction; adequate for the suite's sample sizes.
+    """
+    n1, n2 = len(candidate), len(baseline)
+    if not n1 or not n2:
+        return 1.0
+    combined = sorted([(v, 0) for v in candidate] + [(v, 1) for v in baseline])
+    ranks = [0.0] * len(combined)
+    tie_term = 0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        for k in range(i, j + 1):
+            ranks[k] = rank
+        t = j - i + 1
+        tie_term += t ** 3 - t
+        i = j + 1
+    r1 = sum(r for r, (_, group) in zip(ranks, combined) if group == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    var = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (u1 - mean - 0.5) / math.sqrt(var)  # continuity correction
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def effect_size(candidate, baseline):
+    """Vargha-Delaney A: probability a candidate sample exceeds a baseline sample (ties count half)."""
+    if not candidate or not baseline:
+        return 0.5
+    greater = sum((c > b) + 0.5 * (c == b) for c in candidate for b in baseline)
+    return greater / (len(candidate) * len(baseline))
+
+def significantly_slower(candidate, baseline, alpha=ALPHA):
+    """
+    Whether candidate latency samples are slower than baseline's beyond
+    noise: the median increase clears MIN_DELTA_NS and MIN_RELATIVE_DELTA,
+    the effect is large and the U test is significant.
+    """
+    base_med = _median(baseline)
+    return (_median(candidate) - base_med > max(MIN_DELTA_NS, MIN_RELATIVE_DELTA * base_med)
+            and effect_size(candidate, baseline) >= MIN_EFFECT
+            and mann_whitney_greater(candidate, baseline) < alpha)
+
+def _median(values):
+    ordered = sorted(values)
+    if not ordered:
+        return float('inf')
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+def compare(baseline_results, candidate_results, tolerance=TOLERANCE, mem_tolerance=MEM_TOLERANCE, alpha=ALPHA):
+    """Per-case comparison report; report['regressed'] is True if any case regressed."""
+    cases = []
+    for name, base in baseline_results.items():
+        cand = candidate_results.get(name)
+        if cand is None:
+            cases.append({'name': name, 'verdict': 'missing'})
+            continue
+        base_med = _median(base['samples_ns'])
+        cand_med = _median(cand['samples_ns'])
+        ratio = cand_med / base_med if base_med else float('inf')
+        p_value = mann_whitney_greater(cand['samples_ns'], base['samples_ns'])
+        mem_ratio = cand['mem_peak'] / base['mem_peak'] if base['mem_peak'] else 1.0
+
+        verdict = 'ok'
+        if base['passed'] and not cand['passed']:
+            verdict = 'broken'
+        elif ratio > 1 + tolerance and significantly_slower(cand['samples_ns'], base['samples_ns'], alpha):
+            verdict = 'slower'
+        elif mem_ratio > 1 + mem_tolerance and cand['mem_peak'] - base['mem_peak'] > MIN_MEM_DELTA:
+            verdict = 'more_memory'
+        cases.append({
+            'name': name,
+            'baseline_median_us': base_med / 1000,
+            'candidate_median_us': cand_med / 1000,
+            'ratio': ratio,
+            'p_value': p_value,
+            'effect_size': effect_size(cand['samples_ns'], base['samples_ns']),
+            'baseline_mem': base['mem_peak'],
+            'candidate_mem': cand['mem_peak'],
+            'mem_ratio': mem_ratio,
+            'verdict': verdict,
+        })
+    regressions = [c['name'] for c in cases if c['verdict'] != 'ok']
+    return {
+        'regressed': bool(regressions),
+        'regressions': regressions,
+        'tolerance': tolerance,
+        'mem_tolerance': mem_tolerance,
+        'alpha': alpha,
+        'cases': cases,
+    }
+
+_last_report = None
+# Timed runs take turns: candidates evaluated in parallel would otherwise skew each other's samples
+TIMING_LOCK = threading.Lock()
+
+def measure_pair(current_source, candidate_source, rounds=ROUNDS):
+    """
+    Run the suite on both sources in alternating rounds (A B, B A, ...) so
+    drift in machine load hits both alike. Returns (baseline, candidate)
+    results with each case's samples pooled and its median peak memory.
+    """
+    runs = ([], [])
+    for r in range(rounds):
+        order = (0, 1) if r % 2 == 0 else (1, 0)
+        for side in order:
+            runs[side].append(run_suite(candidate_source if side else current_source))
+    return _pool(runs[0]), _pool(runs[1])
+
+def _pool(runs):
+    pooled = {}
+    for name in runs[0]:
+        results = [run[name] for run in runs]
+        pooled[name] = {
+            'samples_ns': [s for r in results for s in r['samples_ns']],
+            'mem_peak': _median([r['mem_peak'] for r in results]),
+            'passed': all(r['passed'] for r in results),
+            'error': next((r['error'] for r in results if r['error']), None),
+        }
+    return pooled
+
+def _confirm(report, recheck):
+    """Keep only the regressions recheck flags too; the others are marked 'unconfirmed'."""
+    again = {c['name'] for c in recheck['cases'] if c['verdict'] != 'ok'}
+    for case in report['cases']:
+        if case['verdict'] != 'ok' and case['name'] not in again:
+            case['unconfirmed'] = case['verdict']
+            case['verdict'] = 'ok'
+    report['regressions'] = [c['name'] for c in report['cases'] if c['verdict'] != 'ok']
+    report['regressed'] = bool(report['regressions'])
+    report['confirmed_by_rerun'] = True
+    return report
+
+def gate_patch(current_source, candidate_source, tolerance=TOLERANCE, mem_tolerance=MEM_TOLERANCE):
+    """
+    Benchmark a candidate against the current source, measured side by side
+    (see measure_pair()); a regression is only reported if a second
+    measurement confirms it. Returns the report.
+    """
+    global _last_report
+    with TIMING_LOCK:
+        report = compare(*measure_pair(current_source, candidate_source), tolerance, mem_tolerance)
+        if report['regressed']:
+            recheck = compare(*measure_pair(current_source, candidate_source), tolerance, mem_tolerance)
+            report = _confirm(report, recheck)
+    report['base_sha'] = hashlib.sha256(current_source.encode('utf-8')).hexdigest()
+    report['created'] = time.time()
+    _last_report = report
+    log_change("Benchmark comparison", json.dumps({k: report[k] for k in ('regressed', 'regressions', 'base_sha')}))
+    return report
+
+def last_report():
+    """Most recent gate_patch() report (surfaced through /patch/proposal), or None."""
+    return _last_report
+
+# --- Cold start ---------------------------------------------------------------
+
+# Run in a fresh interpreter: time to an app ready to serve, without its background threads
+_STARTUP_PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "app.create_app(start_background=False)\n"
+    "print(json.dumps({'ready_ms': (time.perf_counter() - start) * 1000, 'modules': len(sys.modules)}))\n"
+)
+
+def measure_startup(runs=STARTUP_RUNS, cwd='.'):
+    """
+    Cold-start cost over `runs` fresh interpreters (medians): wall_ms from
+    spawn to exit, ready_ms for import + create_app() inside the process,
+    interpreter_ms for a bare `python -c pass`, and the modules imported.
+    """
+    def spawn(code):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True).stdout
+        return (time.perf_counter() - start) * 1000, out
+    bare = [spawn('pass')[0] for _ in range(runs)]
+    wall, ready, modules = [], [], []
+    for _ in range(runs):
+        elapsed, out = spawn(_STARTUP_PROBE)
+        probe = json.loads(out.strip().splitlines()[-1])
+        wall.append(elapsed)
+        ready.append(probe['ready_ms'])
+        modules.append(probe['modules'])
+    return {'runs': runs, 'wall_ms': _median(wall), 'ready_ms': _median(ready),
+            'interpreter_ms': _median(bare), 'modules': max(modules), 'created': time.time()}
+
+def record_startup(result, commit=None):
+    """Store result under commit (HEAD by default); returns the previously recorded commit's entry, if any."""
+    commit = commit or current_commit()
+    history = dict(read_json(STARTUP_FILE, {}))
+    previous = next((history[c] for c in reversed(list(history)) if c != commit), None)
+    history.pop(commit, None)
+    history[commit] = result
+    os.makedirs(os.path.dirname(STARTUP_FILE), exist_ok=True)
+    tmp = STARTUP_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(history, f)
+    os.replace(tmp, STARTUP_FILE)
+    return previous
+
+def _startup_main():
+    result = measure_startup()
+    previous = record_startup(result)
+    print(f"ready {result['ready_ms']:.1f} ms  wall {result['wall_ms']:.1f} ms  "
+          f"(bare interpreter {result['interpreter_ms']:.1f} ms)  modules {result['modules']}")
+    if previous:
+        print(f"previous commit: ready {previous['ready_ms']:.1f} ms  modules {previous['modules']}  "
+              f"({(result['ready_ms'] / previous['ready_ms'] - 1) * 100:+.0f}% ready time)")
+
+# Run directly to record (or refresh) the baseline for the current core.py;
+# `python benchmark.py startup` measures cold start instead
+if __name__ == "__main__":
+    if sys.argv[1:] == ['startup']:
+        _startup_main()
+        sys.exit(0)
+    with open('core.py') as f:
+        source = f.read()
+    entry = get_baseline(source, refresh=True)
+    for name, result in entry['results'].items():
+        print(f"{name:18} median {_median(result['samples_ns']) / 1000:9.1f} us  mem {result['mem_peak']:8d} B  passed={result['passed']}")
+    print(json.dumps(compare(entry['results'], run_suite(source))['regressions']))
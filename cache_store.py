@@ -0,0 +1,331 @@
+# cache_store.py: Indexed, append-only persistent store for LLM responses
+"""
+SQLite-backed key/value store used by llm_query.py.
+
+Keys are SHA-256 digests of the full cache key (prompt + temperature), so
+lookups hit the primary-key index instead of parsing the whole cache. The
+database runs in WAL mode: writes are single-row appends and several
+processes (Flask workers, reflection threads, CLI runs) can share the file.
+
+A bounded LRU tier sits in front of the disk lookups. Both tiers expire
+an entry ENTRY_TTL seconds after it was first stored, and the disk tier is pruned back to
+DISK_MAX_ENTRIES so neither memory nor llm_cache.db grows without limit.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from logger import log_change
+
+CACHE_DB = 'llm_cache.db'
+LEGACY_CACHE_FILE = 'llm_cache.json'
+
+# Limits (tune per deployment)
+HOT_MAX_ENTRIES = 512
+HOT_MAX_BYTES = 8 * 1024 * 1024
+ENTRY_TTL = 7 * 24 * 3600  # seconds; None disables expiry
+DISK_MAX_ENTRIES = 10000
+PRUNE_EVERY = 100  # disk writes between prune passes
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key     TEXT PRIMARY KEY,
+        value   TEXT NOT NULL,
+        created REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS entries_created ON entries (created)",
+)
+
+def hash_key(raw_key):
+    """Hash a raw cache key (which may embed whole source files) to a fixed-size digest."""
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count and total bytes, with per-entry TTL."""
+
+    def __init__(self, max_entries=HOT_MAX_ENTRIES, max_bytes=HOT_MAX_BYTES, ttl=ENTRY_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _sizeof(key, value):
+        return len(key) + len(value.encode('utf-8'))
+
+    def get(self, key):
+        """Return the value for key (marking it most recently used), or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """The live value for key, or None, without touching recency or the counters."""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or (entry[2] is not None and entry[2] <= time.time()):
+            return None
+        return entry[0]
+
+    def put(self, key, value, ttl=None, created=None):
+        """
+        Insert or refresh key, evicting least recently used entries past the
+        limits. created (default: now) is when the value was first stored, so
+        an entry loaded from disk expires with its disk row.
+        """
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return  # Never let one huge response flush the whole tier
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = (time.time() if created is None else created) + ttl if ttl else None
+        if expires_at is not None and expires_at <= time.time():
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size, expires_at)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+class CacheStore:
+    """Persistent cache with one connection per thread and a bounded LRU hot tier."""
+
+    def __init__(self, path=CACHE_DB, ttl=ENTRY_TTL, max_entries=DISK_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hot = LRUCache(ttl=ttl)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        self._writes = 0
+        is_new = not os.path.exists(path)
+        self._connect()
+        if is_new and os.path.exists(LEGACY_CACHE_FILE):
+            import_json_cache(LEGACY_CACHE_FILE, store=self)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def _cutoff(self):
+        """Rows created at or before this have expired (like the hot tier, at exactly created + ttl)."""
+        return time.time() - self.ttl if self.ttl else float('-inf')
+
+    def get(self, raw_key):
+        """Return the cached value for raw_key, or None."""
+        key = hash_key(raw_key)
+        value = self.hot.get(key)
+        if value is not None:
+            return value
+        row = self._read(key)
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self.hot.put(key, row[0], created=row[1])
+        return row[0]
+
+    def peek(self, raw_key):
+        """Like get(), but leaves the counters and the hot tier alone (for re-checks of a known miss)."""
+        return self.peek_hashed(hash_key(raw_key))
+
+    def peek_hashed(self, key):
+        """peek() by the hash_key() digest, e.g. one stored as a pointer to another entry."""
+        value = self.hot.peek(key)
+        if value is not None:
+            return value
+        row = self._read(key)
+        return row[0] if row is not None else None
+
+    def _read(self, key):
+        """(value, created) of the fresh disk row for key, or None."""
+        try:
+            return self._connect().execute(
+                "SELECT value, created FROM entries WHERE key = ? AND created > ?", (key, self._cutoff())
+            ).fetchone()
+        except sqlite3.Error as e:
+            log_change("Cache read error", str(e), level='ERROR')
+            return None
+
+    def put(self, raw_key, value, hot=True):
+        """
+        Insert a single entry; concurrent writers of the same fresh key keep the
+        first value. hot=False writes only the disk tier (e.g. small pointer rows
+        that shouldn't take hot-tier slots from real responses).
+        """
+        key = hash_key(raw_key)
+        created = time.time()
+        try:
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT INTO entries (key, value, created) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, created = excluded.created "
+                "WHERE entries.created <= ?",
+                (key, value, created, self._cutoff()),
+            )
+            if cursor.rowcount == 0:
+                # A fresh row won; cache what is on disk so both tiers agree
+                row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+        except sqlite3.Error as e:
+            log_change("Cache write error", str(e), level='ERROR')
+            return
+        if hot:
+            self.hot.put(key, value, created=created)
+        with self._stats_lock:
+            self._writes += 1
+            due = self._writes % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    def put_many(self, items):
+        """Insert (raw_key, value) pairs in a single transaction. Returns rows inserted."""
+        now = time.time()
+        rows = [(hash_key(k), v, now) for k, v in items]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO entries (key, value, created) VALUES (?, ?, ?)", rows)
+            conn.execute("COMMIT")
+            return conn.total_changes - before
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK")
+            log_change("Cache bulk write error", str(e), level='ERROR')
+            return 0
+
+    def prune(self):
+        """Drop expired rows and the oldest rows beyond max_entries. Returns rows removed."""
+        conn = self._connect()
+        try:
+            before = conn.total_changes
+            conn.execute("DELETE FROM entries WHERE created <= ?", (self._cutoff(),))
+            if self.max_entries:
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            removed = conn.total_changes - before
+        except sqlite3.Error as e:
+            log_change("Cache prune error", str(e), level='ERROR')
+            return 0
+        with self._stats_lock:
+            self.disk_evictions += removed
+        return removed
+
+    def stats(self):
+        """Counters for both tiers; 'hit_rate' covers memory and disk hits together."""
+        hot = self.hot.stats()
+        with self._stats_lock:
+            hits = hot['hits'] + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'hot': hot,
+                'disk': {
+                    'entries': len(self),
+                    'hits': self.disk_hits,
+                    'evictions': self.disk_evictions,
+                    'max_entries': self.max_entries,
+                },
+                'hits': hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+def import_json_cache(json_path=LEGACY_CACHE_FILE, store=None):
+    """One-shot import of the legacy whole-file llm_cache.json into the store."""
+    if store is None:
+        store = get_store()
+    try:
+        with open(json_path, 'r') as f:
+            legacy = json.load(f)
+    except (IOError, ValueError) as e:
+        log_change("Legacy cache import failed", str(e))
+        return 0
+    imported = store.put_many((k, v) for k, v in legacy.items() if isinstance(v, str))
+    log_change("Imported legacy LLM cache", f"{imported} of {len(legacy)} entries from {json_path}")
+    return imported
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_store():
+    """Return the process-wide cache store, opening it on first use."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = CacheStore()
+    return _STORE
+
+# Run directly to import llm_cache.json into llm_cache.db
+if __name__ == "__main__":
+    count = import_json_cache(LEGACY_CACHE_FILE)
+    print(f"Imported {count} entries into {CACHE_DB} ({len(get_store())} total).")
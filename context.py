@@ -0,0 +1,179 @@
+# context.py: Token-budgeted prompt context for chat and self-modification
+"""
+Keeps LLM prompts inside a token budget instead of growing with file size
+and conversation length.
+
+- Chat: the newest turns are kept (each capped at TURN_TOKENS), older
+  turns are squeezed into one-line summaries, and turns stop being added
+  once the budget is spent.
+- Code: the source is parsed with ast and the prompt carries the target
+  function in full (with its line numbers) plus only the signatures of
+  everything else, instead of the whole file.
+
+Token counts use tiktoken when it is installed and a characters/4 estimate
+otherwise. Every built prompt is recorded so per-call usage can be
+reported (see usage_stats()).
+"""
+
+import ast
+import re
+import threading
+from collections import deque
+
+_ENCODING = False  # tiktoken encoding once loaded, None if unavailable
+
+CONTEXT_LIMIT = 8192   # Model context window (Llama 3 8B)
+CHAT_BUDGET = 1024     # Prompt tokens for chat calls
+CODE_BUDGET = 3000     # Prompt tokens for self-modification calls
+TURN_TOKENS = 200      # Cap per recent turn
+SUMMARY_TOKENS = 30    # Cap per summarized older turn
+FULL_TURNS = 2         # Newest turns kept (capped) rather than summarized
+RECENT_CALLS = 100     # Per-call usage records kept for reporting
+
+def _encoding():
+    """The cl100k encoding, loaded on first use (it reads a large BPE file)."""
+    global _ENCODING
+    if _ENCODING is False:
+        try:
+            import tiktoken
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # ImportError, or no cached encoding offline
+            _ENCODING = None
+    return _ENCODING
+
+def count_tokens(text):
+    """Token count of text (exact with tiktoken, estimated otherwise)."""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_text(text, max_tokens):
+    """Shorten text to about max_tokens, keeping its start and end."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(8, max_tokens * 4 - 40) // 2  # characters kept at each end
+    omitted = len(text) - 2 * keep
+    return f"{text[:keep]} ...[{omitted} chars omitted]... {text[-keep:]}"
+
+def _render(value):
+    if isinstance(value, (list, tuple)) and len(value) > 10:
+        return f"[{len(value)} items: {', '.join(map(str, value[:3]))}, ..., {value[-1]}]"
+    return str(value)
+
+def _summarize_turn(user, ai):
+    # First line of each side, cut to SUMMARY_TOKENS; no LLM call involved
+    first = lambda text: truncate_text(_render(text).strip().split("\n", 1)[0], SUMMARY_TOKENS // 2)
+    return f"User: {first(user)} / AI: {first(ai)}"
+
+def build_history(history, budget):
+    """Render history (oldest first) newest-first into at most budget tokens; returns (text, tokens)."""
+    blocks = []
+    used = 0
+    for age, (user, ai) in enumerate(reversed(history or [])):
+        if age < FULL_TURNS:
+            block = (f"User: {truncate_text(_render(user), TURN_TOKENS // 2)}\n"
+                     f"AI: {truncate_text(_render(ai), TURN_TOKENS // 2)}")
+        else:
+            block = _summarize_turn(user, ai)
+        tokens = count_tokens(block) + 1
+        if used + tokens > budget:
+            break
+        blocks.append(block)
+        used += tokens
+    blocks.reverse()
+    return "\n".join(blocks), used
+
+# --- Code context ----------------------------------------------------------
+
+def _signature(node, lines):
+    """Header line(s) of a def/class up to the colon, plus the docstring's first line."""
+    end = node.body[0].lineno - 1 if node.body else node.lineno
+    header = "\n".join(lines[node.lineno - 1 - len(node.decorator_list):end]).rstrip()
+    doc = ast.get_docstring(node)
+    indent = " " * (node.col_offset + 4)
+    summary = f'\n{indent}"""{doc.strip().splitlines()[0]}"""' if doc else ""
+    return f"{header}{summary}\n{indent}..."
+
+def _pick_target(functions, query):
+    """The function named in the query, else the one sharing the most words with it."""
+    words = set(re.findall(r'[a-z_][a-z0-9_]+', query.lower()))
+    for node in functions:
+        if node.name.lower() in words:
+            return node
+    def overlap(node):
+        return len(words & set(node.name.lower().split('_')))
+    best = max(functions, key=overlap, default=None)
+    if best is not None and overlap(best):
+        return best
+    return next((node for node in functions if node.name == 'process_query'), functions[0] if functions else None)
+
+def extract_code_context(source, query='', target=None, budget=CODE_BUDGET):
+    """
+    Target function in full (with line numbers) plus signatures of the rest.
+
+    target names the function; otherwise it is picked from query. Falls back
+    to a truncated copy of the source if it doesn't parse.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return truncate_text(source, budget)
+    lines = source.splitlines()
+    functions = [n for n in tree.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    chosen = next((n for n in functions if n.name == target), None) if target else _pick_target(functions, query)
+
+    parts = []
+    for node in tree.body:
+        if node is chosen:
+            continue
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign)) and node.end_lineno - node.lineno < 3:
+            parts.append("\n".join(lines[node.lineno - 1:node.end_lineno]))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            parts.append(_signature(node, lines))
+    outline = "\n".join(parts)
+
+    if chosen is None:
+        return truncate_text(outline, budget)
+    start = chosen.lineno - len(chosen.decorator_list)
+    body = "\n".join(lines[start - 1:chosen.end_lineno])
+    body = truncate_text(body, max(budget // 2, budget - count_tokens(outline)))
+    outline = truncate_text(outline, max(0, budget - count_tokens(body)))
+    return (f"# Outline (signatures only):\n{outline}\n\n"
+            f"# Function to change, lines {start}-{chosen.end_lineno}:\n{body}\n")
+
+# --- Usage reporting -------------------------------------------------------
+
+_usage_lock = threading.Lock()
+_usage = {}
+_recent = deque(maxlen=RECENT_CALLS)
+
+def record_usage(kind, prompt, budget):
+    """Count prompt's tokens against budget under kind ('chat', 'code', ...). Returns the count."""
+    tokens = count_tokens(prompt)
+    with _usage_lock:
+        entry = _usage.setdefault(kind, {'calls': 0, 'tokens': 0, 'max_tokens': 0, 'over_budget': 0})
+        entry['calls'] += 1
+        entry['tokens'] += tokens
+        entry['max_tokens'] = max(entry['max_tokens'], tokens)
+        entry['over_budget'] += tokens > budget
+        _recent.append({'kind': kind, 'tokens': tokens, 'budget': budget})
+    return tokens
+
+def usage_stats():
+    """Totals per kind (with the average) and the most recent per-call counts."""
+    with _usage_lock:
+        totals = {kind: dict(entry, avg_tokens=entry['tokens'] / entry['calls']) for kind, entry in _usage.items()}
+        return {'by_kind': totals, 'recent': list(_recent), 'exact': _encoding() is not None,
+                'context_limit': CONTEXT_LIMIT}
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    with open('core.py') as f:
+        code = f.read()
+    snippet = extract_code_context(code, "optimize the sort_rule function")
+    print(snippet)
+    print(f"whole file: {count_tokens(code)} tokens, context: {count_tokens(snippet)} tokens")
+    history = [("sort " + " ".join(map(str, range(5000))), list(range(5000)))] + [(f"q{i}", f"answer {i}") for i in range(20)]
+    text, tokens = build_history(history, CHAT_BUDGET)
+    print(text, tokens)
@@ -24,13 +24,69 @@ Evolution Path:
 """
 
 import re  # For simple parsing helpers
+from rules import RuleRegistry, NO_MATCH
+import numeric
+from numeric import parse_numbers, sort_numbers, aggregate, compact, to_python
+from context import build_history, count_tokens, truncate_text, record_usage, CHAT_BUDGET
+from tracing import span, traced
 
-try:
-    from llm_query import query_llm
-except ImportError:
-    # Fallback if LLM not available (early phases)
-    def query_llm(prompt, **kwargs):
+# The LLM client (requests, the cache database) is imported on the first fallback,
+# so queries the rules answer never load it
+def _llm_client():
+    try:
+        import llm_query
+        return llm_query
+    except ImportError:
+        return None
+
+def query_llm(prompt, **kwargs):
+    client = _llm_client()
+    if client is None:
+        # Fallback if LLM not available (early phases)
         return f"LLM fallback unavailable: {prompt[:50]}..."  # Mock for testing
+    return client.query_llm(prompt, **kwargs)
+
+async def query_llm_async(prompt, **kwargs):
+    client = _llm_client()
+    if client is None:
+        return query_llm(prompt, **kwargs)
+    return await client.query_llm_async(prompt, **kwargs)
+
+def query_llm_stream(prompt, **kwargs):
+    client = _llm_client()
+    if client is None:
+        yield query_llm(prompt, **kwargs)
+        return
+    yield from client.query_llm_stream(prompt, **kwargs)
+
+SYSTEM_PROMPT = (
+    "You are a helpful, witty AI personal assistant built by xAI. "
+    "Respond concisely, accurately, and engagingly. Use tools or reason step-by-step if complex. "
+    "For math/code, output exact results. Keep it fun but professional."
+)
+
+CONTEXT_TURNS = 8  # History turns offered to build_prompt (older ones are summarized to fit CHAT_BUDGET)
+NO_RULE = NO_MATCH  # Sentinel: no rule handled the query, fall back to the LLM
+RULES = RuleRegistry()
+
+# Option words for numeric rules (searched only near the ends of long queries)
+TOP_K_RE = re.compile(r'\b(top|first|largest|smallest|bottom)\s+(\d+)\b', re.IGNORECASE)
+DESC_RE = re.compile(r'\b(?:desc|descending|reverse|largest|biggest)\b', re.IGNORECASE)
+ASC_RE = re.compile(r'\b(?:asc|ascending)\b', re.IGNORECASE)
+FULL_RE = re.compile(r'\bfull\b', re.IGNORECASE)
+# Keywords that are also ordinary words ("plus tax", "three times") only
+# trigger a rule with a number within two words of them
+def near_number(words):
+    return (rf'\b(?:{words})\b(?=(?:\W+[^\W\d]+){{0,2}}\W*-?\d)'
+            rf'|\d(?:\W+[^\W\d]+){{0,2}}\W+(?:{words})\b')
+# Aggregate keywords are ordinary words ("the average age of 30 people"), so they
+# only fire at the start of the query, directly followed by two or more numbers
+STATS_PATTERN = (r"^\W*(?:(?:what\s+is|what's|compute|calculate)\s+(?:the\s+)?)?"
+                 r'(?:mean|average|avg|median|min|minimum|max|maximum)\b(?:\s+of)?[\s:]*'
+                 r'(?=-?\.?\d+(?:\.\d+)?(?:\s*[,;]\s*|\s+)(?:and\s+)?-?\.?\d)')
+STAT_WORD_RE = re.compile(r'\b(?:mean|average|avg|median|min|minimum|max|maximum)\b', re.IGNORECASE)
+STAT_OPS = {'mean': 'mean', 'average': 'mean', 'avg': 'mean', 'median': 'median',
+            'min': 'min', 'minimum': 'min', 'max': 'max', 'maximum': 'max'}
 
 def process_query(query, history=None):
     """
@@ -44,69 +100,184 @@ def process_query(query, history=None):
         str or list or int: Response (type varies by query).
     """
     try:
-        query_lower = query.lower().strip()
-
-        # Rule 1: Greetings
-        if any(greeting in query_lower for greeting in ["hello", "hi", "hey", "greetings"]):
-            return "Hello! How can I help you today?"
-
-        # Rule 2: Sorting numbers (handles spaces, commas)
-        if "sort" in query_lower:
-            # Extract numbers: e.g., "sort 5, 3 1" -> [5,3,1]
-            num_strs = re.findall(r'\d+', query)  # Grab all digits
-            if num_strs:
-                numbers = [int(n) for n in num_strs]
-                return sorted(numbers)  # Returns list for flexibility
-            else:
-                raise ValueError("No valid numbers found in sort query.")
-
-        # Rule 3: Basic math (add, subtract, multiply; expandable)
-        if "add" in query_lower or "+" in query_lower:
-            # Parse: "add 2 3" or "2 + 3"
-            parts = re.findall(r'\d+', query)
-            if len(parts) >= 2:
-                nums = [int(p) for p in parts[:2]]  # First two for simple add
-                return sum(nums)
-            else:
-                raise ValueError("Need at least two numbers for addition.")
-
-        # Rule 4: Simple info (expandable via patches)
-        if "phase" in query_lower:
-            from phase import get_current_phase, PHASES
-            current = get_current_phase()
-            return f"Current phase: {current} ({PHASES[current] if current < len(PHASES) else 'Terminal'})"
-
-        # Fallback: LLM for everything else
-        context = ""
-        if history:
-            recent = history[-3:]  # Last 3 exchanges for brevity
-            context = "\n".join([f"User: {u}\nAI: {a}" for u, a in recent])
-            context += "\n\n"
+        result = apply_rules(query)
+        if result is not NO_RULE:
+            return result
 
-        system_prompt = (
-            "You are a helpful, witty AI personal assistant built by xAI. "
-            "Respond concisely, accurately, and engagingly. Use tools or reason step-by-step if complex. "
-            "For math/code, output exact results. Keep it fun but professional."
-        )
+        llm_response = query_llm(build_prompt(query, history), max_tokens=150, temperature=0.7,
+                                 cache_hint=cache_hint(query, history))
+        return finish_llm_response(llm_response)
+    except Exception as e:
+        return error_response(e)
 
-        full_prompt = f"{system_prompt}\n\nRecent conversation:\n{context}User: {query}\nAssistant:"
+async def process_query_async(query, history=None):
+    """Async variant of process_query: same rules, non-blocking LLM fallback."""
+    try:
+        result = apply_rules(query)
+        if result is not NO_RULE:
+            return result
 
-        llm_response = query_llm(full_prompt, max_tokens=150, temperature=0.7)
+        llm_response = await query_llm_async(build_prompt(query, history), max_tokens=150, temperature=0.7,
+                                             cache_hint=cache_hint(query, history))
+        return finish_llm_response(llm_response)
+    except Exception as e:
+        return error_response(e)
 
-        # Post-process: If LLM outputs code/math, try to eval safely (future phase)
-        if "```python" in llm_response:
-            # Placeholder for safe exec—patch later
-            llm_response += "\n\n(Note: Code execution pending upgrade.)"
+def process_query_stream(query, history=None):
+    """
+    Streaming variant of process_query: yields response chunks.
 
-        return llm_response or "I'm pondering that—got a more specific angle?"
+    Rule results are yielded whole (they may be lists or ints); LLM fallback
+    text is yielded token by token as it arrives.
+    """
+    try:
+        result = apply_rules(query)
+        if result is not NO_RULE:
+            yield result
+            return
 
-    except ValueError as ve:
-        return f"Oops, {ve}. Try clarifying the query!"
-    except ImportError as ie:
-        # If phase helpers missing
-        return f"System not ready for that yet: {ie}"
+        parts = []
+        for chunk in query_llm_stream(build_prompt(query, history), max_tokens=150, temperature=0.7,
+                                      cache_hint=cache_hint(query, history)):
+            parts.append(chunk)
+            yield chunk
+
+        full = "".join(parts)
+        finished = finish_llm_response(full)
+        if finished != full:
+            yield finished[len(full):] if finished.startswith(full) else finished
     except Exception as e:
-        return f"Unexpected hiccup: {e}. Let's try something simpler?"
+        yield error_response(e)
+
+def apply_rules(query):
+    """Fast rule-based handlers (see RULES). Returns NO_RULE if none matched."""
+    query = query.strip()
+    with span('core.rules') as s:
+        result = RULES.dispatch(query, scan_text=command_words(query))
+        s.set(matched=result is not NO_RULE)
+    return result
+
+def command_words(query, edge=200):
+    """The parts of a query where option words live; avoids rescanning huge number lists."""
+    if len(query) <= 2 * edge:
+        return query
+    return f"{query[:edge]} {query[-edge:]}"
+
+def rule_stats():
+    """Per-rule hit counters for the dispatcher."""
+    return RULES.stats()
+
+# --- Rules: registered in priority order, compiled into one regex by RuleRegistry ---
+# Patches add rules here with @RULES.rule(name, pattern); use \b word boundaries.
+
+# Rule 1: Greetings
+@RULES.rule('greeting', r'\b(?:hello|hi|hey|greetings)\b')
+def greeting_rule(query, match):
+    return "Hello! How can I help you today?"
+
+# Rule 2: Sorting numbers (ints, negatives, floats; "desc", "top N", "full")
+@RULES.rule('sort', r'\bsort(?:ed|ing)?\b')
+def sort_rule(query, match):
+    words = command_words(query)
+    top_k = None
+    top = TOP_K_RE.search(words)
+    if top:
+        top_k = int(top.group(2))
+        query = query.replace(top.group(0), ' ', 1)  # Don't parse N as data
+    descending = bool(DESC_RE.search(words)) or bool(top and top.group(1).lower() in ('top', 'largest'))
+    if ASC_RE.search(words):
+        descending = False
+
+    values = parse_numbers(query)
+    if not numeric.size(values):
+        return NO_RULE  # "sort out my week": not a numeric query
+    return compact(sort_numbers(values, descending, top_k), full=bool(FULL_RE.search(words)), label="sorted numbers")
+
+# Rule 3: Basic math (add, subtract, multiply, aggregates) over any number of values
+# Rules that find fewer numbers than they need return NO_RULE, so the query goes to the LLM
+@RULES.rule('add', r'\b(?:add|sum)\b|' + near_number('plus') + r'|\d\s*\+\s*-?\.?\d')
+def add_rule(query, match):
+    # Parse: "add 2 3", "2 + 3", "sum 1.5 -2 4"
+    values = parse_numbers(query)
+    if numeric.size(values) < 2:
+        return NO_RULE
+    return to_python(aggregate(values, 'sum'))
+
+@RULES.rule('subtract', r'\bsubtract\b|' + near_number('minus'))
+def subtract_rule(query, match):
+    values = parse_numbers(query)
+    if numeric.size(values) < 2:
+        return NO_RULE
+    if re.search(r'\bfrom\b', command_words(query), re.IGNORECASE):
+        values = values[::-1]  # "subtract 3 from 10" -> 10 - 3
+    return to_python(aggregate(values, 'subtract'))
+
+@RULES.rule('multiply', r'\bmultiply\b|' + near_number('product|times') + r'|\d\s*\*\s*-?\.?\d')
+def multiply_rule(query, match):
+    values = parse_numbers(query)
+    if numeric.size(values) < 2:
+        return NO_RULE
+    return to_python(aggregate(values, 'product'))
+
+@RULES.rule('stats', STATS_PATTERN)
+def stats_rule(query, match):
+    op = STAT_OPS[STAT_WORD_RE.search(match.group(0)).group(0).lower()]
+    values = parse_numbers(query)
+    if numeric.size(values) < 2:
+        return NO_RULE
+    return to_python(aggregate(values, op))
+
+# Rule 4: Simple info (expandable via patches)
+@RULES.rule('phase', r'\bphases?\b')
+def phase_rule(query, match):
+    from phase import get_current_phase, PHASES
+    current = get_current_phase()
+    return f"Current phase: {current} ({PHASES[current] if current < len(PHASES) else 'Terminal'})"
+
+@traced('core.build_prompt')
+def build_prompt(query, history=None):
+    """LLM prompt: system prompt, recent conversation context, then the query, within CHAT_BUDGET tokens."""
+    head = f"{SYSTEM_PROMPT}\n\nRecent conversation:\n"
+    tail = f"User: {truncate_text(query, CHAT_BUDGET // 2)}\nAssistant:"
+    context = ""
+    if history:
+        # Newest turns verbatim (capped), older ones summarized, until the budget runs out
+        context, _ = build_history(history[-CONTEXT_TURNS:], CHAT_BUDGET - count_tokens(head) - count_tokens(tail))
+        if context:
+            context += "\n\n"
+
+    prompt = f"{head}{context}{tail}"
+    record_usage('chat', prompt, CHAT_BUDGET)
+    return prompt
+
+def cache_hint(query, history=None):
+    """
+    The bare query when there is no history (lets the LLM cache match it across
+    conversations), else None: follow-ups like "why?" or "and in german?"
+    depend on the conversation, so they are only cached under the full
+    prompt, which embeds the history.
+    """
+    if history:
+        return None
+    return query
+
+def finish_llm_response(llm_response):
+    """Post-process an LLM reply (or None on failure) into the user-facing response."""
+    # Post-process: If LLM outputs code/math, try to eval safely (future phase)
+    if llm_response and "```python" in llm_response:
+        # Placeholder for safe exec—patch later
+        llm_response += "\n\n(Note: Code execution pending upgrade.)"
+
+    return llm_response or "I'm pondering that—got a more specific angle?"
+
+def error_response(e):
+    """Map an exception from rules or fallback to a graceful reply."""
+    if isinstance(e, ValueError):
+        return f"Oops, {e}. Try clarifying the query!"
+    if isinstance(e, ImportError):
+        # If phase helpers missing
+        return f"System not ready for that yet: {e}"
+    return f"Unexpected hiccup: {e}. Let's try something simpler?"
 
 # Integration note for main.py: Call as process_query(user_input, conversation_history)
 # After response: conversation_history.append((user_input, response))
@@ -123,6 +294,12 @@ if __name__ == "__main__":
         ("sort 5,3,1", [1, 3, 5]),  # Commas
         ("add 2 3", 5),
         ("2 + 3", 5),
+        ("mean 1 2 3", 2),
+        ("what is the max of 4, 9, 2", 9),
+        ("max speed of a cheetah", "LLM"),  # Ordinary chat: no rule, goes to the LLM
+        ("what is the average age of 30 people", "LLM"),
+        ("I need a minimum of 3 hours of sleep", "LLM"),
+        ("I am 25 years old and the max speed is 100", "LLM"),
         ("what phase", "Current phase: 0 ..."),  # Depends on phase.json
         ("Tell me a joke about AI", "Mock LLM: Why did the AI go to school? To improve its learning algorithm!"),  # LLM fallback
     ]
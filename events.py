@@ -0,0 +1,87 @@
+# events.py: Server-side publish/subscribe bus pushed to browsers over SSE
+"""
+Events (alerts, patch proposals, decisions) are appended to a bounded ring
+with increasing ids. Subscribers don't register: each one holds its own
+cursor (the last id it saw) and blocks in listen() until something newer
+is published, so an idle client costs a sleeping thread and no polling.
+
+The cursor is what a browser's EventSource sends back as Last-Event-ID
+when it reconnects, so a dropped stream resumes where it stopped. If the
+events it missed have already left the ring, listen() reports the gap and
+the client refetches current state instead.
+"""
+
+import threading
+import time
+from collections import deque
+
+MAX_EVENTS = 500     # Events kept for resuming clients
+HEARTBEAT = 15.0     # Seconds between keep-alives on an idle stream
+
+class EventBus:
+    """Bounded ring of (id, type, data) events with blocking, cursor-based reads."""
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self._events = deque(maxlen=max_events)  # (id, ts, type, data)
+        self._last_id = 0
+        self._cond = threading.Condition()
+        self.published = 0
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event_type, data=None):
+        """Append an event and wake every waiting subscriber. Returns its id."""
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, time.time(), event_type, data))
+            self.published += 1
+            self._cond.notify_all()
+            return self._last_id
+
+    def _since(self, last_id):
+        if not self._events or last_id >= self._last_id:
+            return [], False
+        missed = last_id < self._events[0][0] - 1
+        return [e for e in self._events if e[0] > last_id], missed
+
+    def listen(self, last_id, timeout=HEARTBEAT):
+        """
+        Events after last_id, waiting up to timeout for one to arrive.
+        Returns (events, missed); missed is True when some events after
+        last_id were already dropped from the ring.
+        """
+        with self._cond:
+            if last_id > self._last_id:  # Cursor from before a restart
+                return [], True
+            self._cond.wait_for(lambda: self._last_id > last_id, timeout)
+            return self._since(last_id)
+
+    def stats(self):
+        with self._cond:
+            return {'last_id': self._last_id, 'buffered': len(self._events), 'published': self.published}
+
+_BUS = None
+_BUS_LOCK = threading.Lock()
+
+def get_event_bus():
+    """Return the process-wide event bus, creating it on first use."""
+    global _BUS
+    if _BUS is None:
+        with _BUS_LOCK:
+            if _BUS is None:
+                _BUS = EventBus()
+    return _BUS
+
+def publish_event(event_type, data=None):
+    return get_event_bus().publish(event_type, data)
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    bus = get_event_bus()
+    threading.Timer(0.2, lambda: bus.publish('alert', {'message': 'hello'})).start()
+    start = time.perf_counter()
+    events, missed = bus.listen(0, timeout=5)
+    print(f"woke after {(time.perf_counter() - start) * 1000:.1f} ms:", events, missed)
+    print(bus.listen(bus.last_id, timeout=0.1), bus.stats())
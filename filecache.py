@@ -0,0 +1,55 @@
+# filecache.py: mtime-invalidated cache for small JSON state files
+"""
+Small state files (phase.json, benchmark baselines) are read on hot paths
+but rarely change. read_json() parses a file once and then only stats it:
+the cached value is reused while the file's mtime and size are unchanged,
+so writes by this process, other workers or a text editor are picked up on
+the next read.
+
+Cached values are shared between callers and must not be mutated.
+"""
+
+import json
+import os
+import threading
+
+_cache = {}  # path -> (mtime_ns, size, value)
+_lock = threading.Lock()
+
+def read_json(path, default=None):
+    """Parsed contents of path, or default if it is missing or invalid."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return default
+    cached = _cache.get(path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    try:
+        with open(path, 'r') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return default
+    with _lock:
+        _cache[path] = (st.st_mtime_ns, st.st_size, value)
+    return value
+
+def invalidate(path=None):
+    """Forget path (default: everything), e.g. after writing it within the same mtime tick."""
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(path, None)
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    import tempfile
+    import time
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump({'phase': 2}, f)
+    start = time.perf_counter()
+    for _ in range(10000):
+        read_json(f.name, {})
+    print(f"10k cached reads: {(time.perf_counter() - start) * 1000:.1f} ms", read_json(f.name))
+    os.remove(f.name)
@@ -0,0 +1,164 @@
+# history_store.py: Server-side conversation history keyed by session id
+"""
+Keeps each session's turns in a bounded ring buffer (deque) in memory, so
+the Flask cookie only carries a session id instead of the whole history.
+
+Idle sessions are evicted least-recently-used first, by count and by idle
+time. If HISTORY_DB is set, turns are also appended to SQLite, and a
+session evicted from memory is reloaded from there on its next request.
+Sequence numbers are allocated inside the write transaction, so several
+worker processes appending to one session never overwrite each other's turns.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from logger import log_change
+from tracing import traced
+
+MAX_TURNS = 100          # Turns kept per session
+MAX_SESSIONS = 1000      # Sessions kept in memory
+IDLE_TIMEOUT = 6 * 3600  # Seconds before an idle session is dropped from memory
+HISTORY_DB = os.environ.get("HISTORY_DB")  # Optional SQLite persistence path
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS turns (
+        sid     TEXT NOT NULL,
+        seq     INTEGER NOT NULL,
+        user    TEXT NOT NULL,
+        ai      TEXT NOT NULL,
+        created REAL NOT NULL,
+        PRIMARY KEY (sid, seq)
+    )
+    """,
+)
+
+class _Session:
+    __slots__ = ('turns', 'last_seen')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.last_seen = time.time()
+
+class HistoryStore:
+    """Per-session ring buffers with LRU/idle eviction and optional SQLite backing."""
+
+    def __init__(self, max_turns=MAX_TURNS, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT, db_path=HISTORY_DB):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.db_path = db_path
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.evictions = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def _session(self, sid):
+        """Return the live session (loading or creating it); caller holds the lock."""
+        session = self._sessions.get(sid)
+        if session is None:
+            session = self._sessions[sid] = self._load(sid)
+            self._evict()
+        else:
+            self._sessions.move_to_end(sid)
+        session.last_seen = time.time()
+        return session
+
+    def _load(self, sid):
+        session = _Session(self.max_turns)
+        if not self.db_path:
+            return session
+        try:
+            rows = self._connect().execute(
+                "SELECT user, ai FROM turns WHERE sid = ? ORDER BY seq DESC LIMIT ?", (sid, self.max_turns)
+            ).fetchall()
+        except sqlite3.Error as e:
+            log_change("History load error", str(e), level='ERROR')
+            return session
+        for user, ai in reversed(rows):
+            session.turns.append((user, json.loads(ai)))
+        return session
+
+    def _evict(self):
+        cutoff = time.time() - self.idle_timeout
+        while self._sessions:
+            sid, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and oldest.last_seen >= cutoff:
+                break
+            del self._sessions[sid]
+            self.evictions += 1
+
+    @traced('history.append')
+    def append(self, sid, user, ai):
+        """Record one turn; the oldest turn falls off once max_turns is reached."""
+        with self._lock:
+            session = self._session(sid)
+            session.turns.append((user, ai))
+        if self.db_path:
+            conn = self._connect()
+            try:
+                # The next seq is read under the write lock, so concurrent writers can't take the same one
+                conn.execute("BEGIN IMMEDIATE")
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM turns WHERE sid = ?", (sid,)).fetchone()[0]
+                conn.execute("INSERT INTO turns (sid, seq, user, ai, created) VALUES (?, ?, ?, ?, ?)",
+                             (sid, seq, user, json.dumps(ai), time.time()))
+                conn.execute("DELETE FROM turns WHERE sid = ? AND seq <= ?", (sid, seq - self.max_turns))
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                log_change("History write error", str(e), level='ERROR')
+
+    @traced('history.recent')
+    def recent(self, sid, n):
+        """The last n turns (oldest first), without copying the whole buffer."""
+        with self._lock:
+            session = self._session(sid)
+            last = list(islice(reversed(session.turns), n))
+        last.reverse()
+        return last
+
+    def clear(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+        if self.db_path:
+            try:
+                self._connect().execute("DELETE FROM turns WHERE sid = ?", (sid,))
+            except sqlite3.Error as e:
+                log_change("History clear error", str(e), level='ERROR')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'turns': sum(len(s.turns) for s in self._sessions.values()),
+                'evictions': self.evictions,
+                'persistent': bool(self.db_path),
+            }
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_history_store():
+    """Return the process-wide history store, creating it on first use."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = HistoryStore()
+    return _STORE
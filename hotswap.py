@@ -0,0 +1,214 @@
+# hotswap.py: Versioned hot-reload of the core module
+"""
+Keeps accepted patches live without restarting the server.
+
+The registry holds the active version of core (module object, source and
+hash) plus the last few versions in memory. load() execs new source into a
+fresh module, checks it exposes the entry points and answers the smoke
+tests, and only then swaps the active pointer (a single assignment, so
+there is no window where callers see a half-loaded module).
+
+The dispatcher functions below resolve the active version once per call:
+a request that started on version N finishes on version N even if N+1 is
+swapped in meanwhile. restore() reactivates a kept version instantly from
+memory when its source matches, and load()s it otherwise.
+
+Other worker processes learn about a change through the file: at most
+every FILE_CHECK_INTERVAL seconds active() stats core.py and, if its
+mtime or size changed and its hash differs from the live version, loads
+it. Rollbacks go through modify.rollback(), which restores the snapshot,
+writes the file and calls restore().
+"""
+
+import hashlib
+import importlib
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque
+from logger import log_change
+
+CORE_MODULE = 'core'
+CORE_FILE = 'core.py'
+KEEP_VERSIONS = 5  # Previous versions kept in memory for rollback
+FILE_CHECK_INTERVAL = 1.0  # Seconds between checks of core.py for changes made by other workers
+REQUIRED = ('process_query', 'process_query_async', 'process_query_stream', 'apply_rules',
+            'build_prompt', 'finish_llm_response', 'error_response', 'rule_stats')
+SMOKE_TESTS = [("hello", "Hello! How can I help you today?"), ("sort 3 1 2", [1, 2, 3])]
+
+def _sha(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+class Version:
+    __slots__ = ('number', 'module', 'source', 'sha', 'loaded')
+
+    def __init__(self, number, module, source):
+        self.number = number
+        self.module = module
+        self.source = source
+        self.sha = _sha(source)
+        self.loaded = time.time()
+
+    def info(self):
+        return {'version': self.number, 'sha256': self.sha, 'loaded': self.loaded}
+
+class ModuleRegistry:
+    """Active and previous versions of one module, swapped atomically."""
+
+    def __init__(self, name=CORE_MODULE, path=CORE_FILE, required=REQUIRED, smoke_tests=SMOKE_TESTS,
+                 keep=KEEP_VERSIONS):
+        self.name = name
+        self.path = path
+        self.required = required
+        self.smoke_tests = smoke_tests
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._previous = deque(maxlen=keep)
+        self.swaps = 0
+        self.rollbacks = 0
+        module = importlib.import_module(name)
+        self._file_stat = self._stat()
+        with open(path, 'r') as f:
+            self._active = Version(1, module, f.read())
+        self._next = 2
+        self._next_check = time.monotonic() + FILE_CHECK_INTERVAL
+
+    def active(self):
+        """The module callers should use for this request."""
+        if time.monotonic() >= self._next_check:
+            self.sync_with_file()
+        return self._active.module
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def sync_with_file(self):
+        """Load the file if another process changed it (a no-op while another thread checks)."""
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + FILE_CHECK_INTERVAL
+            stat = self._stat()
+            if stat is None or stat == self._file_stat:
+                return
+            with open(self.path, 'r') as f:
+                source = f.read()
+            # Record the stat first: a source that fails validation isn't retried every interval
+            self._file_stat = stat
+            if _sha(source) != self._active.sha:
+                try:
+                    self.restore(source)
+                except Exception as e:
+                    log_change("Hot-swap from file failed", f"{self.path}: {e}", level='ERROR')
+        finally:
+            self._sync_lock.release()
+
+    def _build(self, source):
+        module = types.ModuleType(self.name)
+        module.__file__ = self.path
+        exec(compile(source, self.path, 'exec'), module.__dict__)
+        return module
+
+    def _validate(self, module):
+        missing = [attr for attr in self.required if not callable(getattr(module, attr, None))]
+        if missing:
+            raise ValueError(f"Missing entry points: {', '.join(missing)}")
+        for case, expected in self.smoke_tests:
+            result = module.process_query(case)
+            if result != expected:
+                raise ValueError(f"Smoke test failed for {case!r}: got {result!r}")
+
+    def _activate(self, version):
+        # Caller holds the lock. New imports of the module see the new version too.
+        self._active = version
+        sys.modules[self.name] = version.module
+
+    def load(self, source=None):
+        """Build, validate and activate new source (default: re-read the file). Returns the version info."""
+        if source is None:
+            with open(self.path, 'r') as f:
+                source = f.read()
+        module = self._build(source)
+        self._validate(module)
+        with self._lock:
+            version = Version(self._next, module, source)
+            self._next += 1
+            self._previous.append(self._active)
+            self._activate(version)
+            self.swaps += 1
+        log_change("Hot-swapped module", f"{self.name} -> version {version.number} ({version.sha[:12]})")
+        return version.info()
+
+    def restore(self, source):
+        """Make source live: reactivate the kept version with its hash, else load() it. Returns the version info."""
+        sha = _sha(source)
+        with self._lock:
+            if self._active.sha == sha:
+                return self._active.info()
+            version = next((v for v in reversed(self._previous) if v.sha == sha), None)
+            if version is not None:
+                self._previous.remove(version)
+                self._previous.append(self._active)
+                self._activate(version)
+                self.rollbacks += 1
+        if version is None:
+            return self.load(source)
+        log_change("Reactivated module", f"{self.name} -> version {version.number}", level='WARNING')
+        return version.info()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active.info(),
+                'previous': [v.info() for v in self._previous],
+                'swaps': self.swaps,
+                'rollbacks': self.rollbacks,
+            }
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+def get_registry():
+    """Return the process-wide registry for core, creating it on first use."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = ModuleRegistry()
+    return _REGISTRY
+
+def active_core():
+    """The core module version serving new requests."""
+    return get_registry().active()
+
+# --- Dispatchers: resolve the active version once, at call time ---
+
+def process_query(query, history=None):
+    return active_core().process_query(query, history)
+
+async def process_query_async(query, history=None):
+    return await active_core().process_query_async(query, history)
+
+def process_query_stream(query, history=None):
+    return active_core().process_query_stream(query, history)
+
+def rule_stats():
+    return active_core().rule_stats()
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    registry = get_registry()
+    print(process_query("hello"))
+    with open(CORE_FILE) as f:
+        patched = f.read().replace("How can I help you today?", "How can I help you today?!")
+    registry.smoke_tests = []
+    print(registry.load(patched), process_query("hello"))
+    with open(CORE_FILE) as f:
+        print(registry.restore(f.read()), process_query("hello"))
+    print(registry.stats())
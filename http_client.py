@@ -0,0 +1,205 @@
+# http_client.py: Pooled keep-alive HTTP client for the LLM backend
+"""
+One module-level requests.Session shared by every LLM call, so repeated
+misses reuse TCP+TLS connections instead of handshaking each time.
+
+Every request has connect/read timeouts and is retried on connection
+errors, timeouts, 429 and 5xx with jittered exponential backoff. A
+Retry-After header from the server takes precedence over the computed delay.
+Per-request latency is recorded and available through latency_stats().
+
+post_json_async() is the coroutine variant: it runs post_json() in the
+default executor, so async callers share the same pooled session. (Flask
+runs each async view on a fresh event loop, so a per-loop async client
+would never reuse a connection.)
+
+Set LLM_API_URL to point the client at a local stub server for testing.
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from logger import log_change
+from metrics import LLM_LATENCY, LLM_REQUESTS
+from tracing import traced
+
+API_URL = os.environ.get("LLM_API_URL", "https://router.huggingface.co/v1/chat/completions")
+
+# Connection pool and timeout settings
+POOL_CONNECTIONS = 4   # distinct hosts kept in the pool
+POOL_MAXSIZE = 16      # concurrent connections per host
+CONNECT_TIMEOUT = 5.0  # seconds
+READ_TIMEOUT = 60.0    # seconds
+
+# Retry settings
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5     # seconds, doubled per attempt
+BACKOFF_MAX = 20.0     # cap for computed and Retry-After delays
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_session = None
+_session_lock = threading.Lock()
+_latencies = deque(maxlen=1000)  # (seconds, status or None, attempts)
+
+def get_session():
+    """Return the shared pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def configure(pool_maxsize=None, connect_timeout=None, read_timeout=None, max_retries=None):
+    """Adjust pool/timeout/retry settings; the session is rebuilt on next use."""
+    global POOL_MAXSIZE, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES, _session
+    with _session_lock:
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = pool_maxsize
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+        if max_retries is not None:
+            MAX_RETRIES = max_retries
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def _retry_after(response):
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP-date), or None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, response=None):
+    """Delay before retry number `attempt` (0-based): Retry-After, else full-jitter exponential."""
+    delay = _retry_after(response)
+    if delay is None:
+        delay = random.uniform(0, BACKOFF_BASE * (2 ** attempt))
+    return min(delay, BACKOFF_MAX)
+
+@traced('llm.http')
+def post_json(url, payload, headers=None, timeout=None, retries=None, stream=False):
+    """
+    POST a JSON payload through the pooled session with retries.
+
+    Returns the final requests.Response (raise_for_status() has been called on it).
+    Raises requests.exceptions.RequestException once retries are exhausted.
+    """
+    session = get_session()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    retries = MAX_RETRIES if retries is None else retries
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = session.post(url, headers=headers, json=payload, timeout=timeout, stream=stream)
+            if response.status_code in RETRY_STATUSES and attempt < retries:
+                raise requests.exceptions.HTTPError(f"{response.status_code} from {url}", response=response)
+            response.raise_for_status()
+            _record(start, response.status_code, attempt + 1)
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+            status = response.status_code if response is not None else None
+            retryable = status is None or status in RETRY_STATUSES
+            if not retryable or attempt >= retries:
+                _record(start, status, attempt + 1)
+                raise
+            delay = backoff_delay(attempt, response)
+            log_change("LLM request retry", f"attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s", level='WARNING')
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+async def post_json_async(url, payload, headers=None, retries=None):
+    """
+    Coroutine variant of post_json() with the same pool, timeouts and retry
+    policy: the blocking call runs in a worker thread, so the event loop
+    stays free while the LLM answers. Returns the requests.Response.
+    """
+    return await asyncio.to_thread(post_json, url, payload, headers=headers, retries=retries)
+
+def _record(start, status, attempts):
+    latency = time.perf_counter() - start
+    _latencies.append((latency, status, attempts))
+    LLM_LATENCY.observe(latency)
+    LLM_REQUESTS.labels(str(status)).inc()
+    return latency
+
+def last_latency():
+    """(seconds, status, attempts) for the most recent request, or None."""
+    return _latencies[-1] if _latencies else None
+
+def latency_stats():
+    """Summary of recent per-request latencies (including retries and backoff)."""
+    samples = list(_latencies)
+    if not samples:
+        return {'count': 0}
+    times = sorted(s[0] for s in samples)
+    pick = lambda q: times[min(len(times) - 1, int(q * len(times)))]
+    return {
+        'count': len(times),
+        'avg': sum(times) / len(times),
+        'p50': pick(0.50),
+        'p95': pick(0.95),
+        'max': times[-1],
+        'retried': sum(1 for s in samples if s[2] > 1),
+        'errors': sum(1 for s in samples if s[1] is None or s[1] >= 400),
+    }
+
+# Self-check against a local stub server (run with python http_client.py)
+if __name__ == "__main__":
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    calls = []
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            calls.append(self.path)
+            if len(calls) == 1:
+                self.send_response(503)
+                self.send_header("Retry-After", "0.1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.dumps({"choices": [{"message": {"content": "stub ok"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    resp = post_json(url, {"messages": []})
+    print(resp.json()["choices"][0]["message"]["content"], f"after {len(calls)} calls")
+    print(latency_stats())
+    server.shutdown()
@@ -1,38 +1,122 @@
 import requests
 import os
 import json
+import re
 from logger import log_change
+from cache_store import get_store
+from semantic_cache import get_semantic_cache
+from http_client import API_URL, post_json, post_json_async
+from singleflight import SingleFlight
 
-CACHE_FILE = 'llm_cache.json'
+# Concurrent misses for the same cache key share one upstream request
+_inflight = SingleFlight()
 
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_cache(cache):
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache, f)
-
-def query_llm(prompt, model="meta-llama/Meta-Llama-3-8B-Instruct", max_tokens=200, temperature=0.7):
+def query_llm(prompt, model="meta-llama/Meta-Llama-3-8B-Instruct", max_tokens=200, temperature=0.7, cache_hint=None):
     """
     Query Hugging Face API (initially); cache results.
     Accepts temperature for control over response creativity.
+    cache_hint is the bare user query when the answer doesn't depend on the
+    rest of the prompt (history); it enables the query-level cache tiers.
     """
-    cache = load_cache()
+    cache = get_semantic_cache()
     # Cache key includes temperature to prevent conflicting results for the same prompt
     cache_key = f"{prompt}::{temperature}"
 
-    if cache_key in cache:
-        return cache[cache_key]
+    cached = cache.get(cache_key, prompt, temperature, cache_hint)
+    if cached is not None:
+        return cached
+
+    api_key = os.environ.get("HF_TOKEN") or os.environ.get("HF_API_KEY")
+    if not api_key:
+        return _mock_response(prompt, temperature)
+
+    payload, headers = _build_request(prompt, model, max_tokens, temperature, api_key)
+    remember = lambda generated: cache.put(cache_key, prompt, temperature, generated, cache_hint)
+    recheck = lambda: cache.peek(cache_key, prompt, temperature, cache_hint)
+    return _inflight.do(cache_key, lambda: _fetch_completion(recheck, payload, headers, remember))
+
+async def query_llm_async(prompt, model="meta-llama/Meta-Llama-3-8B-Instruct", max_tokens=200, temperature=0.7, cache_hint=None):
+    """Coroutine variant of query_llm(); shares its cache and in-flight deduplication."""
+    cache = get_semantic_cache()
+    cache_key = f"{prompt}::{temperature}"
+
+    cached = cache.get(cache_key, prompt, temperature, cache_hint)
+    if cached is not None:
+        return cached
 
     api_key = os.environ.get("HF_TOKEN") or os.environ.get("HF_API_KEY")
     if not api_key:
-        log_change("No API key; using mock response for testing", prompt)
-        # Mock for testing: return a simple diff or response based on prompt
-        if "sort" in prompt and temperature < 0.3:
-            return '''--- core.py
+        return _mock_response(prompt, temperature)
+
+    payload, headers = _build_request(prompt, model, max_tokens, temperature, api_key)
+    remember = lambda generated: cache.put(cache_key, prompt, temperature, generated, cache_hint)
+    recheck = lambda: cache.peek(cache_key, prompt, temperature, cache_hint)
+    return await _inflight.do_async(cache_key, lambda: _fetch_completion_async(recheck, payload, headers, remember))
+
+def query_llm_stream(prompt, model="meta-llama/Meta-Llama-3-8B-Instruct", max_tokens=200, temperature=0.7, cache_hint=None):
+    """
+    Streaming variant of query_llm(): yields text chunks as the model generates them.
+
+    Cache hits (and mock responses) are replayed as a stream. A completed
+    stream is written to the cache so the next identical call is a hit.
+    """
+    cache = get_semantic_cache()
+    cache_key = f"{prompt}::{temperature}"
+
+    cached = cache.get(cache_key, prompt, temperature, cache_hint)
+    if cached is None:
+        api_key = os.environ.get("HF_TOKEN") or os.environ.get("HF_API_KEY")
+        if not api_key:
+            cached = _mock_response(prompt, temperature)
+    if cached is not None:
+        yield from replay_chunks(cached)
+        return
+
+    payload, headers = _build_request(prompt, model, max_tokens, temperature, api_key)
+    payload["stream"] = True
+    parts = []
+    response = None
+    try:
+        response = post_json(API_URL, payload, headers=headers, stream=True)
+        for chunk in _iter_stream_deltas(response):
+            parts.append(chunk)
+            yield chunk
+    except requests.exceptions.RequestException as e:
+        _log_request_error(e, response)
+        return
+    finally:
+        if response is not None:
+            response.close()
+
+    generated = "".join(parts).strip()
+    if generated:
+        cache.put(cache_key, prompt, temperature, generated, cache_hint)
+
+def replay_chunks(text):
+    """Split a complete response into word-sized chunks for streaming replay."""
+    return re.findall(r'\s*\S+\s*', text) or ([text] if text else [])
+
+def _iter_stream_deltas(response):
+    """Parse chat-completions SSE lines ('data: {...}') into content deltas."""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+        except (ValueError, KeyError, IndexError):
+            log_change("Invalid LLM stream chunk", data[:200])
+            continue
+        if delta:
+            yield delta
+
+def _mock_response(prompt, temperature):
+    log_change("No API key; using mock response for testing", prompt)
+    # Mock for testing: return a simple diff or response based on prompt
+    if "sort" in prompt and temperature < 0.3:
+        return '''--- core.py
 +++ core.py
 @@ -10,7 +10,8 @@ def process_query(query):
              numbers = [int(x) for x in query.split()[1:]]  # e.g., "sort 3 1 2"
@@ -40,9 +124,9 @@ def query_llm(prompt, model="meta-llama/Meta-Llama-3-8B-Instruct", max_tokens=20
 +            numbers.sort()  # In-place sort for better efficiency on large lists
 +            return numbers
  '''
-        return "Mock response: Improvement applied."
+    return "Mock response: Improvement applied."
 
-    url = "https://router.huggingface.co/v1/chat/completions"
+def _build_request(prompt, model, max_tokens, temperature, api_key):
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -53,25 +137,60 @@ def query_llm(prompt, model="meta-llama/Meta-Llama-3-8B-Instruct", max_tokens=20
         "max_tokens": max_tokens,
         "temperature": temperature # CORRECTED: Pass temperature to payload
     }
+    return payload, headers
+
+def _fetch_completion(recheck, payload, headers, remember):
+    """Single upstream call for a cache miss; run once per key by the single-flight group."""
+    # Another process may have filled the entry while this call waited its turn
+    cached = recheck()
+    if cached is not None:
+        return cached
+
     response = None
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        generated = response.json()["choices"][0]["message"]["content"].strip()
-        if generated:
-            cache[cache_key] = generated
-            save_cache(cache)
-        return generated
+        # Pooled session with timeouts; retries 429/5xx with backoff
+        response = post_json(API_URL, payload, headers=headers)
+        return _store_completion(response, remember)
     except requests.exceptions.RequestException as e:
-        log_change("LLM query error", str(e))
-        if response is not None:
-            try:
-                error_details = response.json()
-                log_change("LLM error details", str(error_details))
-            except:
-                pass
+        return _log_request_error(e, response)
+    except KeyError:
+        log_change("Invalid LLM response")
         return None
+
+async def _fetch_completion_async(recheck, payload, headers, remember):
+    cached = recheck()
+    if cached is not None:
+        return cached
+
+    try:
+        response = await post_json_async(API_URL, payload, headers=headers)
+        return _store_completion(response, remember)
+    except requests.exceptions.RequestException as e:
+        return _log_request_error(e, None)
     except KeyError:
         log_change("Invalid LLM response")
         return None
 
+def _store_completion(response, remember):
+    generated = response.json()["choices"][0]["message"]["content"].strip()
+    if generated:
+        remember(generated)
+    return generated
+
+def _log_request_error(e, response):
+    log_change("LLM query error", str(e), level='ERROR')
+    response = response if response is not None else getattr(e, 'response', None)
+    if response is not None:
+        try:
+            error_details = response.json()
+            log_change("LLM error details", str(error_details))
+        except:
+            pass
+    return None
+
+def cache_stats():
+    """Hit/miss/eviction counters and sizes for the LLM response cache tiers."""
+    stats = get_store().stats()
+    stats['lookup_tiers'] = get_semantic_cache().stats()
+    stats['single_flight'] = _inflight.stats()
+    return stats
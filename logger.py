@@ -1,25 +1,221 @@
 # logger.py: Enhanced logging
+"""
+Structured, non-blocking change log.
+
+log_change() only puts a record on an in-memory queue. A background
+writer thread drains the queue in batches and appends JSON lines to
+LOG_FILE, so request paths never wait on disk. The log rotates by size and
+age, and rotated segments can be gzip-compressed. Large payloads such as
+prompts (which embed whole source files) and diffs are written once to
+BLOB_DIR under their SHA-256, and records reference them by hash; blobs
+no retained segment references are deleted when the log rotates.
+"""
+
+import atexit
 import datetime
+import gzip
+import hashlib
+import json
 import os
+import queue
+import re
+import shutil
+import threading
+import time
+from tracing import span
+
+LOG_FILE = 'changes.log'
+BLOB_DIR = 'log_blobs'
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+MIN_LEVEL = 'INFO'
+
+QUEUE_SIZE = 10000       # Records buffered before new ones are dropped
+BATCH_SIZE = 500         # Records written per flush
+FLUSH_INTERVAL = 0.5     # Seconds between flushes when the queue is quiet
+MAX_BYTES = 10 * 1024 * 1024   # Rotate when the log exceeds this size...
+ROTATE_INTERVAL = 24 * 3600    # ...or is older than this many seconds
+BACKUP_COUNT = 5         # Rotated segments kept
+COMPRESS_ROTATED = True  # gzip rotated segments
+BLOB_THRESHOLD = 2048    # Fields longer than this (chars) are stored by hash
+BLOB_REF_RE = re.compile(rb'"\w+_sha256": "([0-9a-f]{64})"')
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+_segment_started = None
+dropped = 0
 
-def log_change(message, details=None, prompt=None, generated=None):
+def log_change(message, details=None, prompt=None, generated=None, level='INFO'):
     """Log to file with optional details, LLM prompt, and generated output."""
+    global dropped
+    if LEVELS.get(level, 20) < LEVELS[MIN_LEVEL]:
+        return
     try:
-        timestamp = datetime.datetime.now().isoformat()
-        log_entry = f"{timestamp}: {message}"
-        if details:
-            log_entry += f"\nDetails: {details}"
-        if prompt:
-            log_entry += f"\nLLM Prompt: {prompt}"
-        if generated:
-            log_entry += f"\nGenerated: {generated}"
-        with open('changes.log', 'a') as f:
-            f.write(log_entry + "\n\n")
-    except IOError as e:
-        print(f"Logging error: {e}")
+        # Only the enqueue is on the caller's path; the writer thread does the disk I/O
+        with span('log_change', message=message):
+            _ensure_writer()
+            _queue.put_nowait((time.time(), level, message, details, prompt, generated))
+    except queue.Full:
+        dropped += 1
     except Exception as e:
         print(f"Unexpected logging error: {e}")
 
+def flush(timeout=5.0):
+    """Block until queued records are written (for shutdown, tests and CLI runs)."""
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.01)
+    return _queue.unfinished_tasks == 0
+
+def _ensure_writer():
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_write_loop, name='log-writer', daemon=True)
+                _writer.start()
+
+def _write_loop():
+    while True:
+        try:
+            batch = [_queue.get(timeout=FLUSH_INTERVAL)]
+        except queue.Empty:
+            continue
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _rotate_if_needed()
+            lines = [_format(*item) for item in batch]
+            with open(LOG_FILE, 'a') as f:
+                f.write("".join(lines))
+        except IOError as e:
+            print(f"Logging error: {e}")
+        except Exception as e:
+            print(f"Unexpected logging error: {e}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+def _format(ts, level, message, details, prompt, generated):
+    record = {
+        'ts': datetime.datetime.fromtimestamp(ts).isoformat(),
+        'level': level,
+        'message': message,
+    }
+    for name, value in (('details', details), ('prompt', prompt), ('generated', generated)):
+        if value is None or value == '':
+            continue
+        if not isinstance(value, str):
+            value = str(value)
+        if len(value) > BLOB_THRESHOLD:
+            record[f'{name}_sha256'] = _store_blob(value)
+            record[f'{name}_len'] = len(value)
+        else:
+            record[name] = value
+    return json.dumps(record) + "\n"
+
+def _store_blob(text):
+    """Write text once under its content hash and return the hash."""
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    path = os.path.join(BLOB_DIR, digest)
+    try:
+        # Already stored: refresh its mtime so a concurrent _prune_blobs() keeps it
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(BLOB_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return digest
+
+def read_blob(digest):
+    """Return the payload stored under digest (as referenced by a '*_sha256' field)."""
+    with open(os.path.join(BLOB_DIR, digest), 'r') as f:
+        return f.read()
+
+def _rotate_if_needed():
+    global _segment_started
+    try:
+        st = os.stat(LOG_FILE)
+    except FileNotFoundError:
+        _segment_started = time.time()
+        return
+    if _segment_started is None:
+        _segment_started = _segment_start(st)
+    too_big = st.st_size >= MAX_BYTES
+    too_old = ROTATE_INTERVAL and time.time() - _segment_started >= ROTATE_INTERVAL
+    if not (too_big or too_old):
+        return
+    _segment_started = time.time()
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    rotated = f"{LOG_FILE}.{stamp}"
+    os.replace(LOG_FILE, rotated)
+    if COMPRESS_ROTATED:
+        with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+    _prune_segments()
+
+def _segment_start(st):
+    # Creation time isn't portable; the first record's timestamp marks the segment start
+    try:
+        with open(LOG_FILE, 'r') as f:
+            first = json.loads(f.readline())
+        return datetime.datetime.fromisoformat(first['ts']).timestamp()
+    except (ValueError, KeyError, IOError):
+        return st.st_mtime
+
+def _prune_segments():
+    directory = os.path.dirname(os.path.abspath(LOG_FILE))
+    prefix = os.path.basename(LOG_FILE) + '.'
+    segments = sorted(name for name in os.listdir(directory) if name.startswith(prefix))
+    for name in segments[:-BACKUP_COUNT] if BACKUP_COUNT else segments:
+        os.remove(os.path.join(directory, name))
+    _prune_blobs()
+
+def _prune_blobs():
+    """Delete blobs that neither the live log nor a retained segment references."""
+    started = time.time()
+    directory = os.path.dirname(os.path.abspath(LOG_FILE))
+    prefix = os.path.basename(LOG_FILE) + '.'
+    referenced = set()
+    for name in [os.path.basename(LOG_FILE)] + [n for n in os.listdir(directory) if n.startswith(prefix)]:
+        opener = gzip.open if name.endswith('.gz') else open
+        try:
+            with opener(os.path.join(directory, name), 'rb') as f:
+                referenced.update(m.decode() for m in BLOB_REF_RE.findall(f.read()))
+        except (IOError, EOFError):
+            continue  # Gone meanwhile, or a segment still being compressed
+    try:
+        names = os.listdir(BLOB_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(BLOB_DIR, name)
+        try:
+            # Blobs written or reused since the scan began belong to records not on disk yet
+            if name not in referenced and os.stat(path).st_mtime < started:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _reset_after_fork():
+    # Forked workers (sandbox, benchmarks) get a fresh queue and start their own writer
+    global _queue, _writer, _writer_lock
+    _queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _writer = None
+    _writer_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(flush)
+
 # Example usage (comment out for production)
 if __name__ == "__main__":
-    log_change("Test log", details="Detail here", prompt="Test prompt", generated="Test code")
\ No newline at end of file
+    log_change("Test log", details="Detail here", prompt="Test prompt", generated="Test code")
+    log_change("Large payload", prompt="x" * (BLOB_THRESHOLD + 1), level='WARNING')
+    flush()
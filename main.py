@@ -2,9 +2,9 @@
 import threading
 import time
 import os
-from test import monitor_resources
+from monitor import monitor_resources
 from reflect import reflect_and_expand, get_current_phase
-from core import process_query
+from hotswap import process_query
 from logger import log_change
 
 conversation_history = []  # Prep for later phases
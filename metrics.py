@@ -0,0 +1,352 @@
+# metrics.py: Process metrics, counters/histograms and Prometheus exposition
+"""
+One metrics subsystem for the whole process.
+
+- Counters and histograms are sharded per thread: each thread only ever
+  writes its own cells, so the hot path takes no lock, and readers sum the
+  shards when /metrics is scraped.
+- ResourceSampler samples this process (RSS, CPU %, threads, open fds)
+  every SAMPLE_INTERVAL seconds into gauges, using psutil's non-blocking
+  cpu_percent, and raises alerts when limits are crossed.
+- AlertBus keeps recent alerts in a ring with sequence numbers; every
+  subscriber has its own cursor, so each one sees every alert once no
+  matter who polls first.
+
+exposition() renders everything in the Prometheus text format.
+"""
+
+import bisect
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from logger import log_change
+
+SAMPLE_INTERVAL = float(os.environ.get("METRICS_SAMPLE_INTERVAL", 5.0))  # Seconds between samples
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ALERT_HISTORY = 100      # Alerts kept for subscribers that fall behind
+MAX_SUBSCRIBERS = 10000  # Cursors kept (least recently used are dropped)
+
+class _Shards:
+    """Per-thread cells of a fixed width; only the owning thread writes a cell."""
+
+    def __init__(self, width):
+        self.width = width
+        self._local = threading.local()
+        self._cells = []               # (thread, cell)
+        self._retired = [0] * width    # Folded-in cells of finished threads
+        self._lock = threading.Lock()  # Taken once per thread (cell creation) and by readers
+
+    def cell(self):
+        cell = getattr(self._local, 'cell', None)
+        if cell is None:
+            cell = self._local.cell = [0] * self.width
+            with self._lock:
+                if len(self._cells) >= 64:
+                    self._fold_dead()
+                self._cells.append((threading.current_thread(), cell))
+        return cell
+
+    def _fold_dead(self):
+        # Short-lived request threads would otherwise leave a cell behind each
+        live = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                live.append((thread, cell))
+            else:
+                self._retired = [a + b for a, b in zip(self._retired, cell)]
+        self._cells = live
+
+    def totals(self):
+        with self._lock:
+            self._fold_dead()
+            totals = list(self._retired)
+            for _, cell in self._cells:
+                totals = [a + b for a, b in zip(totals, cell)]
+        return totals
+
+class Counter:
+    __slots__ = ('_shards',)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.cell()[0] += amount
+
+    def value(self):
+        return self._shards.totals()[0]
+
+class Gauge:
+    __slots__ = ('_value',)
+
+    def __init__(self):
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value  # Single attribute store; last writer wins
+
+    def value(self):
+        return self._value
+
+class Histogram:
+    """Cumulative-bucket histogram; cells are [bucket counts..., +Inf count, sum]."""
+    __slots__ = ('buckets', '_shards')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._shards = _Shards(len(self.buckets) + 2)
+
+    def observe(self, value):
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        """(cumulative counts per bucket including +Inf, total count, sum)."""
+        totals = self._shards.totals()
+        cumulative = list(itertools.accumulate(totals[:-1]))
+        return cumulative, cumulative[-1], totals[-1]
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Family:
+    """A named metric with optional labels; labels(...) returns the child for those values."""
+
+    def __init__(self, kind, name, help_text, labelnames=(), factory=None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def __getattr__(self, attr):
+        # Unlabelled families proxy to their single child: counter.inc(), histogram.observe()
+        if not self.labelnames and not attr.startswith('_'):
+            return getattr(self._children[()], attr)
+        raise AttributeError(attr)
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+class Registry:
+    def __init__(self):
+        self._families = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _family(self, kind, name, help_text, labelnames, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(kind, name, help_text, labelnames, factory)
+            return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._family('counter', name, help_text, labelnames, Counter)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._family('gauge', name, help_text, labelnames, Gauge)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._family('histogram', name, help_text, labelnames, lambda: Histogram(buckets))
+
+    def exposition(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            families = list(self._families.values())
+        lines = []
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children():
+                labels = [f'{name}="{_escape(value)}"' for name, value in zip(family.labelnames, values)]
+                if family.kind == 'histogram':
+                    cumulative, count, total = child.snapshot()
+                    for bound, n in zip(list(child.buckets) + ['+Inf'], cumulative):
+                        le = 'le="%s"' % bound
+                        lines.append(f"{family.name}_bucket{_fmt_labels(labels + [le])} {n}")
+                    lines.append(f"{family.name}_count{_fmt_labels(labels)} {count}")
+                    lines.append(f"{family.name}_sum{_fmt_labels(labels)} {total}")
+                else:
+                    lines.append(f"{family.name}{_fmt_labels(labels)} {child.value()}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt_labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+REGISTRY = Registry()
+
+# Shared instruments (modules record into these)
+REQUEST_LATENCY = REGISTRY.histogram('http_request_duration_seconds', 'HTTP request latency.', ('endpoint',))
+REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests by endpoint and status.', ('endpoint', 'status'))
+CACHE_LOOKUPS = REGISTRY.counter('llm_cache_lookups_total', 'LLM cache lookups by tier that answered (or miss).', ('tier',))
+LLM_LATENCY = REGISTRY.histogram('llm_request_duration_seconds', 'Upstream LLM request time, including retries.')
+LLM_REQUESTS = REGISTRY.counter('llm_requests_total', 'Upstream LLM requests by final status.', ('status',))
+ALERTS = REGISTRY.counter('alerts_total', 'Alerts published.')
+PROCESS_RSS = REGISTRY.gauge('process_resident_memory_bytes', 'Resident set size of this process.')
+PROCESS_CPU = REGISTRY.gauge('process_cpu_percent', 'CPU used by this process since the previous sample (%).')
+PROCESS_THREADS = REGISTRY.gauge('process_threads', 'Threads in this process.')
+PROCESS_FDS = REGISTRY.gauge('process_open_fds', 'Open file descriptors of this process.')
+
+def exposition():
+    return REGISTRY.exposition()
+
+# --- Alerts ----------------------------------------------------------------
+
+class AlertBus:
+    """Ring of recent alerts; each subscriber reads from its own cursor."""
+
+    def __init__(self, history=ALERT_HISTORY, max_subscribers=MAX_SUBSCRIBERS):
+        self._alerts = deque(maxlen=history)  # (seq, ts, message)
+        self._seq = 0
+        self._cursors = OrderedDict()          # subscriber -> last seq seen
+        self._max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def publish(self, message):
+        with self._lock:
+            self._seq += 1
+            self._alerts.append((self._seq, time.time(), message))
+            listeners = list(self._listeners)
+        ALERTS.inc()
+        for listener in listeners:
+            try:
+                listener(message)
+            except Exception as e:
+                log_change("Alert listener error", str(e), level='ERROR')
+
+    def add_listener(self, callback):
+        """Call callback(message) for every alert published from now on."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def read(self, subscriber):
+        """Alerts published since this subscriber's last read (new subscribers start from now)."""
+        with self._lock:
+            cursor = self._cursors.pop(subscriber, None)
+            if cursor is None:
+                cursor = self._seq
+                alerts = []
+            else:
+                alerts = [message for seq, _, message in self._alerts if seq > cursor]
+            self._cursors[subscriber] = self._seq
+            while len(self._cursors) > self._max_subscribers:
+                self._cursors.popitem(last=False)
+            return alerts
+
+    def recent(self, n=ALERT_HISTORY):
+        with self._lock:
+            return [{'seq': seq, 'ts': ts, 'message': message} for seq, ts, message in list(self._alerts)[-n:]]
+
+ALERT_BUS = AlertBus()
+
+# --- Resource sampling -----------------------------------------------------
+
+class ResourceSampler:
+    """Background sampler of this process's resources, publishing alerts over the limits."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL, max_cpu=95, max_rss_mb=4096, quiet=True):
+        self.interval = interval
+        self.max_cpu = max_cpu
+        self.max_rss_mb = max_rss_mb
+        self.quiet = quiet
+        self._stop = threading.Event()
+        self._thread = None
+        try:
+            import psutil  # Loaded with the first sampler, not with every import of metrics
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
+
+    def sample(self):
+        """Take one sample into the gauges; returns it as a dict."""
+        if self._process is None:
+            return {}
+        proc = self._process
+        with proc.oneshot():
+            sample = {
+                'rss': proc.memory_info().rss,
+                'cpu': proc.cpu_percent(interval=None),  # Since the previous call; never blocks
+                'threads': proc.num_threads(),
+                'fds': proc.num_fds() if hasattr(proc, 'num_fds') else proc.num_handles(),
+            }
+        PROCESS_RSS.set(sample['rss'])
+        PROCESS_CPU.set(sample['cpu'])
+        PROCESS_THREADS.set(sample['threads'])
+        PROCESS_FDS.set(sample['fds'])
+        return sample
+
+    def check(self, sample):
+        rss_mb = sample.get('rss', 0) / (1024 ** 2)
+        if sample.get('cpu', 0) > self.max_cpu:
+            alert = f"Resource limit exceeded: CPU at {sample['cpu']:.1f}% (max: {self.max_cpu}%)"
+            ALERT_BUS.publish(alert)
+            log_change("RESOURCE ALERT", alert, level='WARNING')
+        if rss_mb > self.max_rss_mb:
+            alert = f"Resource limit exceeded: Memory at {rss_mb:.0f} MB (max: {self.max_rss_mb} MB)"
+            ALERT_BUS.publish(alert)
+            log_change("RESOURCE ALERT", alert, level='WARNING')
+
+    def run(self):
+        log_change("Starting resource monitor...", f"every {self.interval}s")
+        while not self._stop.is_set():
+            try:
+                sample = self.sample()
+                if not self.quiet:
+                    print(f"Current - CPU: {sample.get('cpu', 0):.1f}%, RSS: {sample.get('rss', 0) / 1024 ** 2:.0f} MB, "
+                          f"threads: {sample.get('threads')}, fds: {sample.get('fds')}")
+                self.check(sample)
+            except Exception as e:
+                log_change("Error in monitoring thread", str(e), level='ERROR')
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='resource-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    sampler = ResourceSampler(interval=0.2, max_rss_mb=1)
+    sampler.sample()
+    sampler.check(sampler.sample())
+    LLM_LATENCY.observe(0.3)
+    CACHE_LOOKUPS.labels('exact').inc()
+    print(exposition())
+    print(ALERT_BUS.read('a'), ALERT_BUS.recent())
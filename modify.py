@@ -1,23 +1,24 @@
 import os
-import subprocess
 import difflib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from llm_query import query_llm
-from analyze import analyze_performance, detect_fail_state
+from analyze import detect_fail_state
+from benchmark import gate_patch, TOLERANCE, MEM_TOLERANCE, TIMING_LOCK, significantly_slower
+from sandbox import evaluate
+from hotswap import get_registry
 from logger import log_change
 from utils import apply_patch
 from phase import get_current_phase
+from snapshot import get_snapshot_store, content_hash
+from context import extract_code_context, record_usage, CODE_BUDGET
 
-# --- Helper to check git config before committing ---
-def check_git_config():
-    """Checks if git user.email and user.name are configured."""
-    try:
-        subprocess.run(['git', 'config', 'user.email'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        subprocess.run(['git', 'config', 'user.name'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        log_change("GIT CONFIG WARNING", "Git user.email or user.name not configured. Skipping commit. Manual configuration required for full logging.")
-        return False
-# ----------------------------------------------------
+CANDIDATE_TEMPERATURES = (0.2, 0.5, 0.8)  # One diff per temperature in a tournament
+
+class StalePatchError(RuntimeError):
+    """The target file changed between evaluating a patch and applying it."""
 
 def ethical_check(diff_str, phase):
     """Check diff for ethical issues."""
@@ -34,87 +35,301 @@ def ethical_check(diff_str, phase):
         log_change("Ethical check failed", str(e))
         return False
 
-def self_modify(improvement_query, target_file='core.py', test_cases=None, max_diff_lines=50):
-    """Use LLM to generate unified diff patch; apply incrementally."""
-    backup_file = target_file + '.backup'
-    needs_commit = check_git_config() # Check config once
+def _patch_prompt(current_code, improvement_query, target_file):
+    # Added instruction to be small and safe
+    # Only the function to change plus an outline of the rest, so the prompt stays within CODE_BUDGET
+    code_context = extract_code_context(current_code, improvement_query, budget=CODE_BUDGET - 200)
+    return f"Generate a SMALL, SAFE, incremental unified diff patch for this Python code based on: {improvement_query}\nFocus on patching ONE specific function (e.g., optimize a function). Output ONLY the unified diff format (starting with --- and +++) against {target_file}, using the line numbers shown, no explanations.\nCurrent code:\n{code_context}"
+
+def _candidate_source(current_code, generated_diff, max_diff_lines, phase):
+    """Validate an LLM diff and apply it; raises ValueError/PatchError saying why it can't be used."""
+    if not generated_diff or not generated_diff.startswith('---'):
+        raise ValueError("Invalid unified diff from LLM or LLM failure.")
+
+    diff_lines = generated_diff.splitlines()
+    if len(diff_lines) > max_diff_lines:
+        raise ValueError("Generated diff too large; rejecting for safety.")
+
+    if not ethical_check(generated_diff, phase):
+        raise ValueError("Ethical fail")
+
+    return apply_patch(current_code, generated_diff)
+
+def prepare_patch(improvement_query, target_file='core.py', test_cases=None, max_diff_lines=50,
+                  tolerance=TOLERANCE, mem_tolerance=MEM_TOLERANCE, candidates=1):
+    """Generate, test and benchmark a patch without touching target_file.
+
+    Returns {'target', 'base_sha', 'diff', 'source', 'benchmark'}: the
+    candidate source and the hash of the code it was made against, so
+    apply_prepared() can later write it without redoing the work.
+    Raises if the LLM output, the tests or the benchmark reject it.
+
+    With candidates > 1 a tournament is run instead (see run_tournament())
+    and the result also carries its 'tournament' report.
+    """
+    with open(target_file, 'r') as f:
+        current_code = f.read()
+
+    prompt = _patch_prompt(current_code, improvement_query, target_file)
+    prompt_tokens = record_usage('code', prompt, CODE_BUDGET)
+    if candidates > 1:
+        return run_tournament(improvement_query, target_file, current_code, prompt, test_cases, max_diff_lines,
+                              tolerance, mem_tolerance, CANDIDATE_TEMPERATURES[:candidates])
+
+    # Use a low temperature for deterministic code generation
+    generated_diff = query_llm(prompt, max_tokens=500, temperature=0.2) 
+    log_change("Generated diff", f"{improvement_query} ({prompt_tokens} prompt tokens)", prompt=prompt, generated=generated_diff)
+
+    updated_code = _candidate_source(current_code, generated_diff, max_diff_lines, get_current_phase())
+
+    # --- Test the candidate in a sandbox worker; the live file is untouched ---
+    if test_cases:
+        with TIMING_LOCK:
+            metrics = evaluate(updated_code, test_cases)
+        if detect_fail_state(metrics, updated_code):
+            raise RuntimeError("Fail state detected post-modification: failed performance/accuracy tests.")
 
+    # --- Regression benchmark against the current source's baseline ---
+    report = gate_patch(current_code, updated_code, tolerance, mem_tolerance)
+    if report['regressed']:
+        raise RuntimeError(f"Performance regression in: {', '.join(report['regressions'])}")
+
+    return {'target': target_file, 'base_sha': content_hash(current_code), 'diff': generated_diff,
+            'source': updated_code, 'benchmark': report}
+
+# --- Best-of-N tournament ----------------------------------------------------
+
+def _run_candidate(n, prompt, temperature, current_code, test_cases, max_diff_lines, phase, seen, seen_lock):
+    """Generate, apply and test one candidate. Returns (entry, source); source is None if it is out."""
+    entry = {'candidate': n, 'temperature': temperature, 'status': 'lost'}
+    start = time.perf_counter()
     try:
-        if needs_commit:
-            subprocess.run(['git', 'add', '.'], check=True)
+        generated_diff = query_llm(prompt, max_tokens=500, temperature=temperature)
+        entry['diff_lines'] = len(generated_diff.splitlines()) if generated_diff else 0
+        source = _candidate_source(current_code, generated_diff, max_diff_lines, phase)
+    except Exception as e:
+        entry['reason'] = f"rejected before testing: {e}"
+        return entry, None
+    finally:
+        entry['generate_s'] = round(time.perf_counter() - start, 3)
 
-            # Only commit if there are changes to commit
-            result = subprocess.run(['git', 'diff', '--cached', '--quiet'], capture_output=True)
-            if result.returncode != 0:  # returncode != 0 means there are changes
-                subprocess.run(['git', 'commit', '-m', f'Pre-modification commit - {target_file}'], check=True)
+    sha = content_hash(source)
+    with seen_lock:
+        first = seen.setdefault(sha, n)
+    if first != n:
+        entry['reason'] = f"identical to candidate {first}"
+        return entry, None
+    entry['diff'] = generated_diff
 
-        with open(target_file, 'r') as f:
-            current_code = f.read()
+    if test_cases:
+        # Correctness only (a single run per case): candidates share the sandbox
+        # pool in parallel here, and only the timing pass in _time_candidates() takes turns
+        metrics = evaluate(source, test_cases, repeat=1, warmup=0)
+        _record_metrics(entry, metrics)
+        if detect_fail_state(metrics, source):
+            entry['reason'] = _failure_reason(metrics)
+            return entry, None
+    return entry, source
 
-        # Added instruction to be small and safe
-        prompt = f"Generate a SMALL, SAFE, incremental unified diff patch for this Python code based on: {improvement_query}\nFocus on patching ONE specific function (e.g., optimize a function). Output ONLY the unified diff format (starting with --- and +++), no explanations.\nCurrent code:\n{current_code}"
+def _record_metrics(entry, metrics):
+    entry.update(avg_acc=metrics['avg_acc'], p50=metrics['p50'], p95=metrics['p95'],
+                 failures=metrics['failures'], timeouts=metrics['timeouts'],
+                 _samples=[case['samples_ns'] for case in metrics['cases']])
 
-        # Use a low temperature for deterministic code generation
-        generated_diff = query_llm(prompt, max_tokens=500, temperature=0.2) 
+def _failure_reason(metrics):
+    return (f"failed tests: accuracy {metrics['avg_acc']:.0%}, "
+            f"{metrics['failures']} failures, {metrics['timeouts']} timeouts")
 
-        if not generated_diff or not generated_diff.startswith('---'):
-            raise ValueError("Invalid unified diff from LLM or LLM failure.")
+def _time_candidates(entries, sources, test_cases):
+    """
+    Timed runs of the candidates that passed, one at a time under TIMING_LOCK
+    so contention between them doesn't decide the ranking. Skipped when fewer
+    than two remain: there is nothing to rank, and gate_patch() times the
+    winner anyway. Returns the entries still in.
+    """
+    if not test_cases or len(entries) < 2:
+        return entries
+    survivors = []
+    for entry in entries:
+        with TIMING_LOCK:
+            metrics = evaluate(sources[entry['candidate']], test_cases)
+        _record_metrics(entry, metrics)
+        if detect_fail_state(metrics, sources[entry['candidate']]):
+            entry['reason'] = _failure_reason(metrics)
+            continue
+        survivors.append(entry)
+    return survivors
 
-        log_change("Generated diff", improvement_query, prompt=prompt, generated=generated_diff)
+def _slower(entry, other):
+    """Whether entry is measurably slower than other on some test case (the benchmark gate's test)."""
+    for mine, theirs in zip(entry.get('_samples', ()), other.get('_samples', ())):
+        if significantly_slower(mine, theirs):
+            return True
+    return False
 
-        diff_lines = generated_diff.splitlines()
-        if len(diff_lines) > max_diff_lines:
-            raise ValueError("Generated diff too large; rejecting for safety.")
+def _rank(entries):
+    """
+    Order surviving candidates by accuracy, then latency. Candidates not
+    measurably slower than the fastest at the same accuracy count as tied,
+    and ties go to the lower (more conservative) temperature.
+    """
+    fastest = {}
+    for e in entries:
+        acc = round(e.get('avg_acc', 1.0), 4)
+        if acc not in fastest or e.get('p50', 0.0) < fastest[acc].get('p50', 0.0):
+            fastest[acc] = e
+    def key(e):
+        acc = round(e.get('avg_acc', 1.0), 4)
+        slower = _slower(e, fastest[acc])
+        return (-acc, slower, e['p50'] if slower else e['temperature'], e['candidate'])
+    return sorted(entries, key=key)
 
-        current_phase = get_current_phase()
-        if not ethical_check(generated_diff, current_phase):
-            raise ValueError("Ethical fail")
+def _loss_reason(entry, winner):
+    if entry.get('avg_acc', 1.0) < winner.get('avg_acc', 1.0):
+        return f"lower accuracy: {entry['avg_acc']:.0%} vs {winner['avg_acc']:.0%}"
+    if _slower(entry, winner):
+        return f"slower: p50 {entry['p50'] * 1e6:.1f} us vs {winner['p50'] * 1e6:.1f} us"
+    return f"not measurably faster than the winner; temperature {entry['temperature']} vs {winner['temperature']}"
 
-        updated_code = apply_patch(current_code, generated_diff)
+def run_tournament(improvement_query, target_file, current_code, prompt, test_cases=None, max_diff_lines=50,
+                   tolerance=TOLERANCE, mem_tolerance=MEM_TOLERANCE, temperatures=None):
+    """
+    Best-of-N: request one diff per temperature concurrently, apply and
+    test each in a sandbox worker, and keep the best by accuracy then
+    latency that also passes the regression gate.
 
-        os.system(f'cp {target_file} {backup_file}')
+    The LLM calls and the correctness runs (one pass per case, on the
+    sandbox pool) overlap. Only the timed runs that rank the survivors take
+    turns under TIMING_LOCK, and they are skipped when just one survives,
+    so wall-clock time is about one LLM round-trip plus one correctness
+    run, then a timed run per survivor and the gate for the finalists.
 
-        with open(target_file, 'w') as f:
-            f.write(updated_code)
+    Returns a prepare_patch() result with a 'tournament' report giving each
+    candidate's numbers and, for the losers, why they lost. Raises if no
+    candidate survives.
+    """
+    temperatures = temperatures or CANDIDATE_TEMPERATURES
+    phase = get_current_phase()
+    seen, seen_lock = {}, threading.Lock()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(temperatures), thread_name_prefix='candidate') as pool:
+        futures = [pool.submit(_run_candidate, n, prompt, t, current_code, test_cases, max_diff_lines,
+                               phase, seen, seen_lock)
+                   for n, t in enumerate(temperatures, 1)]
+        results = [f.result() for f in futures]
+    entries = [entry for entry, _ in results]
+    sources = {entry['candidate']: source for entry, source in results if source is not None}
 
-        # --- Test the new code by executing it in an isolated namespace ---
-        namespace = {}
-        # NOTE: This is the most dangerous line. analyze.py must prevent malicious side-effects.
-        exec(updated_code, namespace) 
-        updated_func = namespace.get('process_query')
-        if not updated_func:
-            raise NameError("No process_query in generated code after exec.")
+    winner, prepared = None, None
+    ranked = _rank(_time_candidates([e for e in entries if e['candidate'] in sources], sources, test_cases))
+    for entry in ranked:
+        report = gate_patch(current_code, sources[entry['candidate']], tolerance, mem_tolerance)
+        if report['regressed']:
+            entry['reason'] = f"performance regression in: {', '.join(report['regressions'])}"
+            continue
+        winner = entry
+        winner.update(status='won', reason='best accuracy, then latency; passed the regression gate')
+        prepared = {'target': target_file, 'base_sha': content_hash(current_code), 'diff': entry['diff'],
+                    'source': sources[entry['candidate']], 'benchmark': report}
+        break
+    for entry in ranked:
+        if winner is not None and 'reason' not in entry:
+            entry['reason'] = _loss_reason(entry, winner)
+    for entry in entries:
+        entry.pop('diff', None)
+        entry.pop('_samples', None)
+    winner_diff = prepared['diff'] if prepared else None
 
-        # --- Run tests ---
-        if test_cases:
-            metrics = analyze_performance(updated_func, test_cases)
-            if detect_fail_state(metrics, updated_code):
-                raise RuntimeError("Fail state detected post-modification: failed performance/accuracy tests.")
+    tournament = {'candidates': entries, 'winner': winner['candidate'] if winner else None,
+                  'elapsed_s': round(time.perf_counter() - start, 3)}
+    log_change("Patch tournament", json.dumps({'query': improvement_query, **tournament}),
+               generated=winner_diff)
+    if prepared is None:
+        reasons = "; ".join(f"#{e['candidate']} (t={e['temperature']}): {e['reason']}" for e in entries)
+        raise RuntimeError(f"No candidate patch survived: {reasons}")
+    prepared['tournament'] = tournament
+    return prepared
+
+def apply_prepared(prepared, label=''):
+    """Write a prepare_patch() result and swap it in; restores the file (and the live module) if that fails.
+
+    Raises StalePatchError if target_file changed since the patch was prepared.
+    """
+    store = get_snapshot_store()
+    registry = get_registry()  # Before the write, so its first version holds the code that is running
+    target_file = prepared['target']
+
+    with open(target_file, 'r') as f:
+        current_code = f.read()
+    if content_hash(current_code) != prepared['base_sha']:
+        raise StalePatchError(f"{target_file} changed since the patch was evaluated.")
+    # Snapshot only the file being modified (a no-op if it matches the last snapshot)
+    base = store.record({target_file: current_code}, label=f'Pre-modification - {target_file}')
+
+    swapped = False
+    try:
+        with open(target_file + '.tmp', 'w') as f:
+            f.write(prepared['source'])
+        os.replace(target_file + '.tmp', target_file)
+
+        # --- Swap the running process over to the new version ---
+        if target_file == registry.path:
+            version = registry.load(prepared['source'])
+            swapped = True
+            log_change("Patch is live", f"version {version['version']}")
 
         # --- Finalize ---
-        log_change("Patch application successful", improvement_query)
-        if needs_commit:
-            subprocess.run(['git', 'commit', '-am', f'Successful patch modification: {improvement_query}'], check=True)
-        else:
-            log_change("Patch successful but not committed", "Git config missing.")
+        store.record({target_file: prepared['source']}, label=f'Successful patch modification: {label}', parent=base)
+        log_change("Patch application successful", label)
 
     except Exception as e:
-        log_change("Modification failed", str(e))
-        # Restore from backup file first (simpler and safer than git rollback)
-        if os.path.exists(backup_file):
-            os.system(f'mv {backup_file} {target_file}')
-            log_change("Restored from backup file", target_file)
-        # Only use git rollback if backup restoration fails AND we committed a pre-modification commit
-        elif needs_commit:
-            rollback()
+        log_change("Modification failed", str(e), level='ERROR')
+        # A no-op if the write itself failed (restore skips files matching the snapshot)
+        store.restore(base, [target_file])
+        log_change("Restored from snapshot", target_file)
+        if swapped:
+            # Disk is back on the old source, so the running module must be too
+            registry.restore(current_code)
         raise
 
-def rollback():
-    """Revert to previous commit on current branch."""
+def self_modify(improvement_query, target_file='core.py', test_cases=None, max_diff_lines=50,
+                tolerance=TOLERANCE, mem_tolerance=MEM_TOLERANCE, candidates=1):
+    """Use LLM to generate unified diff patch; apply incrementally.
+
+    Patches that pass the tests are also benchmarked against the current
+    source's baseline and rejected if they regress latency or memory beyond
+    tolerance/mem_tolerance. candidates > 1 runs a best-of-N tournament.
+    """
     try:
-        subprocess.run(['git', 'reset', '--hard', 'HEAD~1'], check=True)
-        log_change("Rolled back")
-    except subprocess.CalledProcessError as e:
-        log_change("Rollback error", str(e))
+        prepared = prepare_patch(improvement_query, target_file, test_cases, max_diff_lines,
+                                 tolerance, mem_tolerance, candidates)
+    except Exception as e:
+        log_change("Modification failed", str(e), level='ERROR')
         raise
+    apply_prepared(prepared, improvement_query)
+
+def rollback():
+    """
+    Revert the modified files to the snapshot before the latest one, record
+    that as a new snapshot and swap core back to the restored source. The one
+    rollback path: /core/rollback uses it too, so disk, snapshots and the live
+    module never disagree. Returns the live core version info.
 
+    The rollback snapshot takes the restored snapshot's parent, so calling
+    rollback() again steps further back instead of undoing the rollback.
+    """
+    store = get_snapshot_store()
+    registry = get_registry()
+    head = store.head()
+    if head is None or head['parent'] is None:
+        log_change("Rollback error", "No earlier snapshot to roll back to.", level='ERROR')
+        raise RuntimeError("No earlier snapshot to roll back to.")
+    target = store.get(head['parent'])
+    # Restore the snapshot (writing only the files that differ), then record it
+    store.restore(head['parent'])
+    store.snapshot(target['files'], label=f"Rollback to {head['parent']}", parent=target['parent'])
+    log_change("Rolled back", head['parent'])
+    sha = target['files'].get(registry.path)
+    if sha is None:
+        return registry.stats()['active']
+    return registry.restore(store.read_object(sha))
@@ -1,56 +1,44 @@
-import psutil
-import time
+# monitor.py: Resource monitoring and alert fan-out (backed by metrics.py)
 import threading
-from collections import deque
-from logger import log_change
+import time
+from metrics import ResourceSampler, ALERT_BUS, SAMPLE_INTERVAL
+from events import publish_event
 
-# A thread-safe queue to hold system alerts
-ALERT_QUEUE = deque(maxlen=20)
+_sampler = None
+_sampler_lock = threading.Lock()
 
-def get_alerts():
-    """Retrieves all current alerts from the queue and clears it."""
-    alerts = list(ALERT_QUEUE)
-    ALERT_QUEUE.clear()
-    return alerts
+# Push every alert (including the sampler's) to the event stream as well
+ALERT_BUS.add_listener(lambda message: publish_event('alert', {'message': message}))
 
-def monitor_resources(max_cpu=95, max_mem=28000, quiet=False):  # max_cpu in %, max_mem in MB
-    """Monitor system resources to prevent exhaustion, adding alerts to the queue."""
-    log_change("Starting resource monitor...")
-    try:
-        while True:
-            cpu = psutil.cpu_percent(interval=1)
-            mem = psutil.virtual_memory().used / (1024 ** 2)  # Convert to MB
+def get_alerts(subscriber='default'):
+    """Alerts this subscriber hasn't seen yet; every subscriber gets every alert once."""
+    return ALERT_BUS.read(subscriber)
 
-            if not quiet:
-                print(f"Current - CPU: {cpu:.1f}%, Memory: {mem:.0f} MB")
+def publish_alert(message):
+    """Send an alert to all subscribers."""
+    ALERT_BUS.publish(message)
 
-            if cpu > max_cpu:
-                alert = f"Resource limit exceeded: CPU at {cpu:.1f}% (max: {max_cpu}%)"
-                ALERT_QUEUE.append(alert)
-                log_change("RESOURCE ALERT", alert)
+def monitor_resources(max_cpu=95, max_mem=4096, quiet=False, interval=SAMPLE_INTERVAL):  # max_cpu in %, max_mem in MB (RSS)
+    """Monitor this process's resources (blocking), publishing alerts over the limits."""
+    ResourceSampler(interval, max_cpu, max_mem, quiet).run()
 
-            if mem > max_mem:
-                alert = f"Resource limit exceeded: Memory at {mem:.0f} MB (max: {max_mem} MB)"
-                ALERT_QUEUE.append(alert)
-                log_change("RESOURCE ALERT", alert)
-
-            time.sleep(1)
-    except Exception as e:
-        log_change("Error in monitoring thread", str(e))
-        if not quiet:
-            print(f"Error in monitoring: {e}")
+def start_monitor(max_cpu=95, max_mem=4096, quiet=True, interval=SAMPLE_INTERVAL):
+    """Start the process-wide background sampler once; returns it."""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = ResourceSampler(interval, max_cpu, max_mem, quiet).start()
+    return _sampler
 
 # Start the monitoring thread if run directly (useful for testing)
 if __name__ == "__main__":
-    threading.Thread(target=monitor_resources, daemon=True).start()
+    start_monitor(quiet=False, interval=1.0)
+    get_alerts('console')  # Register the cursor now so no alert is missed
     print("Sandbox monitoring active. Press Ctrl+C to stop.")
     try:
         while True:
             time.sleep(1)
-            alerts = get_alerts()
-            if alerts:
-                for alert in alerts:
-                    print(f"[ALERT]: {alert}")
+            for alert in get_alerts('console'):
+                print(f"[ALERT]: {alert}")
     except KeyboardInterrupt:
         print("Monitoring stopped.")
-
@@ -0,0 +1,179 @@
+# numeric.py: Vectorized numeric skills for the sort/math rules
+"""
+Parses every number in a query (ints, negatives, floats) into one NumPy
+array and runs sort/top-k and aggregate operations on it, so rules stay
+fast on inputs with millions of numbers.
+
+Large results are summarized instead of being returned as giant lists;
+pass full=True (or include "full" in the query) to get every element.
+NumPy is optional: without it the same operations run on Python lists,
+as do integers too large for int64, so they stay exact.
+"""
+
+import heapq
+import math
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional: pure-Python fallback (fine for chat-sized inputs)
+    np = None
+
+NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+_SEPARATORS = str.maketrans(',;', '  ')
+_NON_NUMERIC_RE = re.compile(r'[^0-9eE.\-\s]')  # Characters no plain number contains
+_DIGIT_RE = re.compile(r'\d')
+COMPACT_LIMIT = 50  # Lists longer than this are summarized unless full=True
+PREVIEW = 5         # Elements shown from each end of a summarized list
+
+def _is_number(token):
+    return NUMBER_RE.fullmatch(token) is not None
+
+def parse_numbers(text):
+    """
+    Extract all numbers from text as an array (int64 if all integral, else float64).
+
+    Fast path: split on whitespace/commas, drop the leading/trailing words
+    ("sort desc top 3 ...") and convert the numeric run in bulk. It is only
+    trusted when it saw every number: the dropped words hold no digits and
+    the run holds nothing but number characters. Anything less regular
+    ("2+3", "sort 5, 3, 1.") falls back to a regex scan.
+    """
+    tokens = text.translate(_SEPARATORS).split()
+    lo, hi = 0, len(tokens)
+    while lo < hi and not _is_number(tokens[lo]):
+        lo += 1
+    while hi > lo and not _is_number(tokens[hi - 1]):
+        hi -= 1
+    run = tokens[lo:hi]
+    edges = tokens[:lo] + tokens[hi:]
+    if not any(_DIGIT_RE.search(t) for t in edges) and not _NON_NUMERIC_RE.search(" ".join(run)):
+        try:
+            return _to_array(run)
+        except (ValueError, OverflowError):
+            pass  # e.g. "1-2" or a lone "e"
+    return _to_array(NUMBER_RE.findall(text))
+
+def _to_array(strs):
+    """Bulk-convert numeric strings: int64 when they are all integers, else float64."""
+    if np is None:
+        try:
+            return [int(s) for s in strs]
+        except ValueError:
+            return [float(s) for s in strs]
+    try:
+        return np.array(strs, dtype=np.int64)
+    except OverflowError:
+        # Integers beyond int64 stay exact Python ints (the list code path) rather than rounded floats
+        try:
+            return [int(s) for s in strs]
+        except ValueError:
+            return np.array(strs, dtype=np.float64)
+    except ValueError:
+        return np.array(strs, dtype=np.float64)
+
+def _is_array(values):
+    return np is not None and isinstance(values, np.ndarray)
+
+def _int64_sum_safe(values):
+    """Whether summing values in int64 cannot overflow (n * largest magnitude < 2**63)."""
+    if values.dtype.kind != 'i':
+        return True
+    bound = max(abs(int(values.min())), abs(int(values.max())))
+    return bound * values.size < 2 ** 63
+
+def size(values):
+    return int(values.size) if _is_array(values) else len(values)
+
+def sort_numbers(values, descending=False, top_k=None):
+    """Sort values; with top_k, return only the first k of that order (O(n) selection)."""
+    n = size(values)
+    if top_k is not None and 0 < top_k < n:
+        if not _is_array(values):
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            return pick(top_k, values)
+        if descending:
+            part = np.partition(values, n - top_k)[n - top_k:]
+            return np.sort(part)[::-1]
+        part = np.partition(values, top_k - 1)[:top_k]
+        return np.sort(part)
+    if not _is_array(values):
+        return sorted(values, reverse=descending)
+    ordered = np.sort(values)
+    return ordered[::-1] if descending else ordered
+
+def aggregate(values, op):
+    """Reduce values with op: sum, mean, min, max, median, product, subtract."""
+    if size(values) == 0:
+        raise ValueError(f"No numbers to {op}.")
+    if not _is_array(values):
+        if op == 'sum':
+            return sum(values)
+        if op == 'mean':
+            return sum(values) / len(values)
+        if op == 'min':
+            return min(values)
+        if op == 'max':
+            return max(values)
+        if op == 'median':
+            ordered = sorted(values)
+            mid = len(ordered) // 2
+            return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+        if op == 'product':
+            return math.prod(values)
+        if op == 'subtract':
+            return values[0] - sum(values[1:])
+    else:
+        if op in ('sum', 'subtract') and not _int64_sum_safe(values):
+            # Exact Python ints where int64 would silently wrap around
+            values = values.tolist()
+            return sum(values) if op == 'sum' else values[0] - sum(values[1:])
+        if op == 'sum':
+            return values.sum()
+        if op == 'mean':
+            return values.mean()
+        if op == 'min':
+            return values.min()
+        if op == 'max':
+            return values.max()
+        if op == 'median':
+            return np.median(values)
+        if op == 'product':
+            # Exact Python ints for integer input rather than silent int64 overflow
+            return math.prod(values.tolist()) if values.dtype.kind == 'i' else values.prod()
+        if op == 'subtract':
+            return values[0] - values[1:].sum()
+    raise ValueError(f"Unknown numeric operation: {op}")
+
+def to_python(value):
+    """Convert a NumPy scalar to int/float, keeping integral floats as ints."""
+    if np is not None and isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53:
+        return int(value)
+    return value
+
+def compact(values, full=False, label="numbers"):
+    """Return values as a list, or a short summary string when long and not full."""
+    n = size(values)
+    if full or n <= COMPACT_LIMIT:
+        items = values.tolist() if _is_array(values) else list(values)
+        return [to_python(v) for v in items]
+    head = ", ".join(str(to_python(v)) for v in values[:PREVIEW])
+    tail = ", ".join(str(to_python(v)) for v in values[n - PREVIEW:])
+    return f"{n} {label}: [{head}, ..., {tail}] (ask for 'full' to get every value)"
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    import random
+    import time
+    query = "sort " + " ".join(str(random.randint(-10 ** 6, 10 ** 6)) for _ in range(10 ** 6))
+    start = time.perf_counter()
+    values = parse_numbers(query)
+    parsed = time.perf_counter()
+    result = compact(sort_numbers(values), label="sorted numbers")
+    done = time.perf_counter()
+    print(result)
+    print(f"parse: {(parsed - start) * 1000:.1f} ms, sort: {(done - parsed) * 1000:.1f} ms (numpy={'yes' if np is not None else 'no'})")
+    print(to_python(aggregate(parse_numbers("add 2 -3 4.5"), 'sum')), compact(sort_numbers(parse_numbers("9 1 8 2 7"), True, 3)))
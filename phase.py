@@ -1,9 +1,11 @@
 # phase.py: Shared phase management utilities
 import json
-import os
 from logger import log_change
+from filecache import read_json, invalidate
 
 PHASE_FILE = 'phase.json'
+# High-level continuous goal the reflection loop works towards
+CONTINUOUS_GOAL = "towards a general intelligence system"
 PHASES = [
     "Phase 0: Basic setup and optimization of existing functions.",
     "Phase 1: Patch to optimize existing functions for efficiency (e.g., better algorithms).",
@@ -14,12 +16,9 @@ PHASES = [
 ]
 
 def get_current_phase():
-    """Load or initialize phase."""
+    """Load or initialize phase (re-read only when phase.json changes)."""
     try:
-        if os.path.exists(PHASE_FILE):
-            with open(PHASE_FILE, 'r') as f:
-                return json.load(f).get('phase', 0)
-        return 0
+        return read_json(PHASE_FILE, {}).get('phase', 0)
     except Exception as e:
         log_change("Phase load error", str(e))
         return 0
@@ -30,4 +29,5 @@ def advance_phase():
     if phase < len(PHASES):
         with open(PHASE_FILE, 'w') as f:
             json.dump({'phase': phase}, f)
+        invalidate(PHASE_FILE)
         log_change("Advanced to phase", PHASES[phase])
\ No newline at end of file
@@ -0,0 +1,334 @@
+# proposals.py: Persistent, prioritized queue of patch proposals with background pre-evaluation
+"""
+Patch proposals waiting for a human decision, kept in SQLite so they
+survive restarts.
+
+Each proposal has an id, query, target file, tests, priority and status:
+
+    queued -> evaluating -> ready | failed -> applied | rejected
+
+New proposals are pre-evaluated by a small pool of background threads
+(highest priority first): the diff is generated, tested in the sandbox
+and benchmarked with modify.prepare_patch() (best of CANDIDATES diffs),
+and the winning source is stored with the proposal. Approving a ready proposal then only writes the
+file. A claimed proposal records its owner (worker pid) and claim time, so a
+restarting worker only requeues evaluations whose owner is gone or whose
+EVAL_LEASE ran out, never ones another live worker process is still running. If the target changed in the meantime (another proposal was applied
+first), the proposal is re-evaluated against the new code before applying.
+
+Every status change is published on the event bus as a 'proposal' event.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import log_change
+from events import publish_event
+
+PROPOSALS_DB = 'proposals.db'
+PREEVAL_WORKERS = 2   # Parallel pre-evaluations (matches the sandbox pool)
+MAX_OPEN = 5          # Undecided proposals before reflection pauses
+CANDIDATES = 3        # Diffs generated per proposal; the best one is kept (best-of-N)
+EVAL_LEASE = 3600     # Seconds after which an evaluation is presumed abandoned, even if its pid lives
+
+OPEN = ('queued', 'evaluating', 'ready', 'failed')
+DONE = ('applied', 'rejected')
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS proposals (
+        id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        query     TEXT NOT NULL,
+        target    TEXT NOT NULL,
+        tests     TEXT NOT NULL,
+        priority  INTEGER NOT NULL DEFAULT 0,
+        status    TEXT NOT NULL,
+        prepared  TEXT,
+        error     TEXT,
+        result    TEXT,
+        owner     INTEGER,
+        claimed   REAL,
+        created   REAL NOT NULL,
+        updated   REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS proposals_status ON proposals (status, priority, id)",
+)
+
+_MIGRATIONS = {'owner': "ALTER TABLE proposals ADD COLUMN owner INTEGER",
+               'claimed': "ALTER TABLE proposals ADD COLUMN claimed REAL"}
+
+def _pid_alive(pid):
+    """Whether a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, but belongs to another user
+    except OSError:
+        return False
+    return True
+
+def _summary(row, detail=False):
+    """Client view of a proposal; detail adds the diff and benchmark report."""
+    prepared = json.loads(row['prepared']) if row['prepared'] else None
+    tests = json.loads(row['tests'])
+    view = {
+        'id': row['id'], 'query': row['query'], 'target': row['target'], 'priority': row['priority'],
+        'status': row['status'], 'tests_count': len(tests), 'error': row['error'], 'result': row['result'],
+        'created': row['created'], 'updated': row['updated'],
+        'regressed': prepared['benchmark'].get('regressed') if prepared else None,
+    }
+    if detail:
+        view['diff'] = prepared['diff'] if prepared else None
+        view['benchmark'] = prepared['benchmark'] if prepared else None
+        view['tournament'] = prepared.get('tournament') if prepared else None
+    return view
+
+class ProposalQueue:
+    """SQLite-backed proposal queue; one connection per thread, like CacheStore."""
+
+    def __init__(self, path=PROPOSALS_DB, workers=PREEVAL_WORKERS):
+        self.path = path
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preeval')
+        self._workers = workers
+        self._inflight = {}   # id -> Event set when its evaluation finishes
+        self._inflight_lock = threading.Lock()
+        self._decide_lock = threading.Lock()  # Status check + apply/reject happen one at a time
+        self._migrate()
+        self._requeue_abandoned()
+        if self._count('queued'):
+            self._kick()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        """Add the claim columns to a database created before they existed."""
+        conn = self._connect()
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(proposals)")}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass  # Another process added it first
+
+    def _requeue_abandoned(self):
+        """Evaluations whose worker died (or whose lease ran out) start over; live ones are left alone."""
+        conn = self._connect()
+        rows = conn.execute("SELECT id, owner, claimed FROM proposals WHERE status = 'evaluating'").fetchall()
+        expired = time.time() - EVAL_LEASE
+        for row in rows:
+            if row['owner'] is None or row['claimed'] is None or row['claimed'] < expired \
+                    or not _pid_alive(row['owner']):
+                # Conditional on the same claim, in case the owner finished or another process requeued it
+                conn.execute("UPDATE proposals SET status = 'queued', owner = NULL, claimed = NULL "
+                             "WHERE id = ? AND status = 'evaluating' AND owner IS ? AND claimed IS ?",
+                             (row['id'], row['owner'], row['claimed']))
+
+    def _row(self, proposal_id):
+        return self._connect().execute("SELECT * FROM proposals WHERE id = ?", (proposal_id,)).fetchone()
+
+    def _count(self, *statuses):
+        marks = ", ".join("?" * len(statuses))
+        return self._connect().execute(f"SELECT COUNT(*) FROM proposals WHERE status IN ({marks})", statuses).fetchone()[0]
+
+    def _set(self, proposal_id, expect=None, **fields):
+        """Update fields (only if the status is in expect, when given); returns whether it did."""
+        fields['updated'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        sql = f"UPDATE proposals SET {assignments} WHERE id = ?"
+        params = list(fields.values()) + [proposal_id]
+        if expect:
+            sql += f" AND status IN ({', '.join('?' * len(expect))})"
+            params += list(expect)
+        changed = self._connect().execute(sql, params).rowcount == 1
+        if changed:
+            publish_event('proposal', _summary(self._row(proposal_id)))
+        return changed
+
+    # --- Queue ---
+
+    def add(self, query, target='core.py', tests=None, priority=0):
+        """Queue a proposal and start pre-evaluating it. Returns its id."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO proposals (query, target, tests, priority, status, created, updated) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (query, target, json.dumps(tests or []), priority, now, now))
+        proposal_id = cursor.lastrowid
+        log_change("Patch Proposal Queued", f"#{proposal_id}: {query}")
+        publish_event('proposal', _summary(self._row(proposal_id)))
+        self._kick()
+        return proposal_id
+
+    def get(self, proposal_id, detail=True):
+        row = self._row(proposal_id)
+        return _summary(row, detail) if row else None
+
+    def list(self, statuses=OPEN, limit=50):
+        marks = ", ".join("?" * len(statuses))
+        rows = self._connect().execute(
+            f"SELECT * FROM proposals WHERE status IN ({marks}) ORDER BY priority DESC, id LIMIT ?",
+            (*statuses, limit)).fetchall()
+        return [_summary(row) for row in rows]
+
+    def open_count(self):
+        return self._count(*OPEN)
+
+    def top(self):
+        """Id of the proposal a decision without an id applies to: best ready one, else best open one."""
+        row = self._connect().execute(
+            f"SELECT id FROM proposals WHERE status IN ({', '.join('?' * len(OPEN))}) "
+            "ORDER BY status = 'ready' DESC, priority DESC, id LIMIT 1", OPEN).fetchone()
+        return row[0] if row else None
+
+    # --- Pre-evaluation ---
+
+    def _kick(self):
+        for _ in range(self._workers):
+            self._executor.submit(self._drain)
+
+    def _try_claim(self, proposal_id, expect):
+        """Move the proposal to 'evaluating' if its status is in expect; returns whether it did."""
+        # Status and in-flight marker change together, so _wait() never misses an evaluation
+        with self._inflight_lock:
+            if not self._set(proposal_id, expect=expect, status='evaluating', owner=os.getpid(), claimed=time.time()):
+                return False
+            self._inflight[proposal_id] = threading.Event()
+            return True
+
+    def _claim(self):
+        """Claim the best queued proposal for evaluation; returns its id or None."""
+        while True:
+            row = self._connect().execute(
+                "SELECT id FROM proposals WHERE status = 'queued' ORDER BY priority DESC, id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            if self._try_claim(row[0], ('queued',)):
+                return row[0]
+
+    def _drain(self):
+        while True:
+            proposal_id = self._claim()
+            if proposal_id is None:
+                return
+            self._evaluate(proposal_id)
+
+    def _evaluate(self, proposal_id):
+        """Prepare the claimed proposal's patch and store it ('ready') or the reason it failed."""
+        try:
+            from modify import prepare_patch  # Self-modification is only loaded once there is work for it
+            row = self._row(proposal_id)
+            start = time.perf_counter()
+            try:
+                prepared = prepare_patch(row['query'], row['target'], json.loads(row['tests']) or None,
+                                         candidates=CANDIDATES)
+            except Exception as e:
+                log_change("Proposal pre-evaluation failed", f"#{proposal_id}: {e}", level='WARNING')
+                self._set(proposal_id, expect=('evaluating',), status='failed', error=str(e), prepared=None)
+                return None
+            log_change("Proposal pre-evaluated", f"#{proposal_id} in {time.perf_counter() - start:.2f}s")
+            self._set(proposal_id, expect=('evaluating',), status='ready', error=None, prepared=json.dumps(prepared))
+            return prepared
+        finally:
+            with self._inflight_lock:
+                event = self._inflight.pop(proposal_id, None)
+            if event is not None:
+                event.set()
+
+    def _wait(self, proposal_id, timeout=None):
+        with self._inflight_lock:
+            event = self._inflight.get(proposal_id)
+        if event is not None:
+            event.wait(timeout)
+
+    # --- Decisions ---
+
+    def decide(self, proposal_id, decision):
+        """Approve or reject a proposal; returns a message for the user."""
+        row = self._row(proposal_id)
+        if row is None or row['status'] in DONE:
+            return f"No open patch proposal #{proposal_id}."
+        if decision.lower() != 'approve':
+            with self._decide_lock:
+                if not self._set(proposal_id, expect=OPEN, status='rejected', result='Rejected by user'):
+                    return f"No open patch proposal #{proposal_id}."
+            log_change("User Rejected Patch", f"#{proposal_id}: {row['query']}")
+            return f"Patch proposal #{proposal_id} rejected by user."
+
+        log_change("User Approved Patch", f"#{proposal_id}: {row['query']}")
+        # Make sure there is a prepared patch: evaluate now, or wait for the one in flight.
+        # Outside _decide_lock: this is an LLM round-trip plus a sandbox run, and other
+        # decisions shouldn't wait on it
+        if self._try_claim(proposal_id, ('queued', 'failed')):
+            self._evaluate(proposal_id)
+        else:
+            self._wait(proposal_id)
+
+        from modify import apply_prepared, StalePatchError
+        retried = False
+        while True:
+            # Applies happen one at a time, and only to a proposal still 'ready' when its turn comes
+            with self._decide_lock:
+                row = self._row(proposal_id)
+                if row['status'] in DONE:
+                    return f"Patch proposal #{proposal_id} was {row['status']} meanwhile; nothing was applied."
+                if row['status'] != 'ready':
+                    return f"Patch #{proposal_id} could not be applied: {row['error'] or row['status']}"
+                try:
+                    apply_prepared(json.loads(row['prepared']), row['query'])
+                except Exception as e:
+                    if retried or not isinstance(e, StalePatchError):
+                        self._set(proposal_id, status='failed', error=str(e))
+                        return f"Patch #{proposal_id} execution failed. Codebase rolled back. Error: {e}"
+                else:
+                    self._set(proposal_id, status='applied', result='Applied')
+                    return f"Patch #{proposal_id} applied successfully! The system will now continue its self-improvement cycle."
+
+            # Another patch landed since this one was evaluated; redo it against the new code
+            log_change("Re-evaluating stale proposal", f"#{proposal_id}")
+            if not self._try_claim(proposal_id, ('ready',)):
+                # Another worker process decided or re-claimed it meanwhile
+                return f"Patch #{proposal_id} changed meanwhile (now {self._row(proposal_id)['status']}); nothing was applied."
+            if self._evaluate(proposal_id) is None:
+                return f"Patch #{proposal_id} no longer applies: {self._row(proposal_id)['error']}"
+            retried = True
+
+    def stats(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM proposals GROUP BY status").fetchall()
+        with self._inflight_lock:
+            inflight = len(self._inflight)
+        return {'by_status': {status: count for status, count in rows}, 'evaluating_now': inflight,
+                'workers': self._workers}
+
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+def get_proposal_queue():
+    """Return the process-wide proposal queue, creating it on first use."""
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = ProposalQueue()
+    return _QUEUE
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    queue = get_proposal_queue()
+    print(queue.list(), queue.stats())
@@ -1,21 +1,24 @@
 import os
-import threading
-from core import process_query
+from hotswap import process_query
 from logger import log_change
 # Removed: from phase import get_current_phase, advance_phase, PHASES
-from monitor import get_alerts 
-from modify import self_modify # Must import self_modify here to use it in process_patch_decision
-
-# --- New Global State for Web Interaction ---
-# Store patch proposals waiting for user approval
-PENDING_PATCH = threading.Lock()
-PENDING_PATCH_QUERY = None
-PENDING_PATCH_TESTS = None
-PENDING_PATCH_TARGET = 'core.py'
-# -------------------------------------------
-
-# New, high-level continuous goal for the LLM to target
-CONTINUOUS_GOAL = "towards a general intelligence system"
+from monitor import publish_alert
+from proposals import get_proposal_queue, MAX_OPEN
+
+# New, high-level continuous goal for the LLM to target (defined in phase.py so it loads cheaply)
+from phase import CONTINUOUS_GOAL
+
+def proposal_state(proposal_id=None):
+    """One proposal in detail, or the open ones ({'status': 'none'} if there are none)."""
+    queue = get_proposal_queue()
+    if proposal_id is not None:
+        return queue.get(proposal_id) or {'status': 'unknown', 'id': proposal_id}
+    proposals = queue.list()
+    if not proposals:
+        return {'status': 'none', 'proposals': []}
+    # The top-level fields describe the proposal a decision without an id applies to
+    top = queue.get(queue.top(), detail=False)
+    return dict(top, status='pending', proposal_status=top['status'], proposals=proposals)
 
 def generate_improvement_queries():
     """Query the LLM for a single, incremental improvement idea based on the continuous goal."""
@@ -34,23 +37,22 @@ def generate_improvement_queries():
         log_change("Query generation error", str(e))
         return []
 
-def reflect_and_expand(test_cases):
-    """Continuously reflect and propose patches towards the abstract goal."""
-    global PENDING_PATCH_QUERY, PENDING_PATCH_TESTS, PENDING_PATCH_TARGET
+def reflect_and_expand(test_cases, priority=0):
+    """Continuously reflect and queue patch proposals towards the abstract goal."""
     try:
 
-        # Check if a patch is already pending
-        with PENDING_PATCH:
-            if PENDING_PATCH_QUERY is not None:
-                log_change("Skipping reflection", "Another patch is already pending approval.")
-                get_alerts().append("Reflection paused: A patch is already awaiting your approval.")
-                return
+        # Proposals queue up (and are pre-evaluated) instead of waiting on the user one at a time
+        open_count = get_proposal_queue().open_count()
+        if open_count >= MAX_OPEN:
+            log_change("Skipping reflection", f"{open_count} proposals are already awaiting a decision.")
+            publish_alert(f"Reflection paused: {open_count} patch proposals are already awaiting your decision.")
+            return
 
         queries = generate_improvement_queries()
 
         if not queries:
             log_change("Reflection finished", "No improvement queries generated.")
-            get_alerts().append("Reflection: No viable improvement queries could be generated at this time.")
+            publish_alert("Reflection: No viable improvement queries could be generated at this time.")
             return
 
         q = queries[0]
@@ -62,49 +64,23 @@ def reflect_and_expand(test_cases):
 
         if "yes" in str(eval_response).lower():
             log_change("Patch Proposal Generated", f"Query: {q}")
-
-            with PENDING_PATCH:
-                PENDING_PATCH_QUERY = q
-                PENDING_PATCH_TESTS = test_cases
-                PENDING_PATCH_TARGET = 'core.py'
-                log_change("Patch Proposal Awaiting Approval", q)
+            get_proposal_queue().add(q, 'core.py', test_cases, priority)
         else:
             log_change("Patch Proposal Rejected by Self-Evaluation", q)
-            get_alerts().append(f"Reflection Failed: Self-evaluation rejected the query because it was not considered atomic or incremental: '{q}'.")
+            publish_alert(f"Reflection Failed: Self-evaluation rejected the query because it was not considered atomic or incremental: '{q}'.")
 
     except Exception as e:
-        log_change("Reflection error", str(e))
-        get_alerts().append(f"Reflection Error: An unexpected error occurred during the process: {e}")
-
-def process_patch_decision(decision):
-    """Called by the web API to handle user's patch approval or rejection."""
-    global PENDING_PATCH_QUERY, PENDING_PATCH_TESTS, PENDING_PATCH_TARGET
-
-    with PENDING_PATCH:
-        if PENDING_PATCH_QUERY is None:
+        log_change("Reflection error", str(e), level='ERROR')
+        publish_alert(f"Reflection Error: An unexpected error occurred during the process: {e}")
+
+def process_patch_decision(decision, proposal_id=None):
+    """Called by the web API to handle user's patch approval or rejection (default: the top proposal)."""
+    queue = get_proposal_queue()
+    if proposal_id is None:
+        proposal_id = queue.top()
+        if proposal_id is None:
             return "No patch pending."
-
-        q = PENDING_PATCH_QUERY
-        tests = PENDING_PATCH_TESTS
-        target = PENDING_PATCH_TARGET
-
-        PENDING_PATCH_QUERY = None
-        PENDING_PATCH_TESTS = None
-
-        if decision.lower() == 'approve':
-            log_change("User Approved Patch", q)
-            try:
-                # Removed max_diff_lines limit. Scope is controlled by LLM instruction.
-                self_modify(q, target_file=target, test_cases=tests) 
-
-                # Removed advance_phase() call. The system just returns to reflection loop.
-                return f"Patch applied successfully! The system will now continue its self-improvement cycle."
-            except Exception as e:
-                # Ensure the exception message is clear
-                return f"Patch execution failed. Codebase rolled back. Error: {e}"
-        else:
-            log_change("User Rejected Patch", q)
-            return "Patch proposal rejected by user."
+    return queue.decide(proposal_id, decision)
 
 # Example (comment out for production)
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+# rules.py: Compiled rule registry for core.process_query
+"""
+Rules register a regex pattern and a handler. All patterns are compiled into
+one alternation of named groups, so dispatching a query is a single scan of
+the input no matter how many rules patches add. Each alternative is a
+zero-width lookahead, so a lower-priority match never consumes text a
+higher-priority rule would match ("5 sort plus 2" is a sort, not an add).
+
+Priority is registration order: alternatives are tried in that order at each
+position, and among all rules that match anywhere in the query the earliest
+registered one handles it. A handler that returns NO_MATCH passes the query
+on to the next matching rule. Patterns should use word boundaries (\\b) so
+that e.g. "this" does not trigger a "hi" greeting rule.
+"""
+
+import itertools
+import re
+import threading
+
+NO_MATCH = object()  # Sentinel returned by dispatch() when no rule applies
+
+class Rule:
+    __slots__ = ('name', 'pattern', 'regex', 'handler', 'priority', 'hits')
+
+    def __init__(self, name, pattern, regex, handler, priority):
+        self.name = name
+        self.pattern = pattern
+        self.regex = regex  # Used alone only when a higher-priority rule declines the query
+        self.handler = handler
+        self.priority = priority
+        self.hits = 0
+
+class RuleRegistry:
+    """Ordered set of (pattern, handler) rules dispatched through one combined regex."""
+
+    def __init__(self, flags=re.IGNORECASE):
+        self.flags = flags
+        self._rules = []  # In priority order
+        self._by_group = {}
+        self._combined = None
+        self._priorities = itertools.count()  # Never reused, even after unregister()
+        self._lock = threading.Lock()
+
+    def register(self, name, pattern, handler):
+        """Add (or replace, keeping its priority) the rule called name."""
+        regex = re.compile(pattern, self.flags)  # Fail fast on a bad pattern
+        with self._lock:
+            for i, existing in enumerate(self._rules):
+                if existing.name == name:
+                    self._rules[i] = Rule(name, pattern, regex, handler, existing.priority)
+                    break
+            else:
+                self._rules.append(Rule(name, pattern, regex, handler, next(self._priorities)))
+            self._combined = None
+
+    def rule(self, name, pattern):
+        """Decorator form of register(): @RULES.rule('greeting', r'\\bhello\\b')."""
+        def decorator(handler):
+            self.register(name, pattern, handler)
+            return handler
+        return decorator
+
+    def unregister(self, name):
+        with self._lock:
+            self._rules = [r for r in self._rules if r.name != name]
+            self._combined = None
+
+    def _compile(self):
+        with self._lock:
+            if self._combined is None:
+                groups = {}
+                alternatives = []
+                for i, rule in enumerate(self._rules):
+                    group = f"r{i}"
+                    groups[group] = rule
+                    alternatives.append(f"(?=(?P<{group}>{rule.pattern}))")
+                self._by_group = groups
+                self._combined = re.compile("|".join(alternatives) or r"(?!)", self.flags)
+            return self._combined, self._by_group
+
+    def match(self, query):
+        """Return (rule, match) for the highest-priority rule matching query, or (None, None)."""
+        combined, groups = self._compile()
+        first = groups.get('r0')
+        best = start = None
+        # One zero-width match per position: the highest-priority rule matching there
+        for m in combined.finditer(query):
+            rule = groups[m.lastgroup]
+            if best is None or rule.priority < best.priority:
+                best, start = rule, m.start()
+                if rule is first:
+                    break  # Nothing can outrank the first rule
+        if best is None:
+            return None, None
+        return best, best.regex.match(query, start)  # The rule's own match, so group(0) is its text
+
+    def matches(self, query):
+        """Yield (rule, match) for every rule matching query, highest priority first."""
+        best, m = self.match(query)
+        if best is None:
+            return
+        yield best, m
+        # Only reached when the best rule declined: try the others one pattern at a time
+        with self._lock:
+            rules = list(self._rules)
+        for rule in rules:
+            if rule is not best:
+                m = rule.regex.search(query)
+                if m is not None:
+                    yield rule, m
+
+    def dispatch(self, query, scan_text=None):
+        """
+        Run the matching rules' handler(query, match) in priority order until
+        one returns something other than NO_MATCH; NO_MATCH if none does.
+
+        scan_text, if given, is matched instead of the full query (e.g. just the
+        ends of a query carrying a huge number list); handlers still get query.
+        """
+        for rule, m in self.matches(query if scan_text is None else scan_text):
+            result = rule.handler(query, m)
+            if result is not NO_MATCH:
+                with self._lock:  # += isn't atomic across threaded Flask and batch workers
+                    rule.hits += 1
+                return result
+        return NO_MATCH
+
+    def stats(self):
+        """Per-rule counts of queries handled, in priority order."""
+        with self._lock:
+            return [{'name': r.name, 'pattern': r.pattern, 'hits': r.hits} for r in self._rules]
+
+    def __len__(self):
+        return len(self._rules)
@@ -0,0 +1,237 @@
+# sandbox.py: Resource-limited worker pool for evaluating candidate patches
+"""
+Candidate source never runs in the serving process. A small pool of
+pre-started workers waits for jobs; each job carries the patched source as a
+string, which the worker execs in a fresh namespace and benchmarks case by
+case, sending each case report back over its pipe.
+
+Workers run under RLIMIT_AS (address space) and RLIMIT_CPU limits where the
+platform supports them, and the parent enforces a wall-clock timeout per
+case: a worker that stops answering is killed and replaced. Workers are
+also retired after JOBS_PER_WORKER jobs so one candidate's global side
+effects can't leak into the next evaluation.
+
+Workers start from analyze.worker_context() (forkserver, else spawn), never
+from a fork of the server, which would hand them its SQLite connections
+and held locks.
+"""
+
+import os
+import threading
+from analyze import worker_context, measure_case, failed_case, summarize, DEFAULT_REPEAT, DEFAULT_WARMUP, DEFAULT_TIMEOUT
+from logger import log_change
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: wall-clock timeouts still apply
+    resource = None
+
+POOL_SIZE = 2
+JOBS_PER_WORKER = 1          # Fresh interpreter state for every candidate
+MEMORY_LIMIT = 512 * 1024 * 1024   # Address space a worker may add on top of its start size
+CPU_LIMIT = 60               # CPU seconds per job
+START_TIMEOUT = 10.0         # Seconds for a worker to exec the candidate source
+
+def _address_space():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def _limit_memory():
+    if resource is None or not MEMORY_LIMIT:
+        return
+    current = _address_space()
+    if current is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    soft = current + MEMORY_LIMIT
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+def _limit_cpu():
+    # RLIMIT_CPU counts the whole process lifetime, so allow CPU_LIMIT more than used so far
+    if resource is None or not CPU_LIMIT:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + CPU_LIMIT
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _worker_main(conn):
+    """Worker loop: receive (source, cases, ...) jobs, stream back one message per step."""
+    try:
+        _limit_memory()
+    except (ValueError, OSError) as e:
+        log_change("Sandbox memory limit not set", str(e), level='WARNING')
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        source, func_name, overrides, test_cases, repeat, warmup = job
+        try:
+            _limit_cpu()
+            namespace = {'__name__': 'candidate'}
+            exec(compile(source, '<candidate>', 'exec'), namespace)
+            namespace.update(overrides or {})
+            func = namespace.get(func_name)
+            if func is None:
+                raise NameError(f"No {func_name} in candidate source.")
+            conn.send(('ready', None))
+        except BaseException as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+            continue
+        for case, expected in test_cases:
+            conn.send(('case', measure_case(func, case, expected, repeat, warmup)))
+        conn.send(('done', None))
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'jobs')
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), name='sandbox-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+    def retire(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+class SandboxPool:
+    """Pre-started evaluation workers; evaluate() borrows one for the duration of a job."""
+
+    def __init__(self, size=POOL_SIZE):
+        self._ctx = worker_context()
+        self.size = size
+        self._idle = [_Worker(self._ctx) for _ in range(size)]
+        self._busy = 0
+        self._cond = threading.Condition()
+        self.jobs = 0
+        self.kills = 0
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._busy >= self.size:
+                self._cond.wait()
+            self._busy += 1
+            worker = self._idle.pop() if self._idle else None
+        if worker is None or not worker.process.is_alive():
+            worker = _Worker(self._ctx)
+        return worker
+
+    def _release(self, worker, reusable):
+        worker.jobs += 1
+        if not reusable or worker.jobs >= JOBS_PER_WORKER:
+            if reusable:
+                worker.retire()
+            else:
+                worker.kill()
+            worker = _Worker(self._ctx)  # Start the replacement before the next job needs it
+        with self._cond:
+            self._busy -= 1
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def evaluate(self, source, test_cases, func_name='process_query', overrides=None,
+                 repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP, timeout=DEFAULT_TIMEOUT):
+        """
+        Exec source in a worker and benchmark func_name over (case, expected) pairs.
+
+        overrides replaces names in the candidate namespace (e.g. a stub query_llm);
+        values must be picklable. Returns the same summary as analyze_performance().
+        """
+        test_cases = list(test_cases)
+        worker = self._acquire()
+        reports = []
+        reusable = False
+        try:
+            worker.conn.send((source, func_name, overrides, test_cases, repeat, warmup))
+            kind, payload = self._receive(worker, START_TIMEOUT)
+            if kind != 'ready':
+                reports = [failed_case(case, payload) for case, _ in test_cases]
+                reusable = kind == 'error'
+                return summarize(reports)
+            for case, _ in test_cases:
+                kind, payload = self._receive(worker, timeout)
+                if kind != 'case':
+                    break
+                reports.append(payload)
+            else:
+                kind, payload = self._receive(worker, timeout)
+                reusable = kind == 'done'
+            if not reusable:
+                log_change("Sandbox worker stopped", payload, level='WARNING')
+                for case, _ in test_cases[len(reports):]:
+                    reports.append(failed_case(case, payload, timed_out=kind == 'timeout'))
+            return summarize(reports)
+        finally:
+            with self._cond:
+                self.jobs += 1
+                self.kills += not reusable
+            self._release(worker, reusable)
+
+    def _receive(self, worker, timeout):
+        """Next (kind, payload) from the worker, or ('timeout'/'exit', reason)."""
+        if not worker.conn.poll(timeout):
+            return 'timeout', f"Timed out after {timeout}s"
+        try:
+            return worker.conn.recv()
+        except EOFError:
+            worker.process.join(1)
+            return 'exit', f"Worker exited with code {worker.process.exitcode}"
+
+    def shutdown(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.retire()
+
+    def stats(self):
+        with self._cond:
+            return {'size': self.size, 'idle': len(self._idle), 'busy': self._busy,
+                    'jobs': self.jobs, 'killed': self.kills}
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool():
+    """Return the process-wide sandbox pool, creating it on first use."""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = SandboxPool()
+    return _POOL
+
+def evaluate(source, test_cases, **kwargs):
+    """Evaluate candidate source in the shared sandbox pool (see SandboxPool.evaluate)."""
+    return get_pool().evaluate(source, test_cases, **kwargs)
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    with open('core.py') as f:
+        source = f.read()
+    tests = [("hello", "Hello! How can I help you today?"), ("sort 3 1 2", [1, 2, 3])]
+    print({k: v for k, v in evaluate(source, tests).items() if k != 'cases'})
+    hog = source + "\ndef process_query(q, history=None):\n    while True: pass\n"
+    print({k: v for k, v in evaluate(hog, tests, timeout=1.0).items() if k != 'cases'})
+    print(get_pool().stats())
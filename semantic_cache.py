@@ -0,0 +1,217 @@
+# semantic_cache.py: Normalized and similarity lookup tiers for the LLM cache
+"""
+Extra lookup tiers behind the exact prompt cache in llm_query.py.
+
+1. exact      - the full prompt + temperature, as before.
+2. normalized - the prompt with whitespace collapsed. When the caller says
+                the query doesn't depend on the conversation (a cache hint),
+                the query alone, case-folded and stripped of edge
+                punctuation, so the same question asked with different
+                history still hits.
+3. similar    - off by default (SIMILARITY_THRESHOLD = 1.0). For hinted
+                queries only: a character-trigram cosine similarity index
+                over previously answered queries; the best match at or above
+                the threshold is reused, provided both queries have the same
+                content words. One word can flip the meaning ("vegan" vs
+                "vegetarian", "with" vs "without") while scoring above 0.9,
+                so only spelling, punctuation and filler words may differ.
+
+Tiers 1-2 live in the persistent CacheStore. A response is stored once,
+under its tier 2 key; the exact key holds only a pointer to that row
+(written to disk, not the hot tier), so each answer takes one hot-tier
+slot. A lookup is one counted CacheStore.get() of the tier 2 row, plus
+uncounted peeks at the pointer. The similarity index is in memory and
+bounded. Everything is computed locally, with no embedding service. Hits
+and misses are counted per tier here.
+"""
+
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from cache_store import get_store, hash_key
+from metrics import CACHE_LOOKUPS
+from tracing import span, traced
+
+SIMILARITY_THRESHOLD = 1.0   # Cosine similarity needed to reuse an answer (1.0 disables near matches; e.g. 0.9)
+INDEX_MAX_ENTRIES = 5000     # Queries kept in the similarity index
+MAX_POSTINGS = 500           # Trigrams shared by more entries than this are too common to rank on
+
+REF_PREFIX = '\x00ref:'   # Exact-key rows: this + hash_key() of the normalized key holding the response
+_WS_RE = re.compile(r'\s+')
+_EDGE_PUNCT = ' \t\n?!.,;:'
+_WORD_RE = re.compile(r'\w+')
+# Words whose presence doesn't change a question's meaning; negations and qualifiers are never filler
+_FILLER = frozenset(('a', 'an', 'the', 'is', 'are', 's', 'please', 'me', 'tell', 'can', 'you'))
+
+def normalize_prompt(prompt):
+    """Whitespace-canonical prompt (case is kept: prompts may embed code)."""
+    return _WS_RE.sub(' ', prompt).strip()
+
+def normalize_query(query):
+    """Canonical form of a user query: case-folded, single-spaced, no edge punctuation."""
+    return _WS_RE.sub(' ', query.casefold()).strip(_EDGE_PUNCT)
+
+def content_words(text):
+    return frozenset(w for w in _WORD_RE.findall(text) if w not in _FILLER)
+
+def trigrams(text):
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class SimilarityIndex:
+    """Bounded trigram index answering 'most similar stored query' lookups."""
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_entries=INDEX_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()        # (text, temperature) -> (grams, norm, words, value)
+        self._postings = defaultdict(set)    # trigram -> keys
+        self._lock = threading.Lock()
+
+    def add(self, text, temperature, value):
+        key = (text, temperature)
+        grams = trigrams(text)
+        norm = math.sqrt(sum(c * c for c in grams.values()))
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (grams, norm, content_words(text), value)
+            for gram in grams:
+                self._postings[gram].add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        grams = self._entries.pop(key)[0]
+        for gram in grams:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def search(self, text, temperature):
+        """(value, similarity) of the best match at or above the threshold, else (None, best score)."""
+        grams = trigrams(text)
+        norm = math.sqrt(sum(c * c for c in grams.values()))
+        words = content_words(text)
+        best, best_score = None, 0.0
+        with self._lock:
+            candidates = set()
+            for gram in grams:
+                keys = self._postings.get(gram)
+                if keys and len(keys) <= MAX_POSTINGS:
+                    candidates.update(keys)
+            for key in candidates:
+                if key[1] != temperature:
+                    continue
+                other, other_norm, other_words, value = self._entries[key]
+                if other_words != words:
+                    continue  # "... in 1989" vs "... in 1990", "vegan" vs "vegetarian", "with" vs "without"
+                dot = sum(count * other.get(gram, 0) for gram, count in grams.items())
+                score = dot / (norm * other_norm) if norm and other_norm else 0.0
+                if score > best_score:
+                    best, best_score = value, score
+        if best_score >= self.threshold:
+            return best, best_score
+        return None, best_score
+
+    def __len__(self):
+        return len(self._entries)
+
+class SemanticCache:
+    """Exact, normalized and similarity tiers over a CacheStore."""
+
+    TIERS = ('exact', 'normalized', 'similar')
+
+    def __init__(self, store=None, threshold=SIMILARITY_THRESHOLD):
+        self.store = store if store is not None else get_store()
+        self.index = SimilarityIndex(threshold)
+        self._lock = threading.Lock()
+        self.hits = dict.fromkeys(self.TIERS, 0)
+        self.misses = 0
+
+    def _normalized_key(self, prompt, temperature, hint):
+        if hint:
+            return f"query::{normalize_query(hint)}::{temperature}"
+        return f"prompt::{normalize_prompt(prompt)}::{temperature}"
+
+    def _hit(self, tier, value):
+        CACHE_LOOKUPS.labels(tier or 'miss').inc()
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits[tier] += 1
+        return value
+
+    def get(self, cache_key, prompt, temperature, hint=None):
+        """Cached response for the call, trying each tier in order, or None."""
+        with span('cache.get') as s:
+            tier, value = self._lookup(cache_key, prompt, temperature, hint, self.store.get)
+            s.set(tier=tier or 'miss')
+        return self._hit(tier, value)
+
+    def peek(self, cache_key, prompt, temperature, hint=None):
+        """Like get(), but counts nothing (for re-checking a known miss before calling the LLM)."""
+        return self._lookup(cache_key, prompt, temperature, hint, self.store.peek)[1]
+
+    def _lookup(self, cache_key, prompt, temperature, hint, read):
+        normalized_key = self._normalized_key(prompt, temperature, hint)
+        value = read(normalized_key)  # Where responses live: the one lookup the store counts
+        ref = self.store.peek(cache_key)
+        if value is not None:
+            return ('exact' if ref == REF_PREFIX + hash_key(normalized_key) else 'normalized'), value
+        if ref is not None:
+            # Stored under another tier 2 key (a different hint), or a full response from before pointers
+            value = self.store.peek_hashed(ref[len(REF_PREFIX):]) if ref.startswith(REF_PREFIX) else ref
+            if value is not None:
+                return 'exact', value
+        if hint and self.index.threshold < 1.0:
+            value, _ = self.index.search(normalize_query(hint), temperature)
+            if value is not None:
+                return 'similar', value
+        return None, None
+
+    @traced('cache.put')
+    def put(self, cache_key, prompt, temperature, value, hint=None):
+        """Store a fresh response once, under its normalized key, and point the exact key at it."""
+        normalized_key = self._normalized_key(prompt, temperature, hint)
+        self.store.put(normalized_key, value)
+        self.store.put(cache_key, REF_PREFIX + hash_key(normalized_key), hot=False)
+        if hint and self.index.threshold < 1.0:
+            self.index.add(normalize_query(hint), temperature, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.hits.values()) + self.misses
+            return {
+                'tiers': {tier: {'hits': hits, 'hit_rate': hits / lookups if lookups else 0.0}
+                          for tier, hits in self.hits.items()},
+                'misses': self.misses,
+                'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+                'similarity_threshold': self.index.threshold,
+                'index_entries': len(self.index),
+            }
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_semantic_cache():
+    """Return the process-wide tiered cache, creating it on first use."""
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = SemanticCache()
+    return _CACHE
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    index = SimilarityIndex(threshold=0.9)
+    index.add(normalize_query("What is the capital of France?"), 0.7, "Paris")
+    index.add(normalize_query("Can I take ibuprofen with alcohol?"), 0.7, "Better not.")
+    for query in ("what is the capital of france", "What's the capital of France?", "what is the capital of spain",
+                  "can I take ibuprofen without alcohol"):
+        print(query, "->", index.search(normalize_query(query), 0.7))
@@ -0,0 +1,108 @@
+# singleflight.py: Coalesce concurrent identical calls into one execution
+"""
+If several threads ask for the same key while a call for it is already in
+flight, they wait for that call instead of starting their own. Every caller
+receives the same return value, or the same exception is raised in each.
+Sync (thread) and async (coroutine) callers share the same in-flight table,
+so an async request can join a call started by a worker thread and vice versa
+without tying up a thread while it waits.
+"""
+
+import asyncio
+import threading
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters', 'futures')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.futures = []  # (loop, future) pairs of async waiters
+
+    def finish(self):
+        self.done.set()
+        for loop, future in self.futures:
+            try:
+                loop.call_soon_threadsafe(self._resolve, future)
+            except RuntimeError:
+                pass  # Waiter's event loop already closed
+
+    def _resolve(self, future):
+        if future.done():
+            return
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result(self.result)
+
+class SingleFlight:
+    """Per-key in-flight deduplication for threads and coroutines."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.shared = 0
+
+    def _join(self, key, future=None):
+        """Return (call, is_leader), registering an async waiter's future if given."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                if future is not None:
+                    call.futures.append((asyncio.get_running_loop(), future))
+                return call, False
+            call = self._calls[key] = _Call()
+            self.executions += 1
+            return call, True
+
+    def _release(self, key, call):
+        with self._lock:
+            del self._calls[key]
+        call.finish()
+
+    def do(self, key, fn):
+        """Run fn() once per key among concurrent callers and return its result to all of them."""
+        call, leader = self._join(key)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._release(key, call)
+        return call.result
+
+    async def do_async(self, key, coro_fn):
+        """Async counterpart of do(): await coro_fn() once per key among concurrent callers."""
+        future = asyncio.get_running_loop().create_future()
+        call, leader = self._join(key, future)
+        if not leader:
+            return await future
+
+        try:
+            call.result = await coro_fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._release(key, call)
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {'executions': self.executions, 'shared': self.shared, 'in_flight': len(self._calls)}
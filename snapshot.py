@@ -0,0 +1,226 @@
+# snapshot.py: In-process, content-addressed snapshots of self-modified files
+"""
+Versioning for the files self_modify touches, without spawning git.
+
+File contents are stored once under their SHA-256 in SNAPSHOT_DIR/objects,
+and each snapshot is one JSON line in SNAPSHOT_DIR/snapshots.jsonl mapping
+paths to hashes. Snapshots only cover the files being modified, so taking,
+diffing and restoring one costs O(changed files) rather than a walk of the
+working tree. A per-path stat cache lets snapshot() skip re-reading files
+that haven't changed.
+
+export_git() replays every snapshot not yet exported onto a git branch in
+a single `git fast-import` run, for when a real history is wanted.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+import uuid
+from logger import log_change
+
+SNAPSHOT_DIR = '.snapshots'
+EXPORT_BRANCH = 'self-modify-history'
+HEAD = object()  # Default parent for record()/snapshot(): the latest snapshot
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+class SnapshotStore:
+    """Append-only snapshot log over a content-addressed object directory."""
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.index_file = os.path.join(root, 'snapshots.jsonl')
+        self.export_file = os.path.join(root, 'exported')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._snapshots = {}   # id -> {'id', 'parent', 'label', 'files', 'created'}
+        self._order = []       # ids, oldest first
+        self._known = set(os.listdir(self.objects_dir))
+        self._stat_cache = {}  # path -> (mtime_ns, size, sha)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._snapshots[entry['id']] = entry
+                    self._order.append(entry['id'])
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            log_change("Snapshot index damaged", str(e), level='ERROR')
+
+    def _put_object(self, text):
+        sha = content_hash(text)
+        if sha not in self._known:
+            _write_atomic(os.path.join(self.objects_dir, sha), text)
+            self._known.add(sha)
+        return sha
+
+    def read_object(self, sha):
+        with open(os.path.join(self.objects_dir, sha), 'r') as f:
+            return f.read()
+
+    def _file_hash(self, path):
+        """Hash of path's current content, reading it only if its stat changed."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        cached = self._stat_cache.get(path)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        with open(path, 'r') as f:
+            sha = self._put_object(f.read())
+        self._stat_cache[path] = (st.st_mtime_ns, st.st_size, sha)
+        return sha
+
+    def head(self):
+        """The most recent snapshot, or None."""
+        with self._lock:
+            return self._snapshots[self._order[-1]] if self._order else None
+
+    def get(self, snapshot_id):
+        return self._snapshots.get(snapshot_id)
+
+    def record(self, contents, label='', parent=HEAD):
+        """
+        Snapshot in-memory contents ({path: text}); paths not given carry over
+        from the parent (default: head; None starts a new root). Returns the snapshot id; an unchanged
+        set of files returns the parent's id instead of a new snapshot.
+        """
+        hashes = {path: self._put_object(text) for path, text in contents.items()}
+        return self._commit(hashes, label, parent)
+
+    def snapshot(self, paths, label='', parent=HEAD):
+        """Snapshot the current on-disk contents of paths. Returns the snapshot id."""
+        hashes = {}
+        for path in paths:
+            sha = self._file_hash(path)
+            if sha is not None:
+                hashes[path] = sha
+        return self._commit(hashes, label, parent)
+
+    def _commit(self, hashes, label, parent):
+        with self._lock:
+            if parent is HEAD:
+                parent = self._order[-1] if self._order else None
+            base = self._snapshots[parent]['files'] if parent else {}
+            files = dict(base)
+            files.update(hashes)
+            if parent and files == base:
+                return parent
+            entry = {'id': uuid.uuid4().hex[:16], 'parent': parent, 'label': label,
+                     'files': files, 'created': time.time()}
+            with open(self.index_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+            self._snapshots[entry['id']] = entry
+            self._order.append(entry['id'])
+            return entry['id']
+
+    def diff(self, a, b):
+        """Paths whose content differs between snapshots a and b: {path: (sha_a, sha_b)}."""
+        files_a = self._snapshots[a]['files']
+        files_b = self._snapshots[b]['files']
+        return {path: (files_a.get(path), files_b.get(path))
+                for path in files_a.keys() | files_b.keys()
+                if files_a.get(path) != files_b.get(path)}
+
+    def restore(self, snapshot_id, paths=None):
+        """Write back the snapshot's version of paths (default: all it covers) where they differ. Returns paths written."""
+        entry = self._snapshots.get(snapshot_id)
+        if entry is None:
+            raise KeyError(f"Unknown snapshot: {snapshot_id}")
+        written = []
+        for path in paths or entry['files']:
+            sha = entry['files'].get(path)
+            if sha is None or self._file_hash(path) == sha:
+                continue
+            _write_atomic(path, self.read_object(sha))
+            self._stat_cache.pop(path, None)
+            written.append(path)
+        if written:
+            log_change("Restored snapshot", f"{snapshot_id}: {', '.join(written)}")
+        return written
+
+    def export_git(self, repo='.', branch=EXPORT_BRANCH):
+        """
+        Replay snapshots not yet exported as commits on branch, in one
+        `git fast-import` run. The branch starts from HEAD the first time.
+        Returns the number of commits written.
+        """
+        try:
+            with open(self.export_file, 'r') as f:
+                exported = set(f.read().split())
+        except FileNotFoundError:
+            exported = set()
+        with self._lock:
+            pending = [self._snapshots[i] for i in self._order if i not in exported]
+        if not pending:
+            return 0
+
+        ref = f"refs/heads/{branch}"
+        if subprocess.run(['git', 'rev-parse', '--verify', '--quiet', ref], cwd=repo, capture_output=True).returncode == 0:
+            start = f"{ref}^0"
+        else:
+            start = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, capture_output=True, text=True,
+                                   check=True).stdout.strip()
+        stream = []
+        for n, entry in enumerate(pending):
+            message = (entry['label'] or f"Snapshot {entry['id']}").encode('utf-8')
+            stream.append(f"commit {ref}\ncommitter SelfImprovingAI <self@localhost> {int(entry['created'])} +0000\n".encode())
+            stream.append(f"data {len(message)}\n".encode() + message + b"\n")
+            if n == 0:
+                stream.append(f"from {start}\n".encode())
+            for path, sha in sorted(entry['files'].items()):
+                data = self.read_object(sha).encode('utf-8')
+                stream.append(f"M 100644 inline {os.path.relpath(path, repo)}\ndata {len(data)}\n".encode() + data + b"\n")
+            stream.append(b"\n")
+        subprocess.run(['git', 'fast-import', '--quiet'], cwd=repo, input=b"".join(stream), check=True)
+        with open(self.export_file, 'a') as f:
+            f.write("".join(f"{entry['id']}\n" for entry in pending))
+        log_change("Exported snapshots to git", f"{len(pending)} commits on {branch}")
+        return len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {'snapshots': len(self._order), 'objects': len(self._known),
+                    'head': self._order[-1] if self._order else None}
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_snapshot_store():
+    """Return the process-wide snapshot store, creating it on first use."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = SnapshotStore()
+    return _STORE
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    store = get_snapshot_store()
+    with open('core.py') as f:
+        code = f.read()
+    start = time.perf_counter()
+    base = store.record({'core.py': code}, label='Example base')
+    patched = store.record({'core.py': code + "\n# patched\n"}, label='Example patch', parent=base)
+    print(f"record x2: {(time.perf_counter() - start) * 1000:.3f} ms", store.diff(base, patched))
+    start = time.perf_counter()
+    store.restore(base)
+    print(f"restore (no-op): {(time.perf_counter() - start) * 1000:.3f} ms", store.stats())
@@ -0,0 +1,28 @@
+# tests/test_app.py: /events stream slots
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.create_app(start_background=False).test_client()
+
+
+def test_failed_event_stream_setup_releases_its_slot(client, monkeypatch):
+    real_bus = app_module.get_event_bus
+
+    def broken_bus():
+        raise RuntimeError("bus unavailable")
+
+    monkeypatch.setattr(app_module, 'get_event_bus', broken_bus)
+    for _ in range(app_module.MAX_EVENT_STREAMS + 1):
+        assert client.get('/events').status_code == 500
+    assert app_module._streams == 0
+
+    monkeypatch.setattr(app_module, 'get_event_bus', real_bus)
+    response = client.get('/events', buffered=False)
+    assert response.status_code == 200
+    assert app_module._streams == 1
+    response.close()
+    assert app_module._streams == 0
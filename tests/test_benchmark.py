@@ -0,0 +1,53 @@
+# tests/test_benchmark.py: The regression gate in benchmark.py
+import random
+
+import pytest
+
+import benchmark
+
+
+def results(samples, mem=10000, passed=True):
+    return {'case': {'samples_ns': samples, 'mem_peak': mem, 'passed': passed, 'error': None}}
+
+
+def noisy(median_ns, n=27, spread=0.3, seed=0):
+    rng = random.Random(seed)
+    return [median_ns * (1 + rng.uniform(-spread, spread)) for _ in range(n)]
+
+
+def test_compare_flags_a_real_slowdown():
+    report = benchmark.compare(results(noisy(100_000)), results(noisy(200_000, seed=1)))
+    assert report['regressions'] == ['case']
+
+
+def test_compare_ignores_small_relative_and_absolute_differences():
+    # 30% slower but only 3 us: under the absolute floor
+    assert not benchmark.compare(results(noisy(10_000)), results(noisy(13_000, seed=1)))['regressed']
+    # A consistent but 3% shift on a slow case: under the relative floor and the tolerance
+    assert not benchmark.compare(results(noisy(5_000_000, spread=0.01)),
+                                 results(noisy(5_150_000, spread=0.01, seed=1)))['regressed']
+
+
+def test_unconfirmed_regression_is_dropped():
+    first = benchmark.compare(results(noisy(100_000)), results(noisy(200_000, seed=1)))
+    recheck = benchmark.compare(results(noisy(100_000)), results(noisy(100_000, seed=2)))
+    report = benchmark._confirm(first, recheck)
+    assert not report['regressed']
+    assert report['cases'][0]['unconfirmed'] == 'slower'
+
+
+@pytest.fixture(scope='module')
+def core_source():
+    with open('core.py') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('attempt', range(3))
+def test_gate_never_flags_identical_source(core_source, attempt):
+    report = benchmark.gate_patch(core_source, core_source)
+    assert not report['regressed'], report['regressions']
+
+
+def test_gate_accepts_a_comment_only_edit(core_source):
+    report = benchmark.gate_patch(core_source, core_source + "\n# A comment-only change\n")
+    assert not report['regressed'], report['regressions']
@@ -0,0 +1,101 @@
+# tests/test_cache_store.py: TTL expiry, LRU bounds and disk pruning of the LLM cache
+import pytest
+
+import cache_store
+from cache_store import CacheStore, LRUCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_store, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, clock):
+    monkeypatch.chdir(tmp_path)  # No legacy llm_cache.json to import
+    return CacheStore(path=str(tmp_path / 'cache.db'), ttl=100, max_entries=3)
+
+
+def test_lru_expires_entries_after_ttl(clock):
+    lru = LRUCache(ttl=10)
+    lru.put('k', 'v')
+    clock.now += 9
+    assert lru.get('k') == 'v'
+    clock.now += 1
+    assert lru.get('k') is None
+    assert lru.stats()['expirations'] == 1
+    assert len(lru) == 0
+
+
+def test_lru_entry_loaded_from_disk_keeps_its_original_expiry(clock):
+    lru = LRUCache(ttl=10)
+    lru.put('old', 'v', created=clock.now - 10)
+    assert lru.get('old') is None
+    lru.put('young', 'v', created=clock.now - 5)
+    clock.now += 5
+    assert lru.get('young') is None
+
+
+def test_lru_evicts_least_recently_used(clock):
+    lru = LRUCache(max_entries=2, ttl=None)
+    lru.put('a', '1')
+    lru.put('b', '2')
+    lru.get('a')
+    lru.put('c', '3')
+    assert lru.get('b') is None
+    assert lru.get('a') == '1' and lru.get('c') == '3'
+    assert lru.stats()['evictions'] == 1
+
+
+def test_store_expires_disk_rows_after_ttl(store, clock):
+    store.put('prompt', 'answer')
+    store.hot.clear()
+    clock.now += 99
+    assert store.get('prompt') == 'answer'  # Disk hit, refills the hot tier
+    clock.now += 1
+    assert store.get('prompt') is None
+    stats = store.stats()
+    assert (stats['disk']['hits'], stats['misses']) == (1, 1)
+
+
+def test_expired_row_is_replaced_on_put(store, clock):
+    store.put('prompt', 'old')
+    clock.now += 100
+    store.put('prompt', 'new')
+    store.hot.clear()
+    assert store.get('prompt') == 'new'
+
+
+def test_prune_drops_expired_then_oldest_rows(store, clock):
+    store.put('stale', 'v')
+    clock.now += 100
+    for n in range(4):
+        clock.now += 1
+        store.put(f'fresh{n}', 'v')
+
+    assert store.prune() == 2  # 'stale' expired; 'fresh0' is past max_entries
+    assert len(store) == 3
+    store.hot.clear()
+    assert store.get('fresh0') is None
+    assert all(store.get(f'fresh{n}') == 'v' for n in (1, 2, 3))
+    assert store.stats()['disk']['evictions'] == 2
+
+
+def test_no_ttl_keeps_rows(tmp_path, monkeypatch, clock):
+    monkeypatch.chdir(tmp_path)
+    store = CacheStore(path=str(tmp_path / 'cache.db'), ttl=None, max_entries=None)
+    store.put('prompt', 'answer')
+    clock.now += 10 ** 9
+    store.hot.clear()
+    assert store.prune() == 0
+    assert store.get('prompt') == 'answer'
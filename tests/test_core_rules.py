@@ -0,0 +1,76 @@
+# tests/test_core_rules.py: Numeric parsing and the sort/math rules in core.py
+import pytest
+
+import core
+from numeric import parse_numbers, to_python
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("sort 5 3 1", [5, 3, 1]),
+    ("sort 5, 3, 1.", [5, 3, 1]),
+    ("2+3", [2, 3]),
+    ("what is 2 + 3?", [2, 3]),
+    ("add 1.5 -2 4", [1.5, -2, 4]),
+    ("sort desc top 3 9 1 8", [3, 9, 1, 8]),
+])
+def test_parse_numbers(text, expected):
+    assert [to_python(v) for v in list(parse_numbers(text))] == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("sort 5 3 1", [1, 3, 5]),
+    ("add 2 3", 5),
+    ("2 + 3", 5),
+    ("subtract 3 from 10", 7),
+    ("mean 1 2 3", 2),
+    ("what is the max of 4, 9, 2", 9),
+    ("compute the average of -1 and 3", 1),
+    ("median: 1, 5, 2", 2),
+])
+def test_rules_answer_numeric_queries(query, expected):
+    assert core.apply_rules(query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "max speed of a cheetah",
+    "what do you mean?",
+    "sort out my week",
+    "what is the average age of 30 people",
+    "I need a minimum of 3 hours of sleep",
+    "I am 25 years old and the max speed is 100",
+    "average 5",
+])
+def test_ordinary_chat_goes_to_llm(query):
+    assert core.apply_rules(query) is core.NO_RULE
+
+
+INT64_MAX = 2 ** 63 - 1
+
+
+@pytest.mark.parametrize("query, expected", [
+    (f"add {INT64_MAX} 1", INT64_MAX + 1),
+    (f"add {-INT64_MAX - 1} -1", -INT64_MAX - 2),
+    (f"subtract {-INT64_MAX - 1} 1", -INT64_MAX - 2),
+    (f"subtract 1 from {-INT64_MAX - 1}", -INT64_MAX - 2),
+    (f"add {INT64_MAX} 0", INT64_MAX),
+    (f"add {INT64_MAX + 1} 1", INT64_MAX + 2),
+    (f"multiply {INT64_MAX} 2", INT64_MAX * 2),
+    ("add 99999999999999999999 1", 100000000000000000000),
+])
+def test_integer_results_do_not_overflow(query, expected):
+    result = core.apply_rules(query)
+    assert result == expected and isinstance(result, int)
+
+
+def test_integers_beyond_int64_parse_exactly():
+    big = 2 ** 70 + 1
+    assert [to_python(v) for v in list(parse_numbers(f"sort {big} 3"))] == [big, 3]
+    assert core.apply_rules(f"sort {big} 3 -1") == [-1, 3, big]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("5 sort plus 2", [2, 5]),
+    ("3 hi plus 4", "Hello! How can I help you today?"),
+])
+def test_higher_priority_rule_wins_over_overlapping_match(query, expected):
+    assert core.apply_rules(query) == expected
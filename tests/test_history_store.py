@@ -0,0 +1,33 @@
+# tests/test_history_store.py: Persistent session history shared by several workers
+import threading
+
+from history_store import HistoryStore
+
+
+def test_workers_appending_to_one_session_keep_every_turn(tmp_path):
+    path = str(tmp_path / 'history.db')
+    first, second = HistoryStore(db_path=path), HistoryStore(db_path=path)
+    first.append('s', 'one', 1)
+    second.append('s', 'two', 2)  # Would have reused seq 1 and replaced 'one'
+    first.append('s', 'three', 3)
+    assert HistoryStore(db_path=path).recent('s', 10) == [('one', 1), ('two', 2), ('three', 3)]
+
+
+def test_concurrent_appends_get_distinct_seqs(tmp_path):
+    path = str(tmp_path / 'history.db')
+    workers = [HistoryStore(db_path=path) for _ in range(4)]
+    threads = [threading.Thread(target=lambda w=w, i=i: [w.append('s', f"{i}-{n}", n) for n in range(25)])
+               for i, w in enumerate(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(HistoryStore(db_path=path).recent('s', 1000)) == 100
+
+
+def test_persisted_history_is_trimmed_to_max_turns(tmp_path):
+    path = str(tmp_path / 'history.db')
+    store = HistoryStore(max_turns=3, db_path=path)
+    for n in range(5):
+        store.append('s', str(n), n)
+    assert HistoryStore(max_turns=10, db_path=path).recent('s', 10) == [('2', 2), ('3', 3), ('4', 4)]
@@ -0,0 +1,49 @@
+# tests/test_logger.py: Log rotation and blob retention
+import os
+import time
+
+import pytest
+
+import logger
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(logger, 'LOG_FILE', str(tmp_path / 'changes.log'))
+    monkeypatch.setattr(logger, 'BLOB_DIR', str(tmp_path / 'blobs'))
+    monkeypatch.setattr(logger, 'MAX_BYTES', 1)
+    monkeypatch.setattr(logger, 'BACKUP_COUNT', 1)
+    monkeypatch.setattr(logger, '_segment_started', None)
+    return tmp_path
+
+
+def write_segment(payload):
+    """Append one record with a blob-sized prompt, then rotate; returns the blob's hash."""
+    line = logger._format(time.time(), 'INFO', 'big', None, payload, None)
+    with open(logger.LOG_FILE, 'a') as f:
+        f.write(line)
+    digest = logger._store_blob(payload)
+    old = time.time() - 60  # Written well before the next rotation's scan
+    os.utime(os.path.join(logger.BLOB_DIR, digest), (old, old))
+    time.sleep(0.01)  # Distinct rotated-segment names
+    logger._rotate_if_needed()
+    return digest
+
+
+def test_rotation_deletes_blobs_only_dropped_segments_reference(log_dir):
+    size = logger.BLOB_THRESHOLD + 1
+    first = write_segment("a" * size)
+    second = write_segment("b" * size)
+
+    blobs = set(os.listdir(logger.BLOB_DIR))
+    assert first not in blobs  # Its segment was pruned (BACKUP_COUNT = 1)
+    assert second in blobs
+    assert logger.read_blob(second) == "b" * size
+
+
+def test_reused_blob_survives_rotation(log_dir):
+    payload = "c" * (logger.BLOB_THRESHOLD + 1)
+    digest = write_segment(payload)
+    assert write_segment(payload) == digest
+    assert logger.read_blob(digest) == payload
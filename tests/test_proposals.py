@@ -0,0 +1,125 @@
+# tests/test_proposals.py: Deciding on queued patch proposals
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import modify
+from proposals import EVAL_LEASE, ProposalQueue
+
+DEAD_PID = 2 ** 22 + 1  # Above Linux pid_max, so never a live process
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """prepare_patch blocks until the returned event is set; apply_prepared records what it applied."""
+    release = threading.Event()
+    applied = []
+
+    def prepare_patch(query, target, tests=None, candidates=1):
+        release.wait(10)
+        return {'target': target, 'base_sha': '', 'diff': '', 'source': query, 'benchmark': {'regressed': False}}
+
+    monkeypatch.setattr(modify, 'prepare_patch', prepare_patch)
+    monkeypatch.setattr(modify, 'apply_prepared', lambda prepared, label='': applied.append(prepared['source']))
+    release.applied = applied
+    return release
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return ProposalQueue(path=str(tmp_path / 'proposals.db'), workers=1)
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_reject_does_not_wait_for_another_proposals_evaluation(queue, gate):
+    slow = queue.add("slow patch")
+    other = queue.add("other patch")
+    wait_for(lambda: queue.get(slow)['status'] == 'evaluating')
+
+    results = {}
+    approver = threading.Thread(target=lambda: results.setdefault('approve', queue.decide(slow, 'approve')))
+    approver.start()
+    time.sleep(0.1)  # The approval is now waiting on the in-flight evaluation
+
+    start = time.monotonic()
+    message = queue.decide(other, 'reject')
+    assert time.monotonic() - start < 1.0
+    assert "rejected" in message
+    assert queue.get(other)['status'] == 'rejected'
+
+    gate.set()
+    approver.join(10)
+    assert "applied successfully" in results['approve']
+    assert queue.get(slow)['status'] == 'applied'
+    assert gate.applied == ["slow patch"]
+
+
+def test_proposal_rejected_during_evaluation_is_not_applied(queue, gate):
+    proposal = queue.add("patch")
+    wait_for(lambda: queue.get(proposal)['status'] == 'evaluating')
+
+    results = {}
+    approver = threading.Thread(target=lambda: results.setdefault('approve', queue.decide(proposal, 'approve')))
+    approver.start()
+    time.sleep(0.1)
+    assert "rejected" in queue.decide(proposal, 'reject')
+
+    gate.set()
+    approver.join(10)
+    assert "nothing was applied" in results['approve']
+    assert queue.get(proposal)['status'] == 'rejected'
+    assert gate.applied == []
+
+
+def _stuck(path, owner, claimed):
+    """Leave a proposal 'evaluating' as if a worker process had claimed it."""
+    queue = ProposalQueue(path=path, workers=1)
+    queue._executor.shutdown(wait=False)
+    conn = queue._connect()
+    cursor = conn.execute(
+        "INSERT INTO proposals (query, target, tests, status, owner, claimed, created, updated) "
+        "VALUES ('patch', 'core.py', '[]', 'evaluating', ?, ?, 0, 0)", (owner, claimed))
+    return cursor.lastrowid
+
+
+def test_restart_leaves_another_live_workers_evaluation_alone(tmp_path, gate):
+    path = str(tmp_path / 'proposals.db')
+    live = _stuck(path, os.getppid(), time.time())
+    queue = ProposalQueue(path=path, workers=1)
+    time.sleep(0.1)
+    assert queue.get(live)['status'] == 'evaluating'
+    assert queue.stats()['evaluating_now'] == 0  # Not picked up a second time here
+
+
+@pytest.mark.parametrize("owner, age", [(None, 0), (DEAD_PID, 0), ('parent', EVAL_LEASE + 1)])
+def test_restart_requeues_abandoned_evaluations(tmp_path, gate, owner, age):
+    path = str(tmp_path / 'proposals.db')
+    abandoned = _stuck(path, os.getppid() if owner == 'parent' else owner, time.time() - age)
+    queue = ProposalQueue(path=path, workers=1)
+    gate.set()
+    wait_for(lambda: queue.get(abandoned)['status'] == 'ready')
+
+
+def test_database_from_before_claim_columns_is_migrated(tmp_path, gate):
+    path = str(tmp_path / 'proposals.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE proposals (id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT NOT NULL, "
+                 "target TEXT NOT NULL, tests TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+                 "status TEXT NOT NULL, prepared TEXT, error TEXT, result TEXT, "
+                 "created REAL NOT NULL, updated REAL NOT NULL)")
+    conn.execute("INSERT INTO proposals (query, target, tests, status, created, updated) "
+                 "VALUES ('patch', 'core.py', '[]', 'evaluating', 0, 0)")
+    conn.commit()
+    conn.close()
+    queue = ProposalQueue(path=path, workers=1)
+    gate.set()
+    wait_for(lambda: queue.get(1)['status'] == 'ready')
@@ -0,0 +1,100 @@
+# tests/test_rollback.py: Snapshot history and modify.rollback()
+import pytest
+
+import modify
+from snapshot import SnapshotStore
+
+
+class StubRegistry:
+    """Stands in for the core registry; the rolled-back file here isn't core.py."""
+    path = 'core.py'
+
+    def stats(self):
+        return {'active': {'version': 1}}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = SnapshotStore(root=str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(modify, 'get_snapshot_store', lambda: store)
+    monkeypatch.setattr(modify, 'get_registry', lambda: StubRegistry())
+    return store
+
+
+def write_version(store, text, parent=None):
+    with open('target.py', 'w') as f:
+        f.write(text)
+    return store.snapshot(['target.py'], label=text.strip(), **({'parent': parent} if parent else {}))
+
+
+def read_target():
+    with open('target.py') as f:
+        return f.read()
+
+
+def test_repeated_rollbacks_walk_back_through_history(store):
+    for text in ("p0\n", "p1\n", "p2\n"):
+        write_version(store, text)
+
+    modify.rollback()
+    assert read_target() == "p1\n"
+    modify.rollback()
+    assert read_target() == "p0\n"
+    with pytest.raises(RuntimeError):
+        modify.rollback()
+    assert read_target() == "p0\n"
+
+
+def test_patch_after_rollback_rolls_back_to_the_restored_version(store):
+    for text in ("p0\n", "p1\n", "p2\n"):
+        write_version(store, text)
+    modify.rollback()
+    write_version(store, "p3\n")
+
+    modify.rollback()
+    assert read_target() == "p1\n"
+    modify.rollback()
+    assert read_target() == "p0\n"
+
+
+def test_record_with_no_parent_starts_a_root(store):
+    first = store.record({'target.py': "a\n"})
+    root = store.record({'target.py': "b\n"}, parent=None)
+    assert store.get(first)['parent'] is None
+    assert store.get(root)['parent'] is None
+
+
+class RecordingRegistry(StubRegistry):
+    path = 'target.py'
+
+    def __init__(self):
+        self.live = None
+
+    def load(self, source):
+        self.live = source
+        return {'version': 2}
+
+    def restore(self, source):
+        self.live = source
+        return {'version': 1}
+
+
+def test_failed_finalize_restores_file_and_live_module(store, monkeypatch):
+    registry = RecordingRegistry()
+    monkeypatch.setattr(modify, 'get_registry', lambda: registry)
+    write_version(store, "old\n")
+    prepared = {'target': 'target.py', 'base_sha': modify.content_hash("old\n"), 'source': "new\n"}
+
+    record = store.record
+
+    def fail_on_finalize(contents, **kwargs):
+        if contents['target.py'] == "new\n":
+            raise OSError("disk full")
+        return record(contents, **kwargs)
+    monkeypatch.setattr(store, 'record', fail_on_finalize)
+
+    with pytest.raises(OSError):
+        modify.apply_prepared(prepared, 'test')
+    assert read_target() == "old\n"
+    assert registry.live == "old\n"
@@ -0,0 +1,62 @@
+# tests/test_rules.py: RuleRegistry priority and dispatch
+from rules import RuleRegistry, NO_MATCH
+
+
+def answer(text):
+    return lambda query, match: text
+
+
+def test_earliest_registered_rule_wins():
+    rules = RuleRegistry()
+    rules.register('first', r'\bfoo\b', answer('first'))
+    rules.register('second', r'\bbar\b', answer('second'))
+    assert rules.dispatch("bar foo") == 'first'
+    assert rules.dispatch("bar") == 'second'
+    assert rules.dispatch("baz") is NO_MATCH
+
+
+def test_rule_registered_after_unregister_ranks_last():
+    rules = RuleRegistry()
+    rules.register('a', r'\bx\b', answer('a'))
+    rules.register('b', r'\bx\b', answer('b'))
+    rules.unregister('a')
+    rules.register('late', r'\by\b', answer('late'))
+    # 'late' matches first in the text, but 'b' was registered before it
+    assert rules.dispatch("y x") == 'b'
+    rules.unregister('b')
+    assert rules.dispatch("y x") == 'late'
+
+
+def test_replaced_rule_keeps_its_priority():
+    rules = RuleRegistry()
+    rules.register('a', r'\bx\b', answer('a'))
+    rules.register('b', r'\bx\b', answer('b'))
+    rules.register('a', r'\bx\b', answer('a2'))
+    assert rules.dispatch("x") == 'a2'
+
+
+def test_declining_rule_passes_query_to_next_match():
+    rules = RuleRegistry()
+    rules.register('picky', r'\bsort\b', lambda query, match: NO_MATCH)
+    rules.register('fallback', r'\bweek\b', answer('fallback'))
+    rules.register('unrelated', r'\bzzz\b', answer('unrelated'))
+    assert rules.dispatch("sort out my week") == 'fallback'
+    assert [s['hits'] for s in rules.stats()] == [0, 1, 0]
+    assert rules.dispatch("sort it") is NO_MATCH
+
+
+def test_lower_priority_match_does_not_hide_a_higher_priority_keyword():
+    rules = RuleRegistry()
+    rules.register('greeting', r'\bhi\b', answer('greeting'))
+    rules.register('sort', r'\bsort\b', answer('sort'))
+    rules.register('add', r'\d\W+(?:\w+\W+){0,2}plus\b', answer('add'))
+    assert rules.dispatch("5 sort plus 2") == 'sort'
+    assert rules.dispatch("3 hi plus 4") == 'greeting'
+    assert rules.dispatch("3 and plus 4") == 'add'
+
+
+def test_handler_gets_its_own_rules_match():
+    rules = RuleRegistry()
+    rules.register('other', r'\bzzz\b', answer('other'))
+    rules.register('word', r'\bsort\w*', lambda query, match: match.group(0))
+    assert rules.dispatch("please sorting now") == 'sorting'
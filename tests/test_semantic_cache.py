@@ -0,0 +1,54 @@
+# tests/test_semantic_cache.py: Lookup tiers in front of the CacheStore
+import pytest
+
+from cache_store import CacheStore
+from semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # No legacy llm_cache.json to import
+    return SemanticCache(store=CacheStore(path=str(tmp_path / 'cache.db')))
+
+
+def lookup(cache, prompt, hint=None):
+    return cache.get(f"{prompt}::0.7", prompt, 0.7, hint)
+
+
+def test_one_miss_then_one_hit_counts_each_lookup_once(cache):
+    prompt = "System\nUser: What is the capital of France?\nAssistant:"
+    assert lookup(cache, prompt, "What is the capital of France?") is None
+    cache.put(f"{prompt}::0.7", prompt, 0.7, "Paris", "What is the capital of France?")
+    assert lookup(cache, prompt, "What is the capital of France?") == "Paris"
+
+    tiers = cache.stats()
+    assert tiers['misses'] == 1
+    assert tiers['tiers']['exact']['hits'] == 1
+    assert tiers['hit_rate'] == 0.5
+    store = cache.store.stats()
+    assert (store['hits'], store['misses']) == (1, 1)
+    assert store['hot']['entries'] == 1  # The response once; the exact-key pointer stays on disk
+    assert store['disk']['entries'] == 2
+
+
+def test_normalized_tier_hits_other_spellings(cache):
+    cache.put("A::0.7", "System\nUser: What is the capital of France?\nAssistant:", 0.7, "Paris",
+              "What is the capital of France?")
+    other = "System\nUser: what is the capital of france\nAssistant:"
+    assert lookup(cache, other, "what is the capital of france") == "Paris"
+    assert cache.stats()['tiers']['normalized']['hits'] == 1
+
+
+def test_exact_pointer_finds_a_response_stored_under_another_hint(cache):
+    prompt = "System\nUser: hello there\nAssistant:"
+    cache.put(f"{prompt}::0.7", prompt, 0.7, "Hi!", "hello there")
+    cache.store.hot.clear()
+    assert lookup(cache, prompt) == "Hi!"  # No hint: different tier 2 key, same exact key
+    assert cache.stats()['tiers']['exact']['hits'] == 1
+
+
+def test_peek_counts_nothing(cache):
+    cache.put("p::0.7", "p", 0.7, "answer")
+    assert cache.peek("p::0.7", "p", 0.7) == "answer"
+    assert cache.stats()['misses'] == 0 and sum(t['hits'] for t in cache.stats()['tiers'].values()) == 0
+    assert cache.store.stats()['hits'] == 0
@@ -0,0 +1,58 @@
+# tests/test_tournament.py: Best-of-N candidate evaluation in modify.run_tournament
+import threading
+import time
+
+import pytest
+
+import modify
+
+
+class Tracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {'correctness': 0, 'timed': 0}
+        self.peak = {'correctness': 0, 'timed': 0}
+        self.calls = {'correctness': 0, 'timed': 0}
+
+    def evaluate(self, source, test_cases, repeat=5, warmup=1, **kwargs):
+        kind = 'correctness' if repeat == 1 else 'timed'
+        with self.lock:
+            self.running[kind] += 1
+            self.calls[kind] += 1
+            self.peak[kind] = max(self.peak[kind], self.running[kind])
+        time.sleep(0.2)
+        with self.lock:
+            self.running[kind] -= 1
+        samples = [1000] * repeat
+        return {'avg_acc': 1.0, 'avg_time': 1e-6, 'p50': 1e-6, 'p95': 1e-6, 'failures': 0, 'timeouts': 0,
+                'cases': [{'samples_ns': samples} for _ in test_cases]}
+
+
+@pytest.fixture
+def tracker(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    tracker = Tracker()
+    monkeypatch.setattr(modify, 'evaluate', tracker.evaluate)
+    monkeypatch.setattr(modify, 'query_llm', lambda prompt, max_tokens, temperature: f"--- diff at {temperature}")
+    monkeypatch.setattr(modify, '_candidate_source', lambda code, diff, max_lines, phase: "x = 1  # " + diff * 5)
+    monkeypatch.setattr(modify, 'get_current_phase', lambda: 0)
+    monkeypatch.setattr(modify, 'gate_patch', lambda current, candidate, tol, mem: {'regressed': False})
+    return tracker
+
+
+def test_correctness_runs_overlap_and_timed_runs_take_turns(tracker):
+    tests = [("hello", "Hello!")]
+    prepared = modify.run_tournament("q", 'core.py', "x = 0\n", "prompt", tests)
+
+    assert prepared['tournament']['winner'] == 1  # Tied on speed: lowest temperature
+    assert tracker.calls == {'correctness': 3, 'timed': 3}
+    assert tracker.peak['correctness'] == 3
+    assert tracker.peak['timed'] == 1
+
+
+def test_lone_survivor_skips_the_timed_pass(tracker, monkeypatch):
+    monkeypatch.setattr(modify, '_candidate_source', lambda code, diff, max_lines, phase: "x = 1  # same" * 5)
+    prepared = modify.run_tournament("q", 'core.py', "x = 0\n", "prompt", [("hello", "Hello!")])
+
+    assert prepared['tournament']['winner'] is not None
+    assert tracker.calls == {'correctness': 1, 'timed': 0}
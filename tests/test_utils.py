@@ -0,0 +1,65 @@
+# tests/test_utils.py: Unified diff parsing and application
+import pytest
+
+from utils import apply_patch, apply_patch_files, parse_patch, PatchError
+
+ORIGINAL = "line1\nline2\nline3\n"
+PATCH = "--- original\n+++ modified\n@@ -1,3 +1,3 @@\n line1\n-line2\n+new line2\n line3\n"
+
+
+def test_apply_and_revert():
+    patched = apply_patch(ORIGINAL, PATCH)
+    assert patched == "line1\nnew line2\nline3\n"
+    assert apply_patch(patched, PATCH, revert=True) == ORIGINAL
+
+
+def test_drifted_hunk_is_found_by_context():
+    assert apply_patch("header\n" * 5 + ORIGINAL, PATCH).endswith("line1\nnew line2\nline3\n")
+
+
+def test_missing_context_fails():
+    with pytest.raises(PatchError):
+        apply_patch("something\nelse\nentirely\n", PATCH)
+
+
+GIT_DIFF = """\
+diff --git a/x.py b/x.py
+index 1111111..2222222 100644
+--- a/x.py
++++ b/x.py
+@@ -1,2 +1,2 @@
+ a = 1
+-b = 2
++b = 3
+diff --git a/y.py b/y.py
+index 3333333..4444444 100644
+--- a/y.py
++++ b/y.py
+@@ -1,2 +1,3 @@
+ c = 1
++d = 2
+ e = 3
+
+diff --git a/z.py b/z.py
+new file mode 100644
+index 0000000..5555555
+--- /dev/null
++++ b/z.py
+@@ -0,0 +1 @@
++z = 0
+"""
+
+
+def test_multi_file_git_diff():
+    files = parse_patch(GIT_DIFF)
+    assert [f.path for f in files] == ['x.py', 'y.py', 'z.py']
+    assert [len(f.hunks[0].lines) for f in files] == [3, 3, 1]
+
+    updated, results = apply_patch_files({'x.py': "a = 1\nb = 2\n", 'y.py': "c = 1\ne = 3\n"}, GIT_DIFF)
+    assert updated == {'x.py': "a = 1\nb = 3\n", 'y.py': "c = 1\nd = 2\ne = 3\n", 'z.py': "z = 0\n"}
+    assert all(r['status'] == 'applied' for r in results)
+
+
+def test_garbage_inside_an_unfinished_hunk_is_rejected():
+    with pytest.raises(PatchError):
+        parse_patch("--- a/x.py\n+++ b/x.py\n@@ -1,2 +1,2 @@\n a = 1\nnot a diff line\n")
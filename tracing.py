@@ -0,0 +1,308 @@
+# tracing.py: Per-request tracing spans and an on-demand sampling profiler
+"""
+Tracing: every request gets a trace id (reused from an incoming X-Trace-Id
+header when it looks valid) and code on the request path marks its stages
+with `with span('name'):` - the rule chain, prompt building, cache lookups
+and writes, the upstream HTTP call, log_change, history and session
+handling. The current span lives in a ContextVar, so spans nest correctly
+across threads and the event loops async views run on. Finished traces go
+into a ring buffer of MAX_TRACES (see recent_traces()).
+
+Outside a trace, or with TRACING=0 in the environment, span() returns a
+shared no-op context manager: the cost is one ContextVar lookup.
+
+Profiling: profile(seconds) samples every thread's stack through
+sys._current_frames() every PROFILE_INTERVAL seconds and returns the
+counts of collapsed stacks ("thread;outer;...;inner"), the input format
+of flamegraph.pl and speedscope. Nothing runs between profiles.
+"""
+
+import functools
+import inspect
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+
+TRACING = os.environ.get("TRACING", "1") != "0"  # Set TRACING=0 to turn spans into no-ops
+MAX_TRACES = 200               # Finished traces kept in memory
+MAX_SPANS = 500                # Spans kept per trace (the rest are counted as dropped)
+PROFILE_INTERVAL = 0.005       # Seconds between stack samples
+PROFILE_MAX_SECONDS = 30.0     # Longest profile a caller may ask for
+
+_TRACE_ID_RE = re.compile(r'^[0-9a-fA-F]{8,32}$')
+
+_current = ContextVar('current_span', default=None)
+_traces = deque(maxlen=MAX_TRACES)
+_traces_lock = threading.Lock()
+_span_ids = itertools.count(1)  # Span ids only need to be unique within the process
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Trace:
+    __slots__ = ('trace_id', 'name', 'attrs', 'start', 'start_ns', 'end_ns', 'spans', 'dropped')
+
+    def __init__(self, name, trace_id=None, **attrs):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.spans = []
+        self.dropped = 0
+
+    def to_dict(self):
+        end_ns = self.end_ns or time.perf_counter_ns()
+        return {
+            'trace_id': self.trace_id, 'name': self.name, 'start': self.start,
+            'duration_ms': (end_ns - self.start_ns) / 1e6, 'attrs': self.attrs,
+            'spans': [s.to_dict(self.start_ns) for s in list(self.spans)], 'dropped_spans': self.dropped,
+        }
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'attrs', 'start_ns', 'end_ns', 'error', '_token')
+
+    def __init__(self, trace, name, parent_id, attrs):
+        self.trace = trace
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        trace = self.trace
+        if len(trace.spans) < MAX_SPANS:
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+        return False
+
+    def set(self, **attrs):
+        """Attach attributes (cache hit, status code, ...) to the span."""
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin_ns):
+        end_ns = self.end_ns or time.perf_counter_ns()
+        return {'name': self.name, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                'start_ms': (self.start_ns - origin_ns) / 1e6, 'duration_ms': (end_ns - self.start_ns) / 1e6,
+                'attrs': self.attrs, 'error': self.error}
+
+def span(name, **attrs):
+    """Context manager timing one stage of the current trace (a no-op outside a trace)."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    if isinstance(parent, Trace):
+        return Span(parent, name, None, attrs)
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+def traced(name):
+    """Decorator running each call of a function (or coroutine function) in a span."""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def current_trace_id():
+    current = _current.get()
+    if current is None:
+        return None
+    return current.trace_id if isinstance(current, Trace) else current.trace.trace_id
+
+def tag(**attrs):
+    """Attach attributes to the current trace itself (e.g. the Flask endpoint)."""
+    current = _current.get()
+    if current is not None:
+        (current if isinstance(current, Trace) else current.trace).attrs.update(attrs)
+
+def start_trace(name, trace_id=None, **attrs):
+    """Make a new trace current; returns (trace, token) for finish_trace, or None with tracing off."""
+    if not TRACING:
+        return None
+    if trace_id is not None and not _TRACE_ID_RE.match(trace_id):
+        trace_id = None
+    trace = Trace(name, trace_id, **attrs)
+    return trace, _current.set(trace)
+
+def finish_trace(handle, **attrs):
+    """End a trace from start_trace() and keep it in the ring buffer."""
+    if handle is None:
+        return
+    trace, token = handle
+    trace.end_ns = time.perf_counter_ns()
+    trace.attrs.update(attrs)
+    try:
+        _current.reset(token)
+    except ValueError:  # Finished from another context (e.g. a response closed elsewhere)
+        pass
+    with _traces_lock:
+        _traces.append(trace)
+
+def recent_traces(n=50, min_ms=0.0, trace_id=None):
+    """Newest finished traces first, as dicts; optionally only the slow ones or a single id."""
+    with _traces_lock:
+        traces = list(_traces)
+    result = []
+    for trace in reversed(traces):
+        if trace_id is not None and trace.trace_id != trace_id:
+            continue
+        if (trace.end_ns - trace.start_ns) / 1e6 < min_ms:
+            continue
+        result.append(trace.to_dict())
+        if len(result) >= n:
+            break
+    return result
+
+class TracingMiddleware:
+    """
+    WSGI middleware running each request inside a trace.
+
+    Wrapping the WSGI app (rather than Flask hooks) also covers session
+    loading and saving, and a streamed body: the trace ends when the
+    server closes the response. The id is returned as X-Trace-Id.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        handle = start_trace(f"{environ.get('REQUEST_METHOD', '')} {environ.get('PATH_INFO', '')}",
+                             environ.get('HTTP_X_TRACE_ID'))
+        if handle is None:
+            return self.wsgi_app(environ, start_response)
+        trace = handle[0]
+        status = {}
+
+        def traced_start_response(status_line, headers, exc_info=None):
+            status['code'] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, list(headers) + [('X-Trace-Id', trace.trace_id)], exc_info)
+
+        try:
+            body = self.wsgi_app(environ, traced_start_response)
+        except BaseException:
+            finish_trace(handle, status=500)
+            raise
+        return _TracedBody(body, lambda: finish_trace(handle, status=status.get('code')))
+
+class _TracedBody:
+    """Response iterable that finishes the trace when the server closes it."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+# --- Sampling profiler -------------------------------------------------------
+
+_profile_lock = threading.Lock()
+
+def _collapse(frame, thread_name):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    names.reverse()
+    return ";".join(names)
+
+def profile(seconds, interval=PROFILE_INTERVAL):
+    """
+    Sample all threads' stacks for `seconds`. Returns (Counter of collapsed
+    stacks, number of sampling rounds). Raises RuntimeError if another
+    profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running.")
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        rounds = 0
+        deadline = time.perf_counter() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    counts[_collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+            rounds += 1
+            time.sleep(interval)
+        return counts, rounds
+    finally:
+        _profile_lock.release()
+
+def collapsed_stacks(counts):
+    """Render profile() counts as collapsed-stack text, one "stack count" line each."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+# Example usage (comment out for production)
+if __name__ == "__main__":
+    def busy():
+        end = time.perf_counter() + 0.3
+        while time.perf_counter() < end:
+            sum(range(1000))
+    handle = start_trace("example")
+    with span("outer", kind="demo"):
+        with span("inner"):
+            time.sleep(0.01)
+    finish_trace(handle, status=200)
+    print(recent_traces(1))
+    worker = threading.Thread(target=busy, name='busy')
+    worker.start()
+    counts, rounds = profile(0.2)
+    print(rounds, "rounds")
+    print(collapsed_stacks(counts)[:500])
+
+    start = time.perf_counter()
+    for _ in range(100000):
+        with span("off"):
+            pass
+    print(f"no-op span: {(time.perf_counter() - start) * 10:.3f} us each")
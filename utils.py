@@ -1,45 +1,259 @@
 # utils.py: Pure Python unified diff applier
+"""
+Unified diff parsing and application on lists of lines.
+
+Hunks are located by their context rather than trusted blindly: each hunk
+is tried at its stated line (shifted by the drift of earlier hunks), then at
+growing offsets up to max_offset in both directions, first with exact
+lines, then ignoring trailing whitespace, then with up to `fuzz` context
+lines dropped from either end (like GNU patch). A hunk whose context can't
+be found fails instead of being spliced in at the wrong place. Output is
+built as a list and joined once per file.
+"""
+
 import re
 
-_hdr_pat = re.compile("^@@ -(\\d+),?(\\d+)? \\+(\\d+),?(\\d+)? @@$")
-_no_eol = "\\ No newline at end of file"
+_hdr_pat = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+MAX_OFFSET = 200  # Lines searched either side of a hunk's stated position
+FUZZ = 2          # Context lines that may be ignored at either end of a hunk
+
+class PatchError(Exception):
+    """A diff could not be parsed or applied; .results holds the per-hunk report."""
+
+    def __init__(self, message, results=None):
+        super().__init__(message)
+        self.results = results or []
+
+class Hunk:
+    __slots__ = ('old_start', 'old_len', 'new_start', 'new_len', 'lines')
+
+    def __init__(self, old_start, old_len, new_start, new_len):
+        self.old_start = old_start
+        self.old_len = old_len
+        self.new_start = new_start
+        self.new_len = new_len
+        self.lines = []  # (tag, text) with tag in ' ', '-', '+'; text keeps its line ending
+
+class FilePatch:
+    __slots__ = ('old_path', 'new_path', 'hunks')
+
+    def __init__(self, old_path=None, new_path=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+
+    @property
+    def path(self):
+        """Path the patch applies to (the new name, unless the file is being deleted)."""
+        return self.old_path if self.new_path in (None, '/dev/null') else self.new_path
+
+def _strip_path(header):
+    path = header[4:].split('\t')[0].strip()
+    if path != '/dev/null' and path[:2] in ('a/', 'b/'):
+        path = path[2:]
+    return path
+
+def parse_patch(patch):
+    """Parse a unified diff (string or iterable of lines) into FilePatch objects."""
+    lines = patch.splitlines(True) if isinstance(patch, str) else list(patch)
+    files = []
+    current = hunk = None
+    pending_old = None
+    for i, raw in enumerate(lines):
+        if raw.startswith('--- ') and _is_file_header(lines, i, hunk):
+            pending_old = _strip_path(raw)
+            hunk = None
+            continue
+        if raw.startswith('+++ ') and pending_old is not None:
+            current = FilePatch(pending_old, _strip_path(raw))
+            files.append(current)
+            pending_old = None
+            continue
+        m = _hdr_pat.match(raw)
+        if m:
+            if current is None:  # Bare hunks without file headers
+                current = FilePatch()
+                files.append(current)
+            old_start, old_len, new_start, new_len = m.groups()
+            hunk = Hunk(int(old_start), 1 if old_len is None else int(old_len),
+                        int(new_start), 1 if new_len is None else int(new_len))
+            current.hunks.append(hunk)
+            continue
+        if hunk is None:
+            continue  # Preamble (e.g. "diff --git", "index ...")
+        if raw.startswith('\\'):
+            if hunk.lines:  # "\ No newline at end of file" applies to the previous line
+                tag, text = hunk.lines[-1]
+                hunk.lines[-1] = (tag, text.rstrip('\r\n'))
+            continue
+        tag = raw[:1]
+        if tag not in (' ', '-', '+') and _hunk_done(hunk):
+            hunk = None  # Past the hunk: the next file's preamble ("diff --git", "index ...")
+            continue
+        if tag in (' ', '-', '+'):
+            text = raw[1:]
+        elif raw.strip() == '':
+            tag, text = ' ', raw  # Blank context line whose leading space was lost
+        else:
+            raise PatchError(f"Cannot process diff line: {raw!r}")
+        if not text.endswith('\n'):
+            text += '\n'  # Diffs pasted without a final newline; "\ No newline" strips it again
+        hunk.lines.append((tag, text))
+    if not any(f.hunks for f in files):
+        raise PatchError("Cannot process diff: no hunks found")
+    return files
 
-def apply_patch(s, patch, revert=False):
+def _is_file_header(lines, i, hunk):
+    # "--- x" is also how a removed line reading "-- x" looks inside a hunk
+    if i + 1 >= len(lines) or not lines[i + 1].startswith('+++ '):
+        return False
+    return hunk is None or _hunk_done(hunk) or (i + 2 < len(lines) and lines[i + 2].startswith('@@'))
+
+def _hunk_done(hunk):
+    """True once a hunk has as many old/new lines as its header promised."""
+    old = sum(1 for tag, _ in hunk.lines if tag != '+')
+    new = sum(1 for tag, _ in hunk.lines if tag != '-')
+    return old >= hunk.old_len and new >= hunk.new_len
+
+def _trimmings(lines, fuzz):
+    """Variants of a hunk with up to fuzz context lines dropped from either end, least trimmed first."""
+    lead = 0
+    while lead < len(lines) and lines[lead][0] == ' ':
+        lead += 1
+    trail = 0
+    while trail < len(lines) - lead and lines[-1 - trail][0] == ' ':
+        trail += 1
+    context = sum(1 for tag, _ in lines if tag == ' ')
+    for level in range(1, fuzz + 1):
+        for front, back in ((level, 0), (0, level), (level, level)):
+            front, back = min(front, lead), min(back, trail)
+            if max(front, back) != level or front + back >= context:
+                continue  # Nothing new to try, or no context left to verify the placement
+            yield level, lines[front:len(lines) - back], front
+
+def _matches(source, pos, old, normalize):
+    if pos < 0 or pos + len(old) > len(source):
+        return False
+    if normalize:
+        return all(source[pos + k].rstrip() == line.rstrip() for k, line in enumerate(old))
+    return source[pos:pos + len(old)] == old
+
+def _locate(source, old, expected, lower, max_offset, normalize):
+    """Nearest position >= lower where old matches, searching outward from expected."""
+    if not old:
+        return expected if lower <= expected <= len(source) else None
+    first = old[0].rstrip() if normalize else old[0]
+    for delta in range(max_offset + 1):
+        for pos in ((expected,) if delta == 0 else (expected - delta, expected + delta)):
+            if pos < lower or pos >= len(source):
+                continue
+            head = source[pos].rstrip() if normalize else source[pos]
+            if head == first and _matches(source, pos, old, normalize):
+                return pos
+    return None
+
+def apply_hunks(source, hunks, revert=False, max_offset=MAX_OFFSET, fuzz=FUZZ, path=None):
+    """
+    Apply hunks to a list of lines. Returns (new_lines, results), one result dict
+    per hunk: status ('applied'/'failed'), line, offset, fuzz level and whether
+    trailing whitespace had to be ignored.
+    """
+    add = '-' if revert else '+'
+    out = []
+    results = []
+    cursor = 0  # Source lines before this index are already emitted
+    drift = 0   # Offset at which the previous hunk was found
+    for index, hunk in enumerate(hunks):
+        start = hunk.new_start if revert else hunk.old_start
+        length = hunk.new_len if revert else hunk.old_len
+        expected = start - 1 + (length == 0) + drift
+        placed = None
+        variants = [(0, hunk.lines, 0)] + list(_trimmings(hunk.lines, fuzz))
+        for level, lines, trimmed in variants:
+            old = [text for tag, text in lines if tag != add]
+            for normalize in (False, True):
+                pos = _locate(source, old, expected + trimmed, cursor, max_offset, normalize)
+                if pos is not None:
+                    placed = (pos, lines, old, level, normalize, pos - trimmed - (start - 1 + (length == 0)))
+                    break
+            if placed:
+                break
+        result = {'file': path, 'hunk': index, 'status': 'failed', 'line': start, 'offset': None, 'fuzz': None,
+                  'whitespace': False}
+        results.append(result)
+        if placed is None:
+            continue
+        pos, lines, old, level, normalize, offset = placed
+        out.extend(source[cursor:pos])
+        k = pos
+        for tag, text in lines:
+            if tag == add:
+                out.append(text)
+            else:
+                if tag == ' ':
+                    out.append(source[k])  # Keep the file's own context (matters when normalized)
+                k += 1
+        cursor = pos + len(old)
+        drift = offset
+        result.update(status='applied', line=pos + 1, offset=offset, fuzz=level, whitespace=normalize)
+    out.extend(source[cursor:])
+    return out, results
+
+def apply_patch_files(files, patch, revert=False, max_offset=MAX_OFFSET, fuzz=FUZZ):
+    """
+    Apply a (possibly multi-file) diff to {path: text}. New files may be absent from
+    files; deleted files map to None. Returns (updated {path: text}, results).
+    Raises PatchError (with .results) if any hunk fails, leaving files untouched.
+    """
+    updated = {}
+    results = []
+    for file_patch in parse_patch(patch):
+        path = file_patch.path
+        creating = (file_patch.new_path if revert else file_patch.old_path) == '/dev/null'
+        text = updated.get(path, files.get(path))
+        if text is None and not creating:
+            raise PatchError(f"File not found for patch: {path}", results)
+        lines, file_results = apply_hunks((text or '').splitlines(True), file_patch.hunks, revert, max_offset, fuzz, path)
+        results.extend(file_results)
+        deleting = (file_patch.old_path if revert else file_patch.new_path) == '/dev/null'
+        updated[path] = None if deleting else ''.join(lines)
+    failed = [r for r in results if r['status'] != 'applied']
+    if failed:
+        where = ", ".join(f"{r['file'] or '<input>'} hunk {r['hunk'] + 1} (line {r['line']})" for r in failed)
+        raise PatchError(f"Cannot apply diff: context not found for {where}", results)
+    return updated, results
+
+def apply_patch(s, patch, revert=False, max_offset=MAX_OFFSET, fuzz=FUZZ):
     """
     Apply unified diff patch to string s to recover newer string.
     If revert is True, treat s as the newer string, recover older string.
     """
-    s = s.splitlines(True)
-    p = patch.splitlines(True)
-    t = ''
-    i = sl = 0
-    (midx, sign) = (1, '+') if not revert else (3, '-')
-    while i < len(p) and p[i].startswith(("---", "+++")): 
-        i += 1  # skip header lines
-    while i < len(p):
-        m = _hdr_pat.match(p[i])
-        if not m: 
-            raise Exception("Cannot process diff")
-        i += 1
-        l = int(m.group(midx)) - 1 + (m.group(midx + 1) == '0')
-        t += ''.join(s[sl:l])
-        sl = l
-        while i < len(p) and p[i][0] != '@':
-            if i + 1 < len(p) and p[i + 1][0] == '\\': 
-                line = p[i][:-1]; 
-                i += 2
-            else: 
-                line = p[i]; 
-                i += 1
-            if len(line) > 0:
-                if line[0] == sign or line[0] == ' ': 
-                    t += line[1:]
-                sl += (line[0] != sign)
-    t += ''.join(s[sl:])
-    return t
+    file_patches = parse_patch(patch)
+    if len(file_patches) > 1:
+        raise PatchError("Diff touches several files; use apply_patch_files().")
+    lines, results = apply_hunks(s.splitlines(True), file_patches[0].hunks, revert, max_offset, fuzz)
+    failed = [r for r in results if r['status'] != 'applied']
+    if failed:
+        where = ", ".join(f"hunk {r['hunk'] + 1} (line {r['line']})" for r in failed)
+        raise PatchError(f"Cannot apply diff: context not found for {where}", results)
+    return ''.join(lines)
 
 # Test (comment out for production)
 if __name__ == "__main__":
+    import time
     original = "line1\nline2\nline3\n"
     patch = "--- original\n+++ modified\n@@ -1,3 +1,3 @@\n line1\n-line2\n+new line2\n line3\n"
-    print(apply_patch(original, patch))
\ No newline at end of file
+    print(apply_patch(original, patch))
+    print(apply_patch(apply_patch(original, patch), patch, revert=True) == original)
+
+    # Throughput: 10k-line file, 100 one-line hunks whose line numbers drift by 7
+    source = "".join(f"value_{i} = {i}\n" for i in range(10000))
+    hunks = "".join(f"@@ -{i + 1 - 7},3 +{i + 1 - 7},3 @@\n value_{i} = {i}\n-value_{i + 1} = {i + 1}\n+value_{i + 1} = -{i + 1}\n value_{i + 2} = {i + 2}\n"
+                    for i in range(50, 10000, 100))
+    big_patch = "--- a/big.py\n+++ b/big.py\n" + hunks
+    start = time.perf_counter()
+    for _ in range(20):
+        result = apply_patch(source, big_patch)
+    elapsed = (time.perf_counter() - start) / 20
+    print(f"10k lines, 100 drifted hunks: {elapsed * 1000:.2f} ms per apply ({10000 / elapsed / 1e6:.1f}M lines/s)")